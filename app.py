@@ -26,6 +26,7 @@ class MultiWorkFiles(sgtk.platform.Application):
         """
         self._tk_multi_workfiles = self.import_module("tk_multi_workfiles")
         self.__is_pyside_unstable = None
+        self._cache_warmer = None
 
         if not self.engine.has_ui:
             self.logger.debug("The engine reports that there is no UI. Workfiles2 will not continue initializing.")
@@ -76,6 +77,11 @@ class MultiWorkFiles(sgtk.platform.Application):
             }
         )
 
+        # optionally pre-warm the caches used by the dialogs in the background:
+        if self.get_setting("prewarm_search_cache"):
+            self._cache_warmer = self._tk_multi_workfiles.CacheWarmer()
+            self._cache_warmer.start()
+
         # Process auto startup options - but only on certain supported platforms
         # because of the way QT inits and connects to different host applications
         # differently, in conjunction with the 'boot' process in different tools,
@@ -106,6 +112,14 @@ class MultiWorkFiles(sgtk.platform.Application):
         Clean up app
         """
         self.log_debug("Destroying tk-multi-workfiles2")
+        if self._cache_warmer:
+            self._cache_warmer.shut_down()
+            self._cache_warmer = None
+        # release the files cached for the dialogs:
+        self._tk_multi_workfiles.release_shared_search_cache()
+        self._tk_multi_workfiles.release_path_cache_sync_scheduler()
+        # stop any processes started to extract template fields:
+        self._tk_multi_workfiles.release_process_pool()
 
     def show_file_open_dlg(self):
         """
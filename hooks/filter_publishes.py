@@ -31,6 +31,9 @@ class FilterPublishes(HookClass):
                                  "sg_publish" : {Shotgun entity dictionary for a Published File entity}
                              }
 
+                             The Shotgun entity dictionaries are copies that can be modified
+                             freely when this hook is overridden.
+
 
         :returns:            The filtered list of dictionaries of the same form as the input 'publishes'
                              list
@@ -75,6 +75,38 @@ class GetBadge(HookClass):
         # the default implementation always returns None.
         return None
 
+    def get_publish_badges(self, publishes, **kwargs):
+        """
+        Generate badges for a list of publishes.  This is called once for a batch of publishes
+        rather than calling get_publish_badge for each one.  Overriding this method allows badges
+        to be computed more efficiently, e.g. by performing a single query for all publishes.
+
+        :param list publishes: A list of dictionaries, one for each publish, containing the
+            publish_details and publish_path keyword arguments accepted by get_publish_badge.
+
+        :returns: A list containing a QPixmap, QColor or None for each publish, in the same order
+            as the publishes list.
+        """
+        # the default implementation calls get_publish_badge for each publish.
+        return [self.get_publish_badge(**publish) for publish in publishes]
+
+    def get_work_file_badges(self, work_files, **kwargs):
+        """
+        Generate badges for a list of work files.  This is called once for a batch of work files
+        rather than calling get_work_file_badge for each one.  Overriding this method allows
+        badges to be computed more efficiently, e.g. by performing a single query for all work
+        files.
+
+        :param list work_files: A list of dictionaries, one for each work file, containing the
+            work_file_details and work_file_path keyword arguments accepted by
+            get_work_file_badge.
+
+        :returns: A list containing a QPixmap, QColor or None for each work file, in the same
+            order as the work_files list.
+        """
+        # the default implementation calls get_work_file_badge for each work file.
+        return [self.get_work_file_badge(**work_file) for work_file in work_files]
+
     def generate_badge_pixmap(self, badge_color):
         """
         Generate a badge QPixmap from a QColor. This hook method is used to generate a badge image
@@ -9,5 +9,9 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 from .work_files import WorkFiles
+from .file_search_cache import release_shared_search_cache
+from .cache_warmer import CacheWarmer
+from .path_cache_sync import release_path_cache_sync_scheduler
+from .template_fields import release_process_pool
 # Leaving this in to make it easier to test the dialogs through scripting.
 from .file_open_form import FileOpenForm
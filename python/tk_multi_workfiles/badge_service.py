@@ -0,0 +1,205 @@
+# Copyright (c) 2019 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Service that generates badges for FileItems in batches on the main thread.
+"""
+import weakref
+
+import sgtk
+from sgtk.platform.qt import QtGui
+
+from .util import Threaded
+
+
+class BadgeService(Threaded):
+    """
+    Collects FileItems that need a badge and generates the badges for them in batches using the
+    get_work_file_badges and get_publish_badges hook methods.  Badges are generated in the main
+    thread as they are QPixmaps.  Only weak references to the FileItems are held so that items
+    that are discarded before their badge is generated are skipped.
+    """
+    # maximum number of badges generated in a single main thread call:
+    _MAX_BATCH_SIZE = 500
+
+    def __init__(self):
+        """
+        Construction
+        """
+        Threaded.__init__(self)
+        # list of (weakref to FileItem, use publish details):
+        self._pending = []
+        self._flush_scheduled = False
+        # badge pixmaps generated from colors, {rgba:QPixmap}:
+        self._color_pixmaps = {}
+
+    def request(self, file_item, from_publish=False):
+        """
+        Request a badge for the specified file item.  The badge will be set on the item once it
+        has been generated.
+
+        :param file_item:       The FileItem to generate a badge for
+        :param from_publish:    If True then the badge is generated from the publish details
+                                of the item, even if it is also a work file
+        """
+        if self._add_pending(file_item, from_publish):
+            sgtk.platform.current_engine().async_execute_in_main_thread(self._flush)
+
+    @Threaded.exclusive
+    def _add_pending(self, file_item, from_publish):
+        """
+        :param file_item:       The FileItem to generate a badge for
+        :param from_publish:    True if the badge should be generated from the publish details
+        :returns:               True if a flush needs to be scheduled, otherwise False
+        """
+        self._pending.append((weakref.ref(file_item), from_publish))
+        if self._flush_scheduled:
+            return False
+        self._flush_scheduled = True
+        return True
+
+    @Threaded.exclusive
+    def _take_pending(self):
+        """
+        :returns:   Tuple (list of pending requests to process now, True if more requests remain)
+        """
+        batch = self._pending[:BadgeService._MAX_BATCH_SIZE]
+        self._pending = self._pending[BadgeService._MAX_BATCH_SIZE:]
+        self._flush_scheduled = bool(self._pending)
+        return (batch, self._flush_scheduled)
+
+    def _flush(self):
+        """
+        Generate badges for the next batch of pending file items.  Runs in the main thread.
+        """
+        batch, more_pending = self._take_pending()
+        if more_pending:
+            # let the event loop process other events before the next batch:
+            sgtk.platform.current_engine().async_execute_in_main_thread(self._flush)
+
+        # resolve the items that still exist, removing any duplicates - the most
+        # recent request for an item wins:
+        work_file_items = []
+        publish_items = []
+        seen = set()
+        for item_ref, from_publish in reversed(batch):
+            file_item = item_ref()
+            if not file_item or id(file_item) in seen:
+                continue
+            seen.add(id(file_item))
+            if file_item.is_local and not from_publish:
+                work_file_items.append(file_item)
+            elif file_item.is_published:
+                publish_items.append(file_item)
+            else:
+                file_item.badge = None
+
+        if work_file_items:
+            badges = self._get_badges(
+                work_file_items, "get_work_file_badges", "get_work_file_badge",
+                lambda f: {"work_file_details":f._details, "work_file_path":f.path}
+            )
+            self._apply_badges(work_file_items, badges)
+
+        if publish_items:
+            badges = self._get_badges(
+                publish_items, "get_publish_badges", "get_publish_badge",
+                lambda f: {"publish_details":f._publish_details, "publish_path":f.publish_path}
+            )
+            self._apply_badges(publish_items, badges)
+
+    def _get_badges(self, file_items, bulk_method, single_method, build_args):
+        """
+        Get the badges for a list of file items using the bulk hook method, falling back to
+        calling the single item hook method for each item if that fails.
+
+        :param file_items:      The list of FileItems to get badges for
+        :param bulk_method:     The name of the bulk hook method
+        :param single_method:   The name of the single item hook method
+        :param build_args:      Function that returns the single item hook method kwargs for a FileItem
+        :returns:               A list of badges, one for each file item
+        """
+        app = sgtk.platform.current_bundle()
+        all_args = [build_args(f) for f in file_items]
+        hook_kwargs = {"work_files" if bulk_method == "get_work_file_badges" else "publishes": all_args}
+        try:
+            badges = app.execute_hook_method("hook_get_badge", bulk_method, **hook_kwargs)
+            if isinstance(badges, list) and len(badges) == len(file_items):
+                return badges
+            app.logger.warning(
+                "%s returned an unexpected result - falling back to %s" % (bulk_method, single_method)
+            )
+        except Exception:
+            # the hook may pre-date the bulk method so fall back to the single item method:
+            app.logger.debug(
+                "Exception raised in hook while executing %s - falling back to %s"
+                % (bulk_method, single_method), exc_info=True
+            )
+
+        badges = []
+        for args in all_args:
+            badge = None
+            try:
+                badge = app.execute_hook_method("hook_get_badge", single_method, **args)
+            except Exception:
+                # Capture exceptions raised here and log them, so as not to break
+                # the app if the hook fails.
+                app.logger.warning(
+                    "Exception raised when getting badge for %s"
+                    % (args.get("work_file_path") or args.get("publish_path")),
+                    exc_info=True
+                )
+            badges.append(badge)
+        return badges
+
+    def _apply_badges(self, file_items, badges):
+        """
+        Set the badges on the file items, converting any QColors to pixmaps.
+
+        :param file_items:  The list of FileItems to set the badges on
+        :param badges:      The list of badges, one for each file item
+        """
+        for file_item, badge in zip(file_items, badges):
+            if isinstance(badge, QtGui.QColor):
+                badge = self.get_color_pixmap(badge)
+            file_item.badge = badge
+
+    def get_color_pixmap(self, color):
+        """
+        Get the badge pixmap for a color.  Pixmaps are cached so that all badges with the same
+        color share a single pixmap.  Must be called from the main thread.
+
+        :param color:   The QColor to get the badge pixmap for
+        :returns:       The QPixmap for the color or None if it couldn't be generated
+        """
+        rgba = color.rgba()
+        if rgba in self._color_pixmaps:
+            return self._color_pixmaps[rgba]
+
+        app = sgtk.platform.current_bundle()
+        pixmap = None
+        try:
+            pixmap = app.execute_hook_method(
+                "hook_get_badge",
+                "generate_badge_pixmap",
+                badge_color=color
+            )
+        except Exception:
+            # Capture exceptions raised here and log them, so as not to break
+            # the app if the hook fails.
+            app.logger.warning(
+                "Exception raised in hook while executing generate_badge_pixmap.",
+                exc_info=True
+            )
+        self._color_pixmaps[rgba] = pixmap
+        return pixmap
+
+
+g_badge_service = BadgeService()
@@ -210,6 +210,7 @@ class BrowserForm(QtGui.QWidget):
                 parent=self
             )
             self._my_tasks_form.entity_selected.connect(self._on_entity_selected)
+            self._my_tasks_form.tasks_visible.connect(self._on_tasks_visible)
             self._ui.task_browser_tabs.addTab(self._my_tasks_form, "My Tasks")
             self._my_tasks_form.create_new_task.connect(self.create_new_task)
 
@@ -234,6 +235,7 @@ class BrowserForm(QtGui.QWidget):
                 step_entity_filter=step_entity_filter
             )
             entity_form.entity_selected.connect(self._on_entity_selected)
+            entity_form.tasks_visible.connect(self._on_tasks_visible)
             self._ui.task_browser_tabs.addTab(entity_form, caption)
             entity_form.create_new_task.connect(self.create_new_task)
             self._entity_tree_forms.append(entity_form)
@@ -543,6 +545,16 @@ class BrowserForm(QtGui.QWidget):
 
         return primary_entity
 
+    def _on_tasks_visible(self, tasks):
+        """
+        Called when Tasks become visible in the My Tasks tab or one of the entity tabs so that
+        their files can be prefetched.
+
+        :param tasks: List of Task entity dictionaries, most visible first.
+        """
+        if self._file_model:
+            self._file_model.prefetch_entities(tasks)
+
     def _on_uses_user_sandboxes(self, work_area):
         """
         Called when the file finder reports a work area that uses sandboxes.
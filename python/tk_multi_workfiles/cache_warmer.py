@@ -0,0 +1,219 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Pre-warms the caches used by the File Open and File Save dialogs by searching for the files of the
+current context, and optionally of the current user's tasks, in the background soon after the app
+has been initialised.
+"""
+import sgtk
+from sgtk.platform.qt import QtCore
+
+task_manager = sgtk.platform.import_framework("tk-framework-shotgunutils", "task_manager")
+BackgroundTaskManager = task_manager.BackgroundTaskManager
+
+from .file_finder import AsyncFileFinder
+from .file_search_cache import get_shared_search_cache
+from .search_result_collector import SearchResultCollector
+from .task_limiter import release_task_limiter
+from .user_cache import g_user_cache
+from .util import resolve_filters
+
+
+class CacheWarmer(QtCore.QObject):
+    """
+    Runs low priority searches for the files of the current context and the current user's tasks
+    using a small background task manager of its own.  The searches fill the user cache, the
+    publish store and work file index (if enabled) and the shared search cache (if enabled) so
+    that the first dialog opened in a session is populated straight away.
+    """
+    # delay in milliseconds before pre-warming starts so that the engine can finish starting:
+    _START_DELAY = 5000
+    # only a couple of threads are used so that pre-warming doesn't compete with the DCC:
+    _MAX_THREADS = 2
+
+    def __init__(self, parent=None):
+        """
+        Construction
+
+        :param parent:  The parent QObject for this instance
+        """
+        QtCore.QObject.__init__(self, parent)
+
+        self._app = sgtk.platform.current_bundle()
+        self._bg_task_manager = None
+        self._finder = None
+        self._collector = None
+        self._search_cache = None
+        self._is_shut_down = False
+        self._my_tasks_task_id = None
+        # {search_id:entity}:
+        self._searches = {}
+
+    def start(self):
+        """
+        Start pre-warming the caches after a short delay.
+        """
+        QtCore.QTimer.singleShot(CacheWarmer._START_DELAY, self._start)
+
+    def shut_down(self):
+        """
+        Stop any searches that are still running and release the background threads.
+        """
+        self._is_shut_down = True
+        if self._finder:
+            self._collector.search_completed.disconnect(self._on_search_completed)
+            self._collector.search_failed.disconnect(self._on_search_failed)
+            self._collector.shut_down()
+            self._collector = None
+            self._finder.stop_all_searches()
+            self._finder.shut_down()
+            self._finder = None
+        if self._bg_task_manager:
+            self._bg_task_manager.task_completed.disconnect(self._on_task_completed)
+            self._bg_task_manager.task_failed.disconnect(self._on_task_failed)
+            release_task_limiter(self._bg_task_manager)
+            self._bg_task_manager.shut_down()
+            self._bg_task_manager = None
+        self._searches = {}
+
+    def _start(self):
+        """
+        Start the searches for the current context and query the current user's tasks.
+        """
+        if self._is_shut_down:
+            return
+
+        user = g_user_cache.current_user
+        ctx = self._app.context
+        entity = ctx.task or ctx.entity or ctx.project
+        num_my_tasks = self._app.get_setting("prewarm_my_tasks", 0)
+        if not self._app.get_setting("show_my_tasks", True) or not user or not ctx.project:
+            num_my_tasks = 0
+        if not entity and not num_my_tasks:
+            return
+
+        self._app.log_debug("Pre-warming caches for %s..." % (entity or "My Tasks"))
+        self._search_cache = get_shared_search_cache()
+
+        self._bg_task_manager = BackgroundTaskManager(self, max_threads=CacheWarmer._MAX_THREADS)
+        self._bg_task_manager.task_completed.connect(self._on_task_completed)
+        self._bg_task_manager.task_failed.connect(self._on_task_failed)
+        self._bg_task_manager.start_processing()
+
+        # searches run in the warmer's own task manager so mustn't be coalesced with the dialogs' searches:
+        self._finder = AsyncFileFinder(self._bg_task_manager, self, coalesce=False)
+        self._collector = SearchResultCollector(self._finder, self._search_cache, self)
+        self._collector.search_completed.connect(self._on_search_completed)
+        self._collector.search_failed.connect(self._on_search_failed)
+
+        if entity:
+            self._begin_searches([entity])
+
+        if num_my_tasks:
+            # filters are resolved in the main thread as they use the current context:
+            filters = [["project", "is", ctx.project]]
+            filters.extend(resolve_filters(self._app.get_setting("my_tasks_filters")))
+            self._my_tasks_task_id = self._bg_task_manager.add_task(
+                self._task_find_my_tasks,
+                task_kwargs={"filters":filters, "limit":num_my_tasks}
+            )
+
+    def _begin_searches(self, entities):
+        """
+        Begin searches for the files of the specified entities in the current user's sandbox.
+
+        :param entities:    The list of entities to search for
+        """
+        search_ids = self._finder.begin_searches(entities, [g_user_cache.current_user])
+        for search_id, entity in zip(search_ids, entities):
+            self._searches[search_id] = entity
+            self._collector.add_search(search_id)
+
+    def _task_find_my_tasks(self, filters, limit, **kwargs):
+        """
+        Find the current user's most recently updated tasks.
+
+        :param filters: The Shotgun filters to find the tasks with
+        :param limit:   The maximum number of tasks to find
+        :returns:       Dictionary containing the list of tasks found
+        """
+        sg_tasks = self._app.shotgun.find("Task", filters, ["content"],
+                                          order=[{"field_name":"updated_at", "direction":"desc"}],
+                                          limit=limit)
+        return {"tasks":sg_tasks}
+
+    def _on_task_completed(self, task_id, group, result):
+        """
+        Slot triggered when a background task has completed.
+
+        :param task_id: The id of the task that completed
+        :param group:   The group the task belongs to
+        :param result:  The result of the task
+        """
+        if task_id != self._my_tasks_task_id:
+            return
+        self._my_tasks_task_id = None
+
+        ctx_task = self._app.context.task
+        sg_tasks = [t for t in result.get("tasks", [])
+                    if not ctx_task or t["id"] != ctx_task["id"]]
+        if sg_tasks:
+            self._begin_searches([{"type":t["type"], "id":t["id"], "content":t.get("content")}
+                                  for t in sg_tasks])
+        else:
+            self._finish_if_done()
+
+    def _on_task_failed(self, task_id, group, msg, stack_trace):
+        """
+        Slot triggered when a background task has failed.
+
+        :param task_id:     The id of the task that failed
+        :param group:       The group the task belongs to
+        :param msg:         The error message
+        :param stack_trace: The stack trace of the error
+        """
+        if task_id != self._my_tasks_task_id:
+            return
+        self._my_tasks_task_id = None
+        self._app.log_debug("Failed to find tasks to pre-warm caches for: %s" % msg)
+        self._finish_if_done()
+
+    def _on_search_completed(self, search_id, num_added):
+        """
+        Slot triggered when a search has completed and the work files and publishes found have
+        been added to the shared search cache, unless a dialog had already added them.
+
+        :param search_id:   The id of the search that has completed
+        :param num_added:   The number of cache entries that were added
+        """
+        entity = self._searches.pop(search_id, None)
+        self._app.log_debug("Pre-warmed caches for %s" % entity)
+        self._finish_if_done()
+
+    def _on_search_failed(self, search_id, error_msg):
+        """
+        Slot triggered when a search has failed.
+
+        :param search_id:   The id of the search that failed
+        :param error_msg:   The error message
+        """
+        entity = self._searches.pop(search_id, None)
+        self._app.log_debug("Failed to pre-warm caches for %s: %s" % (entity, error_msg))
+        self._finish_if_done()
+
+    def _finish_if_done(self):
+        """
+        Release the background threads once all searches have finished.
+        """
+        if not self._searches and self._my_tasks_task_id is None:
+            # shut down once control returns to the event loop as this may be called from a
+            # slot connected to the task manager:
+            QtCore.QTimer.singleShot(0, self.shut_down)
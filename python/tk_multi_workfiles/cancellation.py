@@ -0,0 +1,113 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Cooperative cancellation of background tasks.  A task that may run for a long time checks a
+cancellation token between units of work so that it stops soon after the search it is running
+for has been stopped rather than holding on to its thread until it completes.
+"""
+import time
+
+from sgtk import TankError
+
+from .util import Threaded
+
+
+class CancelledError(TankError):
+    """
+    Raised in a background task when the token it was given has been cancelled.
+    """
+
+
+class _CancelLatencyStats(Threaded):
+    """
+    Thread-safe record of how long tasks took to notice that they had been cancelled.
+    """
+    def __init__(self):
+        """
+        Construction
+        """
+        Threaded.__init__(self)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    @Threaded.exclusive
+    def add(self, latency):
+        """
+        :param latency: The time in seconds between a token being cancelled and a task noticing
+        """
+        self._count += 1
+        self._total += latency
+        self._max = max(self._max, latency)
+
+    @Threaded.exclusive
+    def get(self):
+        """
+        :returns:   Dictionary containing the number of cancellations noticed by tasks and the
+                    mean and maximum latency in seconds
+        """
+        return {"count":self._count, "mean_latency":self._total / self._count if self._count else 0.0,
+                "max_latency":self._max}
+
+
+_g_cancel_latency_stats = _CancelLatencyStats()
+
+
+class CancellationToken(object):
+    """
+    Token shared by all tasks run for a search.  It is cancelled in the main thread when the
+    search is stopped and checked by the tasks in background threads.
+    """
+    def __init__(self):
+        """
+        Construction
+        """
+        self._cancel_time = None
+        self._latency_recorded = False
+
+    @property
+    def is_cancelled(self):
+        """
+        :returns:   True if the token has been cancelled
+        """
+        return self._cancel_time is not None
+
+    def cancel(self):
+        """
+        Cancel the token.  Tasks checking it will raise a CancelledError the next time they do.
+        """
+        if self._cancel_time is None:
+            self._cancel_time = time.time()
+
+    def check(self):
+        """
+        Check the token, recording how long it took to notice the first time a cancellation is
+        noticed.
+
+        :raises CancelledError: If the token has been cancelled
+        """
+        if self._cancel_time is None:
+            return
+        if not self._latency_recorded:
+            # benign race - at worst the latency is recorded once by each task that notices:
+            self._latency_recorded = True
+            _g_cancel_latency_stats.add(time.time() - self._cancel_time)
+        raise CancelledError("Search was cancelled")
+
+
+def get_cancel_latency_stats():
+    """
+    Get statistics describing how quickly background tasks stop once their search is stopped.
+
+    :returns:   Dictionary containing the number of cancellations noticed by tasks and the mean
+                and maximum latency in seconds
+    """
+    return _g_cancel_latency_stats.get()
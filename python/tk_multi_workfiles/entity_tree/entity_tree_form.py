@@ -51,6 +51,14 @@ class EntityTreeForm(QtGui.QWidget):
     # Signal emitted when the 'New Task' button is clicked.
     create_new_task = QtCore.Signal(object, object)# entity, step
 
+    # Signal emitted, if prefetching is enabled, when Tasks become visible in the tree either
+    # because the tree has been scrolled or refreshed or because their parent has been expanded.
+    tasks_visible = QtCore.Signal(object)# list of Task entity dictionaries
+
+    # delay in milliseconds after the visible rows change before tasks_visible is emitted so that
+    # scrolling through the tree doesn't emit it for every row:
+    _TASKS_VISIBLE_DELAY = 250
+
     def __init__(self, entity_model, search_label, allow_task_creation, extra_fields, parent, step_entity_filter=None):
         """
         Instantiate a new `EntityTreeForm`.
@@ -125,6 +133,18 @@ class EntityTreeForm(QtGui.QWidget):
         self._ui.entity_tree.expanded.connect(self._on_item_expanded)
         self._ui.entity_tree.collapsed.connect(self._on_item_collapsed)
 
+        # if prefetching is enabled, the Tasks visible in the tree are reported once the visible
+        # rows stop changing:
+        self._tasks_visible_timer = None
+        # Tasks under items expanded since tasks_visible was last emitted:
+        self._expanded_tasks = []
+        if app.get_setting("prefetch_visible_tasks", 0) > 0:
+            self._tasks_visible_timer = QtCore.QTimer(self)
+            self._tasks_visible_timer.setSingleShot(True)
+            self._tasks_visible_timer.setInterval(EntityTreeForm._TASKS_VISIBLE_DELAY)
+            self._tasks_visible_timer.timeout.connect(self._emit_tasks_visible)
+            self._ui.entity_tree.verticalScrollBar().valueChanged.connect(self._on_visible_rows_changed)
+
         self._is_resetting_model = False
 
         if entity_model:
@@ -221,6 +241,14 @@ class EntityTreeForm(QtGui.QWidget):
         """
         signals_blocked = self.blockSignals(True)
         try:
+            # stop reporting visible Tasks:
+            if self._tasks_visible_timer:
+                self._tasks_visible_timer.stop()
+                self._tasks_visible_timer.timeout.disconnect(self._emit_tasks_visible)
+                self._ui.entity_tree.verticalScrollBar().valueChanged.disconnect(self._on_visible_rows_changed)
+                self._tasks_visible_timer = None
+            self._expanded_tasks = []
+
             # clear any references:
             self._entity_to_select = None
             self._expanded_item_values = []
@@ -631,6 +659,7 @@ class EntityTreeForm(QtGui.QWidget):
         # expand any new root rows:
         self._expand_root_rows()
         self._fix_expanded_rows()
+        self._on_visible_rows_changed()
         # try to select the current entity from the new items in the model:
         prev_selected_item = self._reset_selection()
         self._update_selection(prev_selected_item, True)
@@ -732,6 +761,12 @@ class EntityTreeForm(QtGui.QWidget):
             item.model().get_item_field_value_path(item)
         )
 
+        if self._tasks_visible_timer:
+            # the Tasks under the expanded item are likely to be selected next even if they
+            # aren't visible yet:
+            self._expanded_tasks.extend(self._get_child_tasks(idx))
+            self._on_visible_rows_changed()
+
     def _on_item_collapsed(self, idx):
         """
         Slot triggered when an item in the tree is collapsed - used to track expanded
@@ -746,6 +781,79 @@ class EntityTreeForm(QtGui.QWidget):
         if path in self._expanded_item_values:
             self._expanded_item_values.remove(path)
 
+    def showEvent(self, event):
+        """
+        Overriden base class method called when the widget is shown, e.g. when its tab is
+        selected.
+
+        :param event:   The QShowEvent
+        """
+        QtGui.QWidget.showEvent(self, event)
+        self._on_visible_rows_changed()
+
+    def _on_visible_rows_changed(self):
+        """
+        (Re)start the timer to emit the tasks_visible signal if prefetching is enabled.
+        """
+        if self._tasks_visible_timer:
+            self._tasks_visible_timer.start()
+
+    def _emit_tasks_visible(self):
+        """
+        Emit the tasks_visible signal for the Tasks in the rows currently visible in the tree,
+        followed by those under any items expanded since the signal was last emitted.
+        """
+        expanded_tasks = self._expanded_tasks
+        self._expanded_tasks = []
+        if not self.isVisible():
+            # the tab containing the tree isn't selected:
+            return
+
+        view = self._ui.entity_tree
+        entity_model = get_source_model(view.model())
+        if not entity_model:
+            return
+
+        tasks = []
+        viewport_rect = view.viewport().rect()
+        idx = view.indexAt(viewport_rect.topLeft())
+        while idx.isValid() and view.visualRect(idx).top() <= viewport_rect.bottom():
+            item = self._item_from_index(idx)
+            entity = entity_model.get_entity(item) if item else None
+            if entity and entity["type"] == "Task":
+                tasks.append(entity)
+            idx = view.indexBelow(idx)
+
+        tasks.extend(expanded_tasks)
+        if tasks:
+            self.tasks_visible.emit(tasks)
+
+    def _get_child_tasks(self, idx):
+        """
+        Get the Tasks that are children of an item, or grandchildren under a Step, without loading
+        any children that haven't been loaded yet.
+
+        :param idx: The index of the item in the tree
+        :returns:   A list of Task entity dictionaries
+        """
+        view_model = self._ui.entity_tree.model()
+        entity_model = get_source_model(view_model)
+        tasks = []
+        pending = [idx]
+        while pending:
+            parent_idx = pending.pop(0)
+            for row in range(view_model.rowCount(parent_idx)):
+                child_idx = view_model.index(row, 0, parent_idx)
+                child_item = self._item_from_index(child_idx)
+                child_entity = entity_model.get_entity(child_item) if child_item else None
+                if not child_entity:
+                    continue
+                if child_entity["type"] == "Task":
+                    tasks.append(child_entity)
+                elif child_entity["type"] == "Step" and parent_idx == idx:
+                    pending.append(child_idx)
+        return tasks
+
     def _on_new_task(self):
         """
         Slot triggered when the new task button is clicked.  Extracts the necessary
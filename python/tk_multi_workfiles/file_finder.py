@@ -10,15 +10,15 @@
 
 import os
 from datetime import datetime
-import copy
 import time
+import itertools
 
 import sgtk
 from sgtk.platform.qt import QtCore
 from tank_vendor.shotgun_api3 import sg_timezone
 from sgtk import TankError
 
-from .file_item import FileItem
+from .file_item import FileItem, FileKeyBuilder, pack_file_details
 from .user_cache import g_user_cache
 
 from .sg_published_files_model import SgPublishedFilesModel
@@ -27,7 +27,13 @@ task_manager = sgtk.platform.import_framework("tk-framework-shotgunutils", "task
 BackgroundTaskManager = task_manager.BackgroundTaskManager
 
 from .work_area import WorkArea
-from .util import monitor_qobject_lifetime, Threaded
+from .template_walker import TemplateWalker
+from .template_fields import get_field_extractor
+from .work_file_index import get_work_file_index, build_index_signature
+from .publish_store import get_publish_store
+from .task_limiter import TaskLimiter, get_task_limiter
+from .cancellation import CancellationToken, get_cancel_latency_stats
+from .util import monitor_qobject_lifetime, Threaded, freeze_value, thaw_value
 
 
 class FileFinder(QtCore.QObject):
@@ -45,16 +51,22 @@ class FileFinder(QtCore.QObject):
             self._name_map = {}
 
         @Threaded.exclusive
-        def get_name(self, file_key, path, template, fields=None):
+        def get_name(self, file_key, path, template, fields=None, key_builder=None):
             """
-            Thread safe method to get the unique name for the specified file key
+            Thread safe method to get the unique name for the specified file key.  If a key
+            builder is specified then names are also memoized on it so that they don't need
+            to be generated again by subsequent searches.
             """
             name = None
             if file_key in self._name_map:
                 name = self._name_map.get(file_key)
             else:
-                # generate the name:
-                name = self._generate_name(path, template, fields)
+                name = key_builder.get_name(file_key) if key_builder else None
+                if name is None:
+                    # generate the name:
+                    name = self._generate_name(path, template, fields)
+                    if key_builder:
+                        name = key_builder.set_name(file_key, name)
                 # and add it to the map:
                 self._name_map[file_key] = name
             return name
@@ -124,12 +136,24 @@ class FileFinder(QtCore.QObject):
             
             return name    
 
+    # keys in the work file and publish dictionaries that aren't copied to the FileItem details:
+    _INTERNAL_KEYS = ("path", "mtime", "uid", "fields")
+
+    # the filter_publishes hook that ships with the app, which returns the publishes unchanged:
+    _DEFAULT_FILTER_PUBLISHES_HOOK = "{self}/filter_publishes.py"
+
+    # the fields queried for each publish:
+    _PUBLISH_FIELDS = ["id", "description", "version_number", "image", "created_at", "created_by", "name",
+                       "path", "task"]
+
     def __init__(self, parent=None):
         """
         Construction
         """
         QtCore.QObject.__init__(self, parent)
         self._app = sgtk.platform.current_bundle()
+        self._use_template_walker = self._app.get_setting("use_template_walker", False)
+        self._field_extraction_processes = self._app.get_setting("field_extraction_processes", 0)
 
     ################################################################################################
 
@@ -165,13 +189,17 @@ class FileFinder(QtCore.QObject):
         version_compare_ignore_fields = self._app.get_setting("version_compare_ignore_fields", [])    
 
         # find all work & publish files and filter out any that should be ignored:
-        work_files = self._find_work_files(context, work_template, version_compare_ignore_fields)
+        dir_entries = {}
+        work_files = self._find_work_files(context, work_template, version_compare_ignore_fields,
+                                           dir_entries)
         filtered_work_files = self._filter_work_files(work_files, valid_file_extensions)
+        self._gather_file_metadata(filtered_work_files, dir_entries)
         
         published_files = self._find_publishes(publish_filters)
         filtered_published_files = self._filter_publishes(published_files, 
                                                           publish_template, 
                                                           valid_file_extensions)
+        self._gather_file_metadata(filtered_published_files)
         
         # turn these into FileItem instances:
         name_map = FileFinder._FileNameMap()
@@ -205,9 +233,109 @@ class FileFinder(QtCore.QObject):
 
         return file_items
 
+    def find_work_files_in_directories(self, work_area, directories):
+        """
+        Find the work files for a work area that are in the specified directories or in any of
+        their subdirectories that can contain work files.  This is used to update the files for a
+        work area when only a few directories are known to have changed rather than searching the
+        whole work area again.
+
+        :param work_area:   The WorkArea instance to find work files for
+        :param directories: A list of directories to look in
+        :returns:           A list of FileItem instances, one for each work file found
+        """
+        work_file_item_details, _ = self._find_work_file_details_in_directories(work_area, directories)
+        return [FileItem(**kwargs) for kwargs in work_file_item_details.values()]
+
+    def _find_work_file_details_in_directories(self, work_area, directories, cancel_token=None):
+        """
+        Find the details of the work files for a work area that are in the specified directories
+        or in any of their subdirectories that can contain work files, e.g. a new directory for a
+        work template like 'work/{name}/{name}.v{version}.ma'.  This accesses the filesystem and
+        may query Shotgun so is run in a background task by the AsyncFileFinder.
+
+        :param work_area:       The WorkArea instance to find work files for
+        :param directories:     A list of directories to look in
+        :param cancel_token:    An optional CancellationToken checked before each directory
+        :returns:               Tuple containing a dictionary of {(file key, version):FileItem kwargs},
+                                one for each work file found, and the set of directories that
+                                were searched, including any subdirectories
+        """
+        work_template = work_area.work_template
+        context = work_area.context
+        if not work_template or not context or not getattr(work_template, "root_path", None):
+            return ({}, set())
+
+        # use the same fields as when searching the whole work area:
+        search_fields = self._get_work_file_search_fields(context, work_template,
+                                                          work_area.version_compare_ignore_fields)
+        if search_fields is None:
+            return ({}, set())
+        work_fields, skip_fields = search_fields
+
+        # walk each directory, descending into any subdirectories that match the template:
+        walker = TemplateWalker(work_template, work_fields, skip_fields, skip_missing_optional_keys=True,
+                                cancel_token=cancel_token)
+        work_file_paths = []
+        for directory in directories:
+            work_file_paths.extend(walker.iter_paths(directory))
+
+        filtered_work_files = self._filter_work_files(work_file_paths, work_area.valid_file_extensions)
+        self._gather_file_metadata(filtered_work_files, walker.entries, cancel_token=cancel_token)
+        work_file_item_details = self._process_work_files(filtered_work_files,
+                                                          work_template,
+                                                          context,
+                                                          FileFinder._FileNameMap(),
+                                                          work_area.version_compare_ignore_fields,
+                                                          cancel_token=cancel_token)
+        return (work_file_item_details, walker.directories)
+
+    def _gather_file_metadata(self, files, dir_entries=None, cancel_token=None):
+        """
+        Gather the filesystem metadata for a list of work files or publishes, issuing at most a
+        single stat per path.  The modified time and owner uid are stored in the 'mtime' and 'uid'
+        entries of each file dictionary, both of which are None if the path couldn't be stat'd.
+
+        :param files:       A list of file dictionaries, each containing at least a 'path' entry.
+        :param dir_entries: An optional dictionary of {path:os.DirEntry} found when searching for
+                            the files.  If a path is in this dictionary then the stat result is
+                            retrieved from the entry, which avoids a stat call on platforms
+                            where the directory listing already contains this information.
+        :param cancel_token:    An optional CancellationToken checked before each file.
+        :returns:           The number of stat calls issued.
+        """
+        dir_entries = dir_entries or {}
+        num_stats = 0
+        for file_details in files:
+            if cancel_token:
+                cancel_token.check()
+            path = file_details["path"]
+            if (file_details.get("modified_at") and file_details.get("modified_by")):
+                # details were already provided by the filter hook:
+                file_details["mtime"] = file_details["uid"] = None
+                continue
+
+            entry = dir_entries.get(path)
+            num_stats += 1
+            try:
+                stat_result = entry.stat() if entry else os.stat(path)
+            except OSError:
+                # ignore OSErrors as it's probably a permissions thing or
+                # the file doesn't exist!
+                file_details["mtime"] = file_details["uid"] = None
+                continue
+            file_details["mtime"] = stat_result.st_mtime
+            file_details["uid"] = stat_result.st_uid
+
+        self._app.log_debug("Gathered metadata for %d files with %d stat calls" % (len(files), num_stats))
+        return num_stats
+
     def _process_work_files(self, work_files, work_template, context, name_map, version_compare_ignore_fields, 
-                          filter_file_key=None):
+                          filter_file_key=None, index_scan=None, cancel_token=None):
         """
+        Note that the filesystem is not accessed here - metadata for the files should have been
+        gathered previously using _gather_file_metadata().
+
         :param work_files: A list of dictionaries with file details.
         :param work_template: The template which was used to generate the files list.
         :param context: The context for which the files are retrieved.
@@ -216,38 +344,72 @@ class FileFinder(QtCore.QObject):
                                               when building a key for the file.
         :param filter_file_key: A unique file 'key' that, if specified, will limit
                                 the returned list of files to just those that match.
+        :param index_scan: An optional WorkFileIndexScan used when searching for the files.
+                           Fields and file keys are reused from valid index records and
+                           records are added for all other files.
+        :param cancel_token: An optional CancellationToken checked before each file.
         returns: A dictionary where keys are (file key, version number) tuples
                   and values are dictionaries which can be used to instantiate
                   :class:`FileItem`.
         """
         files = {}
+        key_builder = FileKeyBuilder.get(work_template, version_compare_ignore_fields)
+
+        # find any valid index records and extract the fields for all other work files in bulk:
+        records = {}
+        if index_scan:
+            for work_file in work_files:
+                record = index_scan.get_record(work_file["path"], work_file.get("mtime"))
+                if record:
+                    records[work_file["path"]] = record
+        paths_to_parse = [wf["path"] for wf in work_files if wf["path"] not in records]
+        parsed_fields = dict(zip(paths_to_parse, get_field_extractor(work_template).extract(
+            paths_to_parse, self._field_extraction_processes
+        )))
+
+        # resolve the users that last modified the work files in a single query:
+        users_by_uid = g_user_cache.get_user_details_for_uids(
+            [wf.get("uid") for wf in work_files if not wf.get("modified_by")]
+        )
+        # values such as the entity and users are shared by the details of all work files:
+        frozen_values = {}
         
         for work_file in work_files:
+            if cancel_token:
+                cancel_token.check()
             
             # always have the work path:
             work_path = work_file["path"]
-            
-            # get fields for work file:
-            wf_fields = work_template.get_fields(work_path)
             wf_ctx = None
 
-
-            # Build the unique file key for the work path.
-            # All files that share the same key are considered
-            # to be different versions of the same file.
-            #
-            file_key = FileItem.build_file_key(
-                wf_fields,
-                work_template,
-                version_compare_ignore_fields
-            )
+            record = records.get(work_path)
+            if record:
+                # reuse the fields and key parsed previously:
+                wf_fields = record.fields
+                file_key = key_builder.intern(record.file_key)
+            else:
+                # get fields for work file:
+                wf_fields = parsed_fields.get(work_path)
+                if wf_fields is None:
+                    # path doesn't match the template so this will raise the appropriate error:
+                    wf_fields = work_template.get_fields(work_path)
+
+                # Build the unique file key for the work path.
+                # All files that share the same key are considered
+                # to be different versions of the same file.
+                #
+                file_key = key_builder.build(wf_fields)
+                if index_scan and work_file.get("mtime") is not None:
+                    index_scan.add_record(work_path, wf_fields, file_key, wf_fields.get("version", 0),
+                                          work_file["mtime"], work_file.get("uid"))
             if filter_file_key and file_key != filter_file_key:
                 # we can ignore this file completely!
                 continue
             
             # copy common fields from work_file:
             #
-            file_details = dict([(k, v) for k, v in work_file.iteritems() if k != "path"])
+            file_details = dict([(k, v) for k, v in work_file.iteritems()
+                                 if k not in FileFinder._INTERNAL_KEYS])
             
             # get version from fields if not specified in work file:
             if not file_details["version"]:
@@ -269,24 +431,19 @@ class FileFinder(QtCore.QObject):
             # Entity:
             file_details["entity"] = context.entity
 
-            # File modified details:
-            if not file_details["modified_at"]:
-                try:
-                    modified_at = os.path.getmtime(work_path)
-                    file_details["modified_at"] = datetime.fromtimestamp(
-                        modified_at, tz=sg_timezone.local
-                    )
-                except OSError:
-                    # ignore OSErrors as it's probably a permissions thing!
-                    pass
+            # File modified details.  The FileItem converts the timestamp to a datetime
+            # when it's needed:
+            mtime = work_file.get("mtime")
+            if not file_details["modified_at"] and mtime is not None:
+                file_details["modified_at"] = mtime
 
             if not file_details["modified_by"]:
-                file_details["modified_by"] = g_user_cache.get_file_last_modified_user(work_path)
+                file_details["modified_by"] = users_by_uid.get(work_file.get("uid"))
 
             if not file_details["name"]:
                 # make sure all files with the same key have the same name:
                 file_details["name"] = name_map.get_name(
-                    file_key, work_path, work_template, wf_fields
+                    file_key, work_path, work_template, wf_fields, key_builder
                 )
 
             # add to the list of files
@@ -294,21 +451,31 @@ class FileFinder(QtCore.QObject):
                 "key": file_key,
                 "is_work_file": True,
                 "work_path": work_path,
-                "work_details": file_details,
+                "work_details": pack_file_details(file_details, frozen_values),
             }
 
         return files
 
     def _process_publish_files(self, sg_publishes, publish_template, work_template, context, name_map, 
-                             version_compare_ignore_fields, filter_file_key=None):
+                             version_compare_ignore_fields, filter_file_key=None, cancel_token=None):
         """
         """
         files = {}
+        key_builder = FileKeyBuilder.get(work_template, version_compare_ignore_fields)
         
         # and add in publish details:
         ctx_fields = context.as_template_fields(work_template)
+
+        # resolve the users that last modified the local publish files in a single query:
+        users_by_uid = g_user_cache.get_user_details_for_uids(
+            [p.get("uid") for p in sg_publishes if p.get("mtime") is not None]
+        )
+        # values such as the entity and users are shared by the details of all publishes:
+        frozen_values = {}
                     
         for sg_publish in sg_publishes:
+            if cancel_token:
+                cancel_token.check()
             file_details = {}
     
             # always have a path:
@@ -318,7 +485,9 @@ class FileFinder(QtCore.QObject):
             # The order is important as it ensures that the user is correct if the 
             # publish file is in a user sandbox but we also need to be careful not
             # to overrwrite fields that are being ignored when comparing work files
-            publish_fields = publish_template.get_fields(publish_path)
+            publish_fields = sg_publish.get("fields")
+            if publish_fields is None:
+                publish_fields = publish_template.get_fields(publish_path)
             wp_fields = publish_fields.copy()
             for k, v in ctx_fields.iteritems():
                 if k not in version_compare_ignore_fields:
@@ -326,8 +495,7 @@ class FileFinder(QtCore.QObject):
             
             # build the unique file key for the publish path.  All files that share the same key are considered
             # to be different versions of the same file.
-            file_key = FileItem.build_file_key(wp_fields, work_template, 
-                                               version_compare_ignore_fields)
+            file_key = key_builder.build(wp_fields)
             if filter_file_key and file_key != filter_file_key:
                 # we can ignore this file completely!
                 continue
@@ -343,7 +511,8 @@ class FileFinder(QtCore.QObject):
             
             # copy common fields from sg_publish:
             #
-            file_details = dict([(k, v) for k, v in sg_publish.iteritems() if k != "path"])
+            file_details = dict([(k, v) for k, v in sg_publish.iteritems()
+                                 if k not in FileFinder._INTERNAL_KEYS])
             
             # get version from fields if not specified in publish file:
             if file_details["version"] == None:
@@ -353,14 +522,10 @@ class FileFinder(QtCore.QObject):
             file_details["entity"] = context.entity
         
             # local file modified details:
-            if os.path.exists(publish_path):
-                try:
-                    modified_at = os.path.getmtime(publish_path)
-                    file_details["modified_at"] = datetime.fromtimestamp(modified_at, tz=sg_timezone.local)
-                except OSError:
-                    # ignore OSErrors as it's probably a permissions thing!
-                    pass
-                file_details["modified_by"] = g_user_cache.get_file_last_modified_user(publish_path)
+            mtime = sg_publish.get("mtime")
+            if mtime is not None:
+                file_details["modified_at"] = mtime
+                file_details["modified_by"] = users_by_uid.get(sg_publish.get("uid"))
             else:
                 # just use the publish info
                 file_details["modified_at"] = sg_publish.get("published_at")
@@ -368,7 +533,8 @@ class FileFinder(QtCore.QObject):
 
             if not file_details["name"]:
                 # make sure all files with the same key have the same name:
-                file_details["name"] = name_map.get_name(file_key, publish_path, publish_template, publish_fields)
+                file_details["name"] = name_map.get_name(file_key, publish_path, publish_template, publish_fields,
+                                                         key_builder)
 
             # add new file item for this publish.  Note that we also keep track of the
             # work path even though we don't know if this publish has a corresponding
@@ -378,7 +544,7 @@ class FileFinder(QtCore.QObject):
                 "work_path": work_path,
                 "is_published": True,
                 "publish_path": publish_path,
-                "publish_details": file_details,
+                "publish_details": pack_file_details(file_details, frozen_values),
             }
         return files
 
@@ -389,10 +555,9 @@ class FileFinder(QtCore.QObject):
         :returns:                   List of dictionaries, each one containing the details
                                     of an individual published file
         """
-        fields = ["id", "description", "version_number", "image", "created_at", "created_by", "name", "path", "task"]
         published_file_type = sgtk.util.get_published_file_entity_type(self._app.sgtk)
         sg_publishes = self._app.shotgun.find(
-            published_file_type, publish_filters, fields
+            published_file_type, publish_filters, FileFinder._PUBLISH_FIELDS
         )
         return sg_publishes
 
@@ -400,7 +565,12 @@ class FileFinder(QtCore.QObject):
         """
         """
         # build list of publishes to send to the filter_publishes hook:
-        hook_publishes = [{"sg_publish":sg_publish} for sg_publish in sg_publishes]
+        if self._app.get_setting("hook_filter_publishes") == FileFinder._DEFAULT_FILTER_PUBLISHES_HOOK:
+            # the default hook doesn't modify the publishes so the shared records can be used:
+            hook_publishes = [{"sg_publish":sg_publish} for sg_publish in sg_publishes]
+        else:
+            # a custom hook may modify the publishes it's given so give it mutable copies:
+            hook_publishes = [{"sg_publish":thaw_value(sg_publish)} for sg_publish in sg_publishes]
         
         # execute the hook - this will return a list of filtered publishes:
         hook_result = self._app.execute_hook("hook_filter_publishes", publishes = hook_publishes)
@@ -410,7 +580,7 @@ class FileFinder(QtCore.QObject):
             hook_result = []
         
         # split back out publishes:
-        published_files = []
+        candidates = []
         for item in hook_result:
             sg_publish = item.get("sg_publish")
             if not sg_publish:
@@ -427,13 +597,22 @@ class FileFinder(QtCore.QObject):
             # skip file if it doesn't contain a valid file extension:
             if valid_file_extensions and os.path.splitext(path)[1] not in valid_file_extensions:
                 continue
-    
-            # make sure path matches the publish template:            
-            if not publish_template.validate(path):
+
+            candidates.append((item, sg_publish, path))
+
+        # make sure paths match the publish template, extracting the fields for all paths at once
+        # so that they can be reused when the publishes are processed:
+        all_fields = get_field_extractor(publish_template).extract(
+            [candidate_path for _, _, candidate_path in candidates], self._field_extraction_processes
+        )
+
+        published_files = []
+        for (item, sg_publish, path), fields in zip(candidates, all_fields):
+            if fields is None:
                 continue
     
             # build file details for this publish:
-            file_details = {"path":path}
+            file_details = {"path":path, "fields":fields}
             
             # add in details from sg record:
             file_details["version"] = sg_publish.get("version_number")
@@ -458,7 +637,8 @@ class FileFinder(QtCore.QObject):
         return published_files
     
         
-    def _find_work_files(self, context, work_template, version_compare_ignore_fields):
+    def _find_work_files(self, context, work_template, version_compare_ignore_fields, dir_entries=None,
+                         index_scan=None, cancel_token=None):
         """
         Find all work files for the specified context and work template.
         
@@ -466,9 +646,59 @@ class FileFinder(QtCore.QObject):
         :param work_template:                   The work template to match found files against
         :param version_compare_ignore_fields:   List of fields to ignore when comparing files in order to find 
                                                 different versions of the same file
+        :param dir_entries:                     An optional dictionary that will be populated with
+                                                {path:os.DirEntry} for the files found if the
+                                                filesystem is walked directly.
+        :param index_scan:                      An optional WorkFileIndexScan used to list directories
+                                                when the filesystem is walked directly.
+        :param cancel_token:                    An optional CancellationToken checked while walking
+                                                the filesystem.
         :returns:                               A list of file paths.
         """
+        return list(self._iter_work_files(context, work_template, version_compare_ignore_fields,
+                                          dir_entries, index_scan, cancel_token))
+
+    def _iter_work_files(self, context, work_template, version_compare_ignore_fields, dir_entries=None,
+                         index_scan=None, cancel_token=None):
+        """
+        Find all work files for the specified context and work template, yielding the paths as
+        they are found.  When the filesystem is walked directly, paths are yielded while the
+        walk is still in progress.
+
+        :param context:                         The context to find work files for
+        :param work_template:                   The work template to match found files against
+        :param version_compare_ignore_fields:   List of fields to ignore when comparing files in order to find 
+                                                different versions of the same file
+        :param dir_entries:                     An optional dictionary that will be populated with
+                                                {path:os.DirEntry} for the files found if the
+                                                filesystem is walked directly.
+        :param index_scan:                      An optional WorkFileIndexScan used to list directories
+                                                when the filesystem is walked directly.
+        :param cancel_token:                    An optional CancellationToken checked while walking
+                                                the filesystem.
+        :returns:                               A generator yielding file paths.
+        """
         # find work files that match the current work template:
+        search_fields = self._get_work_file_search_fields(context, work_template, version_compare_ignore_fields)
+        if search_fields is None:
+            return
+        work_fields, skip_fields = search_fields
+
+        for path in self._iter_template_paths(work_template, work_fields, skip_fields, dir_entries, index_scan,
+                                              cancel_token):
+            yield path
+
+    def _get_work_file_search_fields(self, context, work_template, version_compare_ignore_fields):
+        """
+        Get the fields used to search for work files for the specified context and work template.
+
+        :param context:                         The context to find work files for
+        :param work_template:                   The work template to match found files against
+        :param version_compare_ignore_fields:   List of fields to ignore when comparing files in order to find 
+                                                different versions of the same file
+        :returns:                               Tuple (work fields, list of fields to skip) or None if
+                                                the fields can't be resolved for the context
+        """
         work_fields = []
         try:
             work_fields = context.as_template_fields(work_template, validate=True)
@@ -477,7 +707,7 @@ class FileFinder(QtCore.QObject):
             # when the context object does not have any corresponding objects on 
             # disk / in the path cache. In this case, we cannot continue with any
             # file system resolution, so just exit early insted.
-            return []
+            return None
 
         # Build list of fields to ignore when looking for files, any missing key
         # is treated as a wildcard, which allows, for example to retrieve all files
@@ -494,14 +724,123 @@ class FileFinder(QtCore.QObject):
         if "version" not in skip_fields:
             skip_fields += ["version"]
 
-        # find paths:
+        return (work_fields, skip_fields)
+
+    def _iter_template_paths(self, work_template, work_fields, skip_fields, dir_entries=None, index_scan=None,
+                             cancel_token=None):
+        """
+        Find all paths matching a template, yielding the paths as they are found.
+
+        :param work_template:   The template to find paths for
+        :param work_fields:     The fields to find paths for
+        :param skip_fields:     The list of fields to treat as wildcards
+        :param dir_entries:     An optional dictionary that will be populated with {path:os.DirEntry}
+                                for the files found if the filesystem is walked directly.
+        :param index_scan:      An optional WorkFileIndexScan used to list directories when the
+                                filesystem is walked directly.
+        :param cancel_token:    An optional CancellationToken checked before each directory is walked.
+                                paths_from_template can't be interrupted so the token is only checked
+                                once it has returned when the template walker isn't used.
+        :returns:               A generator yielding file paths.
+        """
+        if self._use_template_walker and getattr(work_template, "root_path", None):
+            # walk the filesystem using a walker compiled from the template:
+            walker = TemplateWalker(
+                work_template,
+                work_fields,
+                skip_fields,
+                skip_missing_optional_keys=True,
+                list_directory_fn=index_scan.list_directory if index_scan else None,
+                cancel_token=cancel_token
+            )
+            walker_entries = walker.entries
+            for path in walker.iter_paths():
+                if dir_entries is not None:
+                    dir_entries[path] = walker_entries[path]
+                yield path
+            return
+
         work_file_paths = self._app.sgtk.paths_from_template(
             work_template,
             work_fields,
             skip_fields,
             skip_missing_optional_keys=True
         )
-        return work_file_paths
+        if cancel_token:
+            cancel_token.check()
+        for path in work_file_paths:
+            yield path
+
+    def _find_work_files_for_work_areas(self, work_areas, dir_entries=None, index_scan_fn=None, cancel_token=None):
+        """
+        Find all work files for a list of work areas, walking the filesystem once for all work areas
+        that share the same work template.  When the search fields only differ for some keys, e.g.
+        the Step or Task name for sibling Tasks, the paths are found once with those keys treated as
+        wildcards and then partitioned between the work areas using the fields of each path.
+
+        :param work_areas:      The list of WorkAreas to find work files for
+        :param dir_entries:     An optional dictionary that will be populated with {path:os.DirEntry}
+                                for the files found if the filesystem is walked directly.
+        :param index_scan_fn:   An optional function that returns a WorkFileIndexScan for a WorkArea
+        :param cancel_token:    An optional CancellationToken checked while walking the filesystem
+        :returns:               A list containing a tuple (list of paths, WorkFileIndexScan or None)
+                                for each work area
+        """
+        results = [([], None) for _ in work_areas]
+
+        # group the work areas by the template and wildcards used to search for files:
+        groups = {}
+        for wi, work_area in enumerate(work_areas):
+            if not (work_area and work_area.context and work_area.work_template):
+                continue
+            search_fields = self._get_work_file_search_fields(work_area.context, work_area.work_template,
+                                                              work_area.version_compare_ignore_fields)
+            if search_fields is None:
+                continue
+            work_fields, skip_fields = search_fields
+            group_key = (id(work_area.work_template), frozenset(skip_fields))
+            groups.setdefault(group_key, []).append((wi, work_area, work_fields, skip_fields))
+
+        for members in groups.values():
+            _, work_area, work_fields, skip_fields = members[0]
+            work_template = work_area.work_template
+
+            # find the fields that are the same for all work areas:
+            common_fields = dict(work_fields)
+            for _, _, member_fields, _ in members[1:]:
+                for name, value in member_fields.iteritems():
+                    if common_fields.get(name, value) != value:
+                        del common_fields[name]
+                for name in common_fields.keys():
+                    if name not in member_fields:
+                        del common_fields[name]
+            differing_fields = set()
+            for _, _, member_fields, _ in members:
+                differing_fields.update([name for name in member_fields if name not in common_fields])
+
+            index_scan = index_scan_fn(work_area) if index_scan_fn else None
+            paths = list(self._iter_template_paths(work_template, common_fields,
+                                                   list(skip_fields) + list(differing_fields),
+                                                   dir_entries, index_scan, cancel_token))
+            if not differing_fields:
+                for wi, _, _, _ in members:
+                    results[wi] = (list(paths), index_scan)
+                continue
+
+            # partition the paths using the fields that differ between the work areas:
+            member_paths = dict([(wi, []) for wi, _, _, _ in members])
+            all_fields = get_field_extractor(work_template).extract(paths, self._field_extraction_processes)
+            for path, fields in zip(paths, all_fields):
+                if fields is None:
+                    continue
+                for wi, _, member_fields, _ in members:
+                    if all(fields.get(name) == member_fields[name]
+                           for name in differing_fields if name in member_fields):
+                        member_paths[wi].append(path)
+            for wi, _, _, _ in members:
+                results[wi] = (member_paths[wi], index_scan)
+
+        return results
 
     def _filter_work_files(self, work_file_paths, valid_file_extensions):
         """
@@ -580,8 +919,8 @@ class AsyncFileFinder(FileFinder):
             """
             """
             self.id = search_id
-            self.entity = copy.deepcopy(entity)
-            self.users = copy.deepcopy(users)
+            self.entity = freeze_value(entity)
+            self.users = freeze_value(users)
             self.publish_model = publish_model
             self.publish_model_refreshed = False
             self.aborted = False
@@ -590,40 +929,175 @@ class AsyncFileFinder(FileFinder):
 
             self.construct_work_area_task = None
             self.resolve_work_area_task = None
-            self.find_work_files_tasks = set()
+            # {process work items task id:user id}
+            self.find_work_files_tasks = {}
+            # when streaming work files, {find work file batch task id:user id}
+            self.find_work_file_batch_tasks = {}
+            # {user id:number of work file batches still being processed}
+            self.pending_work_file_batches = {}
+            # ids of users whose work areas are still being walked
+            self.walking_user_ids = set()
             self.load_cached_pubs_task = None
+            # revision of the stored publishes processed, if the publish store is being used:
+            self.sync_publishes_task = None
+            self.stored_publishes_revision = None
+            # task querying the publishes instead of refreshing the publish model:
+            self.query_publishes_task = None
             self.find_publishes_tasks = set()
             self.user_work_areas = {}
 
+            # single-flight details when searches are coalesced:
+            self.coalesce_key = None
+            # list of _Follower instances attached to this search
+            self.followers = []
+            # list of (signal name, args) emitted so far, replayed to followers when they attach
+            self.emitted = []
+            # True once the search is no longer required by the caller that started it
+            self.detached = False
+            self.stop_pending = False
+
+            # id of the _SearchBatch the search is part of, if any:
+            self.batch_id = None
+            # ids of users whose work files are still being found by the batch:
+            self.awaiting_batch_users = set()
+
+    class _SearchBatch(object):
+        def __init__(self, batch_id, search_ids, find_publishes):
+            """
+            :param batch_id:        The task group id used for the tasks shared by the batch
+            :param search_ids:      The ids of the searches in the batch
+            :param find_publishes:  True if the publishes for all searches are found by the batch
+            """
+            self.id = batch_id
+            self.search_ids = list(search_ids)
+            self.find_publishes = find_publishes
+            # {search id:WorkArea or None if the search was aborted}
+            self.work_areas = {}
+            # {find work files task id:(user id, [search ids])}
+            self.find_work_files_tasks = {}
+            self.find_publishes_task = None
+            self.find_publishes_search_ids = []
+
+    class _Follower(object):
+        def __init__(self, finder, search_id):
+            """
+            :param finder:      The AsyncFileFinder the follower search was started with
+            :param search_id:   The search id returned to the caller of begin_search
+            """
+            self.finder = finder
+            self.search_id = search_id
+            # True once all previously emitted signals have been replayed to the follower
+            self.live = False
+            self.stopped = False
+
     _FIND_PUBLISHES_PRIORITY, _FIND_FILES_PRIORITY = (20, 40)
 
+    # searches in flight across all finders that can be attached to, {coalesce key:(finder, search)}
+    _in_flight_searches = {}
+    _coalescing_stats = {"searches_started":0, "searches_coalesced":0, "signals_replayed":0}
+
+    # signals emitted once a search has finished:
+    _FINAL_SIGNALS = ("search_completed", "search_failed")
+
+    # the minimum number of sibling Task searches that are batched together:
+    _MIN_BATCH_SIZE = 2
+
     # Signals
     work_area_found = QtCore.Signal(object, object)
     work_area_resolved = QtCore.Signal(object, object) # search_id, WorkArea
-    files_found = QtCore.Signal(object, object, object) # search_id, file list, WorkArea
+    files_found = QtCore.Signal(object, object, object, bool) # search_id, file list, WorkArea, is final batch
     publishes_found = QtCore.Signal(object, object, object) # search_id, file list, WorkArea
     search_failed = QtCore.Signal(object, object) # search_id, message
     search_completed = QtCore.Signal(object) # search_id
+    directory_files_found = QtCore.Signal(object, object, object, object) # search_id, file list, WorkArea, directories
+    directory_search_failed = QtCore.Signal(object, object) # search_id, message
 
-    def __init__(self, bg_task_manager, parent=None):
+    def __init__(self, bg_task_manager, parent=None, priority_offset=0, coalesce=True):
         """
+        Construction
+
+        :param bg_task_manager: The BackgroundTaskManager to run the search tasks in
+        :param parent:          The parent QObject for this instance
+        :param priority_offset: Offset added to the priority of all search tasks, e.g. a negative
+                                offset ensures that speculative searches only run when there are
+                                no other tasks waiting.  With a negative offset, publishes are
+                                queried by a search task rather than by refreshing a publish model
+                                as publish models always refresh at their own priority.
+        :param coalesce:        If False, searches run by this finder are never coalesced with
+                                those run by other finders even if coalescing is enabled in the
+                                app settings.  Finders running speculative or background searches
+                                should disable this so that a search the user is waiting on is
+                                never attached to a search running at a lower priority or in a
+                                different task manager.
         """
         FileFinder.__init__(self, parent)
+        self._priority_offset = priority_offset
+
+        # if set, work files are found and processed in batches of this size:
+        self._work_file_batch_size = self._app.get_setting("work_file_batch_size", 0)
+        # if set, publishes are synchronised incrementally through the publish store rather than
+        # being refreshed in full by the publish model:
+        self._publish_store = get_publish_store()
 
         self._searches = {}
         self._available_publish_models = []
 
+        # if set, identical searches are coalesced so that only one runs at a time:
+        self._coalesce_searches = coalesce and self._app.get_setting("coalesce_searches", False)
+        # if set, searches for sibling Tasks share a publish query and filesystem walk:
+        self._batch_task_searches = self._app.get_setting("batch_task_searches", False)
+        self._batches = {}
+        # searches following a search started by this or another finder, {search id:(finder, search)}
+        self._followed_searches = {}
+        # (search, _Follower) tuples waiting for previously emitted signals to be replayed:
+        self._pending_replays = []
+        # {search or batch id:CancellationToken} passed to all tasks run for the search or batch so
+        # that long running tasks stop soon after the search is stopped:
+        self._cancel_tokens = {}
+        # searches for the work files in a few directories of a work area, {search id:(WorkArea, directories)}
+        self._directory_searches = {}
+
         self._bg_task_manager = bg_task_manager
-        self._bg_task_manager.task_completed.connect(self._on_background_task_completed)
-        self._bg_task_manager.task_failed.connect(self._on_background_task_failed)
-        self._bg_task_manager.task_group_finished.connect(self._on_background_search_finished)
+        # if enabled, tasks are run through the limiter shared by everything using the task manager
+        # that restricts how many tasks of each resource class run at the same time.  Publish models
+        # always use the task manager directly:
+        self._task_limiter = get_task_limiter(bg_task_manager)
+        self._task_manager = self._task_limiter or self._bg_task_manager
+        self._task_manager.task_completed.connect(self._on_background_task_completed)
+        self._task_manager.task_failed.connect(self._on_background_task_failed)
+        self._task_manager.task_group_finished.connect(self._on_background_search_finished)
 
     def shut_down(self):
         """
         """
+        # stop following searches run by other finders:
+        for search_id in self._followed_searches.keys():
+            self.stop_search(search_id)
+        self._pending_replays = []
+
+        self._directory_searches = {}
+
+        # stop any running tasks as soon as possible so that shutting down the task manager
+        # doesn't have to wait for them:
+        for cancel_token in self._cancel_tokens.values():
+            cancel_token.cancel()
+        # the task manager and limiter are shared so only stop the tasks added by this finder:
+        if self._task_manager:
+            for group in self._cancel_tokens.keys():
+                self._task_manager.stop_task_group(group)
+        self._cancel_tokens = {}
+
+        # searches run by this finder can't continue so restart them for any followers:
+        for search in self._searches.values():
+            self._unregister_search(search)
+            for follower in search.followers:
+                if not follower.stopped and follower.finder != self:
+                    follower.finder._restart_followed_search(follower.search_id, search)
+            search.followers = []
+
         # clean up any publish models - not doing this will result in 
         # severe instability!
-        for search in self._searches:
+        for search in self._searches.values():
             if search.publish_model:
                 self._available_publish_models.append(search.publish_model)
         self._searches = {}
@@ -632,13 +1106,20 @@ class AsyncFileFinder(FileFinder):
         self._available_publish_models = []
 
         # and shut down the task manager
-        if self._bg_task_manager:
+        if self._task_manager:
             # disconnect from the task manager:
-            self._bg_task_manager.task_completed.disconnect(self._on_background_task_completed)
-            self._bg_task_manager.task_failed.disconnect(self._on_background_task_failed)
-            self._bg_task_manager.task_group_finished.disconnect(self._on_background_search_finished)
+            self._task_manager.task_completed.disconnect(self._on_background_task_completed)
+            self._task_manager.task_failed.disconnect(self._on_background_task_failed)
+            self._task_manager.task_group_finished.disconnect(self._on_background_search_finished)
 
 
+    def get_task_stats(self):
+        """
+        :returns:   Dictionary of statistics for each resource class if tasks are being limited -
+                    see TaskLimiter.get_stats() for details - otherwise an empty dictionary.
+        """
+        return self._task_limiter.get_stats() if self._task_limiter else {}
+
     def begin_search(self, entity, users = None):
         """
         A full search involves several stages:
@@ -664,8 +1145,85 @@ class AsyncFileFinder(FileFinder):
         users = users or []
 
         # get a new unique group id from the task manager - this will be used as the search id
-        search_id = self._bg_task_manager.next_group_id()
+        search_id = self._task_manager.next_group_id()
+
+        if self._attach_to_in_flight_search(search_id, entity, users):
+            return search_id
 
+        return self._start_search(search_id, entity, users)
+
+    def begin_searches(self, entities, users = None):
+        """
+        Begin searches for a list of entities.  If enabled, searches for sibling Tasks are run as
+        a batch that finds the publishes for all of the Tasks with a single query and walks the
+        filesystem once for all Tasks that share a work template.  Each search still emits its
+        own signals with its own results.
+
+        :param entities:    The list of entities to search for files for
+        :param users:       A list of user sandboxes to search for files for.  If 'None' then only files for the current
+                            users sandbox will be searched for.
+        :returns:           A list of search ids, one for each entity
+        """
+        users = users or []
+
+        search_ids = []
+        batch_search_ids = []
+        batch_entities = []
+        for entity in entities:
+            search_id = self._task_manager.next_group_id()
+            search_ids.append(search_id)
+            if self._attach_to_in_flight_search(search_id, entity, users):
+                continue
+            if self._batch_task_searches and entity and entity.get("type") == "Task":
+                batch_search_ids.append(search_id)
+                batch_entities.append(entity)
+                continue
+            self._start_search(search_id, entity, users)
+
+        if len(batch_search_ids) < AsyncFileFinder._MIN_BATCH_SIZE:
+            # not enough searches to batch:
+            for search_id, entity in zip(batch_search_ids, batch_entities):
+                self._start_search(search_id, entity, users)
+            return search_ids
+
+        # publishes can't be found by the batch when they are synchronised through the publish store:
+        batch = AsyncFileFinder._SearchBatch(self._task_manager.next_group_id(), batch_search_ids,
+                                             find_publishes=not self._publish_store)
+        self._batches[batch.id] = batch
+        for search_id, entity in zip(batch_search_ids, batch_entities):
+            self._start_search(search_id, entity, users, batch)
+        return search_ids
+
+    def _attach_to_in_flight_search(self, search_id, entity, users):
+        """
+        Attach a search to an identical search that is already running, if searches are coalesced.
+
+        :param search_id:   The id of the new search
+        :param entity:      The entity to search for files for
+        :param users:       A list of user sandboxes to search for files for
+        :returns:           True if the search was attached to an in-flight search, otherwise False
+        """
+        if not self._coalesce_searches:
+            return False
+        # attach to an identical search if one is already running:
+        coalesce_key = self._get_coalesce_key(entity, users)
+        in_flight = AsyncFileFinder._in_flight_searches.get(coalesce_key)
+        if not in_flight:
+            return False
+        owner, search = in_flight
+        owner._attach_follower(search, self, search_id)
+        return True
+
+    def _start_search(self, search_id, entity, users, batch=None):
+        """
+        Start a new search.
+
+        :param search_id:   The id to use for the search
+        :param entity:      The entity to search for files for
+        :param users:       A list of user sandboxes to search for files for
+        :param batch:       The _SearchBatch the search is part of, if any
+        :returns:           The search id
+        """
         # get a publish model - re-use if possible, otherwise create a new one.  Max number of publish
         # models created will be the max number of searches at any one time.
         publish_model = None
@@ -682,28 +1240,59 @@ class AsyncFileFinder(FileFinder):
 
         # construct the new search data:
         search = AsyncFileFinder._SearchData(search_id, entity, users, publish_model)
+        search.batch_id = batch.id if batch else None
         self._searches[search.id] = search
 
+        AsyncFileFinder._coalescing_stats["searches_started"] += 1
+        if self._coalesce_searches:
+            # register the search so that identical searches can attach to it:
+            search.coalesce_key = self._get_coalesce_key(entity, users)
+            AsyncFileFinder._in_flight_searches[search.coalesce_key] = (self, search)
+
         # begin the search stage 1:
         self._begin_search_stage_1(search)
 
         # and return the search id:
         return search.id
 
+    def _add_task(self, cbl, task_class, **kwargs):
+        """
+        Add a task to the task limiter if tasks are being limited, otherwise directly to the task
+        manager.  The task is passed the cancellation token for its group in the 'cancel_token'
+        kwarg.
+
+        :param cbl:         The callable to run
+        :param task_class:  The resource class of the task, one of the TaskLimiter classes
+        :param kwargs:      Additional kwargs for BackgroundTaskManager.add_task()
+        :returns:           The id of the task
+        """
+        # all tasks for a search or batch share a cancellation token:
+        group = kwargs.get("group")
+        cancel_token = self._cancel_tokens.get(group)
+        if not cancel_token:
+            cancel_token = self._cancel_tokens[group] = CancellationToken()
+        kwargs["task_kwargs"] = dict(kwargs.get("task_kwargs") or {}, cancel_token=cancel_token)
+        if self._priority_offset:
+            kwargs["priority"] = (kwargs.get("priority") or 0) + self._priority_offset
+
+        if self._task_limiter:
+            return self._task_limiter.add_task(cbl, task_class, **kwargs)
+        return self._bg_task_manager.add_task(cbl, **kwargs)
+
     def _begin_search_stage_1(self, search):
         """
         """
         # start Stage 1 to construct the work area:
         # 1a. Construct a work area for the entity.  The work area contains the context as well as
         # all settings, etc. specific to the work area.
-        search.construct_work_area_task = self._bg_task_manager.add_task(self._task_construct_work_area,
-                                                                         group=search.id,
-                                                                         task_kwargs = {"entity": search.entity})
+        search.construct_work_area_task = self._add_task(self._task_construct_work_area, TaskLimiter.SHOTGUN,
+                                                         group=search.id,
+                                                         task_kwargs = {"entity": search.entity})
 
         # 1b. Resolve sandbox users for the work area (if there are any)
-        search.resolve_work_area_task = self._bg_task_manager.add_task(self._task_resolve_sandbox_users,
-                                                                    group=search.id,
-                                                                    upstream_task_ids = [search.construct_work_area_task])
+        search.resolve_work_area_task = self._add_task(self._task_resolve_sandbox_users, TaskLimiter.FILESYSTEM,
+                                                    group=search.id,
+                                                    upstream_task_ids = [search.construct_work_area_task])
 
     def _begin_search_for_work_files(self, search, work_area):
         """
@@ -717,27 +1306,66 @@ class AsyncFileFinder(FileFinder):
             user_work_area = work_area.create_copy_for_user(user) if user else work_area
             search.user_work_areas[user_id] = user_work_area
 
+            if search.batch_id:
+                # work files will be found by the batch once all work areas in it are known:
+                search.awaiting_batch_users.add(user_id)
+                continue
+
+            if self._work_file_batch_size > 0:
+                # stream work files - batches are processed as they are found:
+                find_batch_task = self._add_task(self._task_find_work_file_batch, TaskLimiter.FILESYSTEM,
+                                                 group=search.id,
+                                                 priority=AsyncFileFinder._FIND_FILES_PRIORITY,
+                                                 task_kwargs = {"environment":user_work_area})
+                search.find_work_file_batch_tasks[find_batch_task] = user_id
+                search.walking_user_ids.add(user_id)
+                continue
+
             # find work files:
-            find_work_files_task = self._bg_task_manager.add_task(self._task_find_work_files, 
-                                                                  group=search.id,
-                                                                  priority=AsyncFileFinder._FIND_FILES_PRIORITY,
-                                                                  task_kwargs = {"environment":user_work_area})
-
-            # filter work files:
-            filter_work_files_task = self._bg_task_manager.add_task(self._task_filter_work_files,
-                                                                    group=search.id,
-                                                                    priority=AsyncFileFinder._FIND_FILES_PRIORITY,
-                                                                    upstream_task_ids = [find_work_files_task],
-                                                                    task_kwargs = {"environment":user_work_area})
-
-            # build work items:
-            process_work_items_task = self._bg_task_manager.add_task(self._task_process_work_items,
-                                                                     group=search.id, 
-                                                                     priority=AsyncFileFinder._FIND_FILES_PRIORITY,
-                                                                     upstream_task_ids = [filter_work_files_task],
-                                                                     task_kwargs = {"environment":user_work_area,
-                                                                                    "name_map":search.name_map})
-            search.find_work_files_tasks.add(process_work_items_task)
+            find_work_files_task = self._add_task(self._task_find_work_files, TaskLimiter.FILESYSTEM,
+                                                  group=search.id,
+                                                  priority=AsyncFileFinder._FIND_FILES_PRIORITY,
+                                                  task_kwargs = {"environment":user_work_area})
+            self._add_process_work_files_tasks(search, user_id, user_work_area,
+                                               upstream_task_ids = [find_work_files_task])
+
+    def _add_process_work_files_tasks(self, search, user_id, user_work_area, upstream_task_ids=None,
+                                      task_kwargs=None):
+        """
+        Add the tasks to filter, gather metadata for and process a list of work files found
+        for a user.
+
+        :param search:              The _SearchData instance for the search
+        :param user_id:             The id of the user the work files were found for
+        :param user_work_area:      The WorkArea for the user
+        :param upstream_task_ids:   Optional list of upstream task ids that provide the work files
+        :param task_kwargs:         Optional additional kwargs for the filter task, e.g. the work files
+        """
+        filter_kwargs = dict(task_kwargs or {})
+        filter_kwargs["environment"] = user_work_area
+
+        # filter work files:
+        filter_work_files_task = self._add_task(self._task_filter_work_files, TaskLimiter.CPU,
+                                                group=search.id,
+                                                priority=AsyncFileFinder._FIND_FILES_PRIORITY,
+                                                upstream_task_ids = upstream_task_ids,
+                                                task_kwargs = filter_kwargs)
+
+        # gather filesystem metadata for the work files:
+        work_files_metadata_task = self._add_task(self._task_gather_file_metadata, TaskLimiter.FILESYSTEM,
+                                                  group=search.id,
+                                                  priority=AsyncFileFinder._FIND_FILES_PRIORITY,
+                                                  upstream_task_ids = [filter_work_files_task])
+
+        # build work items:
+        process_work_items_task = self._add_task(self._task_process_work_items, TaskLimiter.CPU,
+                                                 group=search.id, 
+                                                 priority=AsyncFileFinder._FIND_FILES_PRIORITY,
+                                                 upstream_task_ids = [work_files_metadata_task],
+                                                 task_kwargs = {"environment":user_work_area,
+                                                                "name_map":search.name_map})
+        search.find_work_files_tasks[process_work_items_task] = user_id
+        search.pending_work_file_batches[user_id] = search.pending_work_file_batches.get(user_id, 0) + 1
 
     def _begin_search_process_publishes(self, search, sg_publishes):
         """
@@ -747,21 +1375,25 @@ class AsyncFileFinder(FileFinder):
             user_id = user["id"] if user else None
             user_work_area = search.user_work_areas[user_id]
 
-            users_publishes = copy.deepcopy(sg_publishes)
-
             # filter publishes:
-            filter_publishes_task = self._bg_task_manager.add_task(self._task_filter_publishes,
-                                                                   group=search.id,
-                                                                   priority=AsyncFileFinder._FIND_PUBLISHES_PRIORITY,
-                                                                   task_kwargs = {"environment":user_work_area,
-                                                                                  "sg_publishes":users_publishes})
+            filter_publishes_task = self._add_task(self._task_filter_publishes, TaskLimiter.CPU,
+                                                   group=search.id,
+                                                   priority=AsyncFileFinder._FIND_PUBLISHES_PRIORITY,
+                                                   task_kwargs = {"environment":user_work_area,
+                                                                  "sg_publishes":sg_publishes})
+            # gather filesystem metadata for the publishes:
+            publishes_metadata_task = self._add_task(self._task_gather_file_metadata, TaskLimiter.FILESYSTEM,
+                                                     group=search.id,
+                                                     priority=AsyncFileFinder._FIND_PUBLISHES_PRIORITY,
+                                                     upstream_task_ids = [filter_publishes_task])
+
             # build publish items:
-            process_publish_items_task = self._bg_task_manager.add_task(self._task_process_publish_items,
-                                                                        group=search.id,
-                                                                        priority=AsyncFileFinder._FIND_PUBLISHES_PRIORITY,
-                                                                        upstream_task_ids = [filter_publishes_task],
-                                                                        task_kwargs = {"environment":user_work_area,
-                                                                                       "name_map":search.name_map})
+            process_publish_items_task = self._add_task(self._task_process_publish_items, TaskLimiter.CPU,
+                                                        group=search.id,
+                                                        priority=AsyncFileFinder._FIND_PUBLISHES_PRIORITY,
+                                                        upstream_task_ids = [publishes_metadata_task],
+                                                        task_kwargs = {"environment":user_work_area,
+                                                                       "name_map":search.name_map})
 
             search.find_publishes_tasks.add(process_publish_items_task)
 
@@ -775,7 +1407,7 @@ class AsyncFileFinder(FileFinder):
         search.publish_model_refreshed = True
 
         # get any publishes from the publish model:
-        sg_publishes = copy.deepcopy(search.publish_model.get_sg_data())
+        sg_publishes = self._freeze_publishes(search.publish_model.get_sg_data())
 
         # and begin processing:
         self._begin_search_process_publishes(search, sg_publishes)
@@ -784,11 +1416,11 @@ class AsyncFileFinder(FileFinder):
         """
         """
         model = self.sender()
-        search_id = model.search_id
-        if search_id not in self._searches:
+        search = self._searches.get(model.uid)
+        if not search:
             return
-        self.stop_search(search_id)
-        self.search_failed.emit(search_id, msg)
+        self._stop_search_now(search)
+        self._emit(search, "search_failed", msg)
 
     def _on_background_task_completed(self, task_id, search_id, result):
         """
@@ -796,6 +1428,22 @@ class AsyncFileFinder(FileFinder):
 
         Runs in main thread
         """
+        directory_search = self._directory_searches.pop(search_id, None)
+        if directory_search:
+            # the search has a single task so it's finished:
+            self._cancel_tokens.pop(search_id, None)
+            work_area, directories = directory_search
+            files = [FileItem(**kwargs) for kwargs in result.get("work_items", {}).values()]
+            # include any subdirectories that were found below the requested directories:
+            directories = list(set(directories) | set(result.get("directories") or []))
+            self.directory_files_found.emit(search_id, files, work_area, directories)
+            return
+
+        batch = self._batches.get(search_id)
+        if batch:
+            self._on_batch_task_completed(batch, task_id, result)
+            return
+
         if search_id not in self._searches:
             return
         search = self._searches[search_id]
@@ -803,29 +1451,64 @@ class AsyncFileFinder(FileFinder):
 
         if task_id == search.construct_work_area_task:
             search.construct_work_area_task = None
-            self.work_area_found.emit(search_id, work_area)
+            self._emit(search, "work_area_found", work_area)
 
             # If one or more template hasn't been configured, derail the whole process
             # and return nothing found.
             missing_templates = work_area.get_missing_templates()
             if missing_templates:
                 # Notify that no files were found so the UI can update
-                self.publishes_found.emit(search_id, [], work_area)
-                self.files_found.emit(search_id, [], work_area)
+                self._emit(search, "publishes_found", [], work_area)
+                self._emit(search, "files_found", [], work_area, True)
                 search.aborted = True
+                if search.batch_id:
+                    self._on_batch_work_area_found(self._batches.get(search.batch_id), search.id, None)
                 return
 
             # we have successfully constructed a work area that we can 
             # use for the next stage so begin searching for work files:
             self._begin_search_for_work_files(search, work_area)
             # and also add a task to process cached publishes:
-            search.load_cached_pubs_task = self._bg_task_manager.add_pass_through_task(group = search.id,
-                                                                    priority=AsyncFileFinder._FIND_PUBLISHES_PRIORITY,
-                                                                    task_kwargs = {"environment":work_area})
+            batch = self._batches.get(search.batch_id)
+            if batch:
+                self._on_batch_work_area_found(batch, search.id, work_area)
+                if batch.find_publishes:
+                    # publishes will be found by the batch:
+                    return
+            if self._publish_store:
+                search.load_cached_pubs_task = self._add_task(self._task_load_stored_publishes, TaskLimiter.FILESYSTEM,
+                                                              group = search.id,
+                                                              priority=AsyncFileFinder._FIND_PUBLISHES_PRIORITY,
+                                                              task_kwargs = {"environment":work_area})
+            else:
+                search.load_cached_pubs_task = self._task_manager.add_pass_through_task(group = search.id,
+                                                              priority=(AsyncFileFinder._FIND_PUBLISHES_PRIORITY
+                                                                        + self._priority_offset),
+                                                              task_kwargs = {"environment":work_area})
         elif task_id == search.resolve_work_area_task:
             search.resolve_work_area_task = None
             # found a work area so emit it:
-            self.work_area_resolved.emit(search_id, work_area)
+            self._emit(search, "work_area_resolved", work_area)
+
+        elif task_id == search.load_cached_pubs_task and self._publish_store:
+            search.load_cached_pubs_task = None
+            sg_publishes = result.get("sg_publishes")
+            if sg_publishes is not None:
+                # begin stage 3 for the stored publishes:
+                search.stored_publishes_revision = result.get("revision")
+                self._begin_search_process_publishes(search, sg_publishes)
+            # and synchronise the stored publishes with Shotgun:
+            search.sync_publishes_task = self._add_task(self._task_sync_publishes, TaskLimiter.SHOTGUN,
+                                                        group = search.id,
+                                                        priority=AsyncFileFinder._FIND_PUBLISHES_PRIORITY,
+                                                        task_kwargs = {"environment":work_area})
+
+        elif task_id == search.sync_publishes_task:
+            search.sync_publishes_task = None
+            search.publish_model_refreshed = True
+            if result.get("revision") != search.stored_publishes_revision:
+                # publishes have changed since they were loaded so process them again:
+                self._begin_search_process_publishes(search, result.get("sg_publishes", []))
 
         elif task_id == search.load_cached_pubs_task:
             search.load_cached_pubs_task = None
@@ -833,36 +1516,104 @@ class AsyncFileFinder(FileFinder):
             sg_publishes = self._load_cached_publishes(search, work_area)
             # begin stage 3 for the un-cached publishes:
             self._begin_search_process_publishes(search, sg_publishes)
-            # we can also start the background refresh of the publishes model:
-            search.publish_model.refresh()
+            if self._priority_offset < 0:
+                # the publish model refreshes at its own priority so query the publishes in a
+                # task instead to keep them behind all other searches:
+                search.query_publishes_task = self._add_task(self._task_query_publishes, TaskLimiter.SHOTGUN,
+                                                             group = search.id,
+                                                             priority=AsyncFileFinder._FIND_PUBLISHES_PRIORITY,
+                                                             task_kwargs = {"environment":work_area})
+            else:
+                # we can also start the background refresh of the publishes model:
+                search.publish_model.refresh()
+
+        elif task_id == search.query_publishes_task:
+            search.query_publishes_task = None
+            search.publish_model_refreshed = True
+            self._begin_search_process_publishes(search, result.get("sg_publishes", []))
 
         elif task_id in search.find_publishes_tasks:
             search.find_publishes_tasks.remove(task_id)
             # found publishes:
             publish_item_args = result.get("publish_items", {}).values()
             files = [FileItem(**kwargs) for kwargs in publish_item_args]
-            self.publishes_found.emit(search_id, files, work_area)
+            self._emit(search, "publishes_found", files, work_area)
+
+        elif task_id in search.find_work_file_batch_tasks:
+            user_id = search.find_work_file_batch_tasks.pop(task_id)
+            is_final = result.get("is_final", True)
+            if not is_final:
+                # continue walking the work area:
+                find_batch_task = self._add_task(self._task_find_work_file_batch, TaskLimiter.FILESYSTEM,
+                                                 group=search.id,
+                                                 priority=AsyncFileFinder._FIND_FILES_PRIORITY,
+                                                 task_kwargs = {
+                                                     "environment":work_area,
+                                                     "work_file_iter":result.get("work_file_iter"),
+                                                     "walk_entries":result.get("walk_entries"),
+                                                     "index_scan":result.get("index_scan")
+                                                 })
+                search.find_work_file_batch_tasks[find_batch_task] = user_id
+            else:
+                search.walking_user_ids.discard(user_id)
+
+            # process the batch of work files that were found:
+            work_files = result.get("work_files")
+            if work_files:
+                self._add_process_work_files_tasks(search, user_id, work_area,
+                                                   task_kwargs = {"work_files":work_files,
+                                                                  "dir_entries":result.get("dir_entries"),
+                                                                  "index_scan":result.get("index_scan")})
+            elif is_final and not search.pending_work_file_batches.get(user_id):
+                # nothing more to process so let any listeners know that all files have been found:
+                self._emit(search, "files_found", [], work_area, True)
 
         elif task_id in search.find_work_files_tasks:
-            search.find_work_files_tasks.remove(task_id)
+            user_id = search.find_work_files_tasks.pop(task_id)
+            search.pending_work_file_batches[user_id] -= 1
+            # this is the final batch if the walk has completed and all other batches have been processed:
+            is_final = (user_id not in search.walking_user_ids
+                        and not search.pending_work_file_batches[user_id])
             # found work files:
             work_item_args = result.get("work_items", {}).values()
             files = [FileItem(**kwargs) for kwargs in work_item_args]
-            self.files_found.emit(search_id, files, work_area)
+            self._emit(search, "files_found", files, work_area, is_final)
 
     def _on_background_task_failed(self, task_id, search_id, msg, stack_trace):
         """
         """
-        if search_id not in self._searches:
+        if self._directory_searches.pop(search_id, None):
+            self._cancel_tokens.pop(search_id, None)
+            app = sgtk.platform.current_bundle()
+            app.log_debug(stack_trace)
+            self.directory_search_failed.emit(search_id, msg)
+            return
+
+        batch = self._batches.get(search_id)
+        if batch:
+            # tasks shared by the batch failed so all searches in the batch fail:
+            searches = [self._searches.get(batch_search_id) for batch_search_id in batch.search_ids]
+            self._stop_batch(batch)
+            app = sgtk.platform.current_bundle()
+            app.log_error(msg)
+            app.log_debug(stack_trace)
+            for search in searches:
+                if search:
+                    self._stop_search_now(search)
+                    self._emit(search, "search_failed", msg)
+            return
+
+        search = self._searches.get(search_id)
+        if not search:
             return
-        self.stop_search(search_id)
+        self._stop_search_now(search)
 
         app = sgtk.platform.current_bundle()
         app.log_error(msg)
         app.log_debug(stack_trace)
 
         # emit signal:
-        self.search_failed.emit(search_id, msg)
+        self._emit(search, "search_failed", msg)
 
     def _on_background_search_finished(self, search_id):
         """
@@ -875,39 +1626,393 @@ class AsyncFileFinder(FileFinder):
         # be emitted multiple times for a single search so we need to check
         # that the search has actually finished!
         if search.users and not search.aborted:
-            if (search.find_publishes_tasks or search.find_work_files_tasks 
+            if (search.find_publishes_tasks or search.find_work_files_tasks
+                or search.find_work_file_batch_tasks or search.awaiting_batch_users
                 or search.load_cached_pubs_task or not search.publish_model_refreshed
                 ):
                 # we still have work outstanding!
                 return
 
         # ok, looks like the search is actually complete!
-        self.stop_search(search_id)
+        self._stop_search_now(search)
 
         # emit search completed signal:
-        self.search_completed.emit(search_id)
+        self._emit(search, "search_completed")
+
+    def begin_directory_search(self, work_area, directories):
+        """
+        Begin a search for the work files of a work area that are in the specified directories
+        or their subdirectories, e.g. when only a few directories are known to have changed.  The
+        search runs in a background task and either the directory_files_found signal, with the
+        list of all directories that were searched, or the directory_search_failed signal is
+        emitted when it has finished.
+
+        :param work_area:   The WorkArea instance to find work files for
+        :param directories: A list of directories to look in
+        :returns:           The id of the search
+        """
+        search_id = self._task_manager.next_group_id()
+        self._directory_searches[search_id] = (work_area, list(directories))
+        self._add_task(self._task_find_work_files_in_directories, TaskLimiter.FILESYSTEM,
+                       group=search_id,
+                       priority=AsyncFileFinder._FIND_FILES_PRIORITY,
+                       task_kwargs = {"environment":work_area, "directories":list(directories)})
+        return search_id
+
+    def stop_directory_search(self, search_id):
+        """
+        Stop a search started with begin_directory_search().  No signals will be emitted for it.
+
+        :param search_id:   The id of the search to stop
+        """
+        if self._directory_searches.pop(search_id, None):
+            self._stop_task_group(search_id)
 
     def stop_search(self, search_id):
         """
         """
+        followed = self._followed_searches.pop(search_id, None)
+        if followed:
+            # detach from the search being followed:
+            owner, search = followed
+            owner._detach_follower(search, self, search_id)
+            return
+
         search = self._searches.get(search_id)
         if not search:
             return
 
-        self._bg_task_manager.stop_task_group(search_id)
-        if search.publish_model:
-            search.publish_model.clear()
-            self._available_publish_models.append(search.publish_model)
-        del self._searches[search_id]
+        if search.coalesce_key:
+            # the search may still be needed by followers, or by an identical search started
+            # straight after this one is stopped (e.g. on refresh) so defer stopping it:
+            search.detached = True
+            self._stop_search_if_unused(search)
+            return
+
+        self._stop_search_now(search)
 
     def stop_all_searches(self):
         """
         """
+        for search_id in self._followed_searches.keys():
+            self.stop_search(search_id)
+
+        for search_id in self._directory_searches.keys():
+            self.stop_directory_search(search_id)
+
         for search in self._searches.values():
-            self._bg_task_manager.stop_task_group(search.id)
+            self._unregister_search(search)
+            if search.followers:
+                # followers still need the search so just detach from it:
+                search.detached = True
+                continue
+            self._stop_task_group(search.id)
             if search.publish_model:
                 self._available_publish_models.append(search.publish_model)
-        self._searches = {}
+            del self._searches[search.id]
+
+    @staticmethod
+    def get_coalescing_stats():
+        """
+        Get counters describing how effective search coalescing has been across all finders.
+
+        :returns:   A dictionary containing the number of searches started, the number of
+                    searches that were coalesced with a search already running and the number
+                    of signals replayed to searches that attached late
+        """
+        return dict(AsyncFileFinder._coalescing_stats)
+
+    @staticmethod
+    def get_cancel_latency_stats():
+        """
+        Get statistics describing how quickly running tasks stop once their search is stopped.
+
+        :returns:   A dictionary containing the number of cancellations noticed by tasks and the
+                    mean and maximum time in seconds it took them to notice
+        """
+        return get_cancel_latency_stats()
+
+    def _get_coalesce_key(self, entity, users):
+        """
+        Get the key used to identify identical searches.  The templates used by a search are
+        determined by the app settings and the context of the entity so the app instance and
+        the entity identify the set of templates searched.
+
+        :param entity:  The entity being searched for
+        :param users:   The list of users being searched for
+        :returns:       A hashable key
+        """
+        def _entity_key(entity_dict):
+            return (entity_dict.get("type"), entity_dict.get("id")) if entity_dict else None
+        return (self._app.instance_name, _entity_key(entity),
+                frozenset([_entity_key(user) for user in users]))
+
+    def _emit(self, search, signal_name, *args):
+        """
+        Emit a signal for a search, forwarding it to any followers of the search.
+
+        :param search:      The _SearchData instance the signal is for
+        :param signal_name: The name of the signal to emit
+        :param *args:       The signal arguments, excluding the search id
+        """
+        if search.coalesce_key or search.followers:
+            # keep track of the signal so that it can be replayed to followers that attach later:
+            search.emitted.append((signal_name, args))
+
+        if not search.detached:
+            getattr(self, signal_name).emit(search.id, *args)
+
+        for follower in search.followers:
+            if follower.live and not follower.stopped:
+                follower.finder._emit_followed(follower.search_id, signal_name, args)
+
+    def _emit_followed(self, search_id, signal_name, args):
+        """
+        Emit a signal for a search that is following a search run by this or another finder.
+
+        :param search_id:   The id of the follower search
+        :param signal_name: The name of the signal to emit
+        :param args:        The signal arguments, excluding the search id
+        """
+        if signal_name in AsyncFileFinder._FINAL_SIGNALS:
+            # the search has finished so there is nothing left to follow:
+            self._followed_searches.pop(search_id, None)
+        getattr(self, signal_name).emit(search_id, *args)
+
+    def _attach_follower(self, search, finder, search_id):
+        """
+        Attach a new follower to a search run by this finder.  Signals already emitted by the
+        search are replayed to the follower once control returns to the event loop so that the
+        caller of begin_search has a chance to store the search id first.
+
+        :param search:      The _SearchData instance to attach to
+        :param finder:      The AsyncFileFinder the follower search was started with
+        :param search_id:   The id of the follower search
+        """
+        follower = AsyncFileFinder._Follower(finder, search_id)
+        search.followers.append(follower)
+        search.stop_pending = False
+        finder._followed_searches[search_id] = (self, search)
+
+        AsyncFileFinder._coalescing_stats["searches_coalesced"] += 1
+        self._app.log_debug("File Finder: Search %s attached to in-progress search %s (%s)"
+                            % (search_id, search.id, AsyncFileFinder.get_coalescing_stats()))
+
+        self._pending_replays.append((search, follower))
+        QtCore.QTimer.singleShot(0, self._replay_to_followers)
+
+    def _replay_to_followers(self):
+        """
+        Replay previously emitted signals to all followers that have attached since the last
+        replay and start forwarding new signals to them.
+        """
+        pending_replays = self._pending_replays
+        self._pending_replays = []
+        for search, follower in pending_replays:
+            if follower.stopped:
+                continue
+            for signal_name, args in list(search.emitted):
+                if follower.stopped:
+                    break
+                AsyncFileFinder._coalescing_stats["signals_replayed"] += 1
+                follower.finder._emit_followed(follower.search_id, signal_name, args)
+            follower.live = True
+
+    def _detach_follower(self, search, finder, search_id):
+        """
+        Detach a follower from a search run by this finder, stopping the search if it's no
+        longer needed.
+
+        :param search:      The _SearchData instance to detach from
+        :param finder:      The AsyncFileFinder the follower search was started with
+        :param search_id:   The id of the follower search
+        """
+        for follower in search.followers:
+            if follower.finder == finder and follower.search_id == search_id:
+                follower.stopped = True
+                search.followers.remove(follower)
+                break
+        self._stop_search_if_unused(search)
+
+    def _restart_followed_search(self, search_id, search):
+        """
+        Restart a search that was following a search run by a finder that has been shut down.
+
+        :param search_id:   The id of the follower search
+        :param search:      The _SearchData instance that was being followed
+        """
+        if not self._followed_searches.pop(search_id, None):
+            return
+        self._start_search(search_id, search.entity, search.users)
+
+    def _stop_search_if_unused(self, search):
+        """
+        Schedule a search to be stopped once control returns to the event loop if it isn't
+        needed by the caller that started it or any followers.  This gives an identical
+        search started immediately afterwards the chance to attach to it.
+
+        :param search:  The _SearchData instance to stop
+        """
+        if not search.detached or search.followers or search.stop_pending:
+            return
+        search.stop_pending = True
+        QtCore.QTimer.singleShot(0, lambda: self._stop_pending_search(search))
+
+    def _stop_pending_search(self, search):
+        """
+        Stop a search if it's still unused since it was scheduled to be stopped.
+
+        :param search:  The _SearchData instance to stop
+        """
+        if search.stop_pending and not search.followers and self._searches.get(search.id) is search:
+            self._stop_search_now(search)
+
+    def _unregister_search(self, search):
+        """
+        Make sure no new followers can attach to a search.
+
+        :param search:  The _SearchData instance to unregister
+        """
+        if search.coalesce_key:
+            in_flight = AsyncFileFinder._in_flight_searches.get(search.coalesce_key)
+            if in_flight and in_flight[1] is search:
+                del AsyncFileFinder._in_flight_searches[search.coalesce_key]
+
+    def _stop_search_now(self, search):
+        """
+        Stop all tasks for a search and release its publish model.
+
+        :param search:  The _SearchData instance to stop
+        """
+        self._unregister_search(search)
+        search.stop_pending = False
+        if self._searches.get(search.id) is not search:
+            return
+
+        self._stop_task_group(search.id)
+        if search.publish_model:
+            search.publish_model.clear()
+            self._available_publish_models.append(search.publish_model)
+        del self._searches[search.id]
+
+        batch = self._batches.get(search.batch_id)
+        if batch and search.id in batch.search_ids:
+            # the batch no longer needs to wait for this search:
+            batch.search_ids.remove(search.id)
+            if not batch.search_ids:
+                self._stop_batch(batch)
+            elif search.id not in batch.work_areas:
+                self._begin_batch_tasks_if_ready(batch)
+
+    def _on_batch_work_area_found(self, batch, search_id, work_area):
+        """
+        Called when the work area has been constructed for a search in a batch.
+
+        :param batch:       The _SearchBatch the search is part of
+        :param search_id:   The id of the search
+        :param work_area:   The WorkArea constructed or None if the search was aborted
+        """
+        if not batch:
+            return
+        batch.work_areas[search_id] = work_area
+        self._begin_batch_tasks_if_ready(batch)
+
+    def _begin_batch_tasks_if_ready(self, batch):
+        """
+        Add the tasks shared by the searches in a batch once the work areas for all of the
+        searches have been constructed.
+
+        :param batch:   The _SearchBatch to begin the tasks for
+        """
+        if any(search_id not in batch.work_areas for search_id in batch.search_ids):
+            # still waiting for work areas:
+            return
+        searches = [self._searches[search_id] for search_id in batch.search_ids
+                    if batch.work_areas[search_id] and search_id in self._searches]
+        if not searches:
+            self._stop_batch(batch)
+            return
+
+        # find the work files for each user in a single task:
+        for user in searches[0].users:
+            user_id = user["id"] if user else None
+            find_work_files_task = self._add_task(self._task_find_batch_work_files, TaskLimiter.FILESYSTEM,
+                                                  group=batch.id,
+                                                  priority=AsyncFileFinder._FIND_FILES_PRIORITY,
+                                                  task_kwargs = {
+                                                      "environments":[search.user_work_areas[user_id]
+                                                                      for search in searches]
+                                                  })
+            batch.find_work_files_tasks[find_work_files_task] = (user_id, [search.id for search in searches])
+
+        if batch.find_publishes:
+            # and find the publishes for all searches with a single query:
+            batch.find_publishes_search_ids = [search.id for search in searches]
+            batch.find_publishes_task = self._add_task(self._task_find_batch_publishes, TaskLimiter.SHOTGUN,
+                                                       group=batch.id,
+                                                       priority=AsyncFileFinder._FIND_PUBLISHES_PRIORITY,
+                                                       task_kwargs = {
+                                                           "environments":[batch.work_areas[search.id]
+                                                                           for search in searches]
+                                                       })
+
+    def _on_batch_task_completed(self, batch, task_id, result):
+        """
+        Distribute the results of a task shared by the searches in a batch to the searches.
+
+        Runs in main thread
+
+        :param batch:   The _SearchBatch the task was run for
+        :param task_id: The id of the task that completed
+        :param result:  The result of the task
+        """
+        if task_id in batch.find_work_files_tasks:
+            user_id, search_ids = batch.find_work_files_tasks.pop(task_id)
+            dir_entries = result.get("dir_entries")
+            for search_id, (work_files, index_scan) in zip(search_ids, result.get("work_files", [])):
+                search = self._searches.get(search_id)
+                if not search:
+                    continue
+                search.awaiting_batch_users.discard(user_id)
+                self._add_process_work_files_tasks(search, user_id, search.user_work_areas[user_id],
+                                                   task_kwargs = {"work_files":work_files,
+                                                                  "dir_entries":dir_entries,
+                                                                  "index_scan":index_scan})
+
+        elif task_id == batch.find_publishes_task:
+            batch.find_publishes_task = None
+            for search_id, sg_publishes in zip(batch.find_publishes_search_ids, result.get("sg_publishes", [])):
+                search = self._searches.get(search_id)
+                if not search:
+                    continue
+                search.publish_model_refreshed = True
+                self._begin_search_process_publishes(search, sg_publishes)
+
+        if not batch.find_work_files_tasks and not batch.find_publishes_task:
+            # all results have been distributed:
+            del self._batches[batch.id]
+            self._cancel_tokens.pop(batch.id, None)
+
+    def _stop_batch(self, batch):
+        """
+        Stop all tasks shared by the searches in a batch.
+
+        :param batch:   The _SearchBatch to stop
+        """
+        if self._batches.pop(batch.id, None):
+            self._stop_task_group(batch.id)
+
+    def _stop_task_group(self, group):
+        """
+        Stop all tasks for a search or batch and cancel its token so that any tasks that are
+        already running stop as soon as they next check it.
+
+        :param group:   The id of the search or batch to stop the tasks for
+        """
+        self._task_manager.stop_task_group(group)
+        cancel_token = self._cancel_tokens.pop(group, None)
+        if cancel_token:
+            cancel_token.cancel()
 
     ################################################################################################
     ################################################################################################
@@ -925,6 +2030,15 @@ class AsyncFileFinder(FileFinder):
             work_area = WorkArea(context)
         return {"environment": work_area}
 
+    def _task_find_work_files_in_directories(self, environment, directories, cancel_token=None, **kwargs):
+        """
+        Find the work files for a work area that are in a list of directories or their subdirectories.
+        """
+        work_items, searched_directories = self._find_work_file_details_in_directories(environment,
+                                                                                        directories,
+                                                                                        cancel_token)
+        return {"environment":environment, "work_items":work_items, "directories":searched_directories}
+
     def _task_resolve_sandbox_users(self, environment, **kwargs):
         """
         """
@@ -936,6 +2050,35 @@ class AsyncFileFinder(FileFinder):
         """
         Runs in main thread.
         """
+        publish_filters = self._get_publish_filters(work_area)
+
+        # load the data into the publish model:
+        search.publish_model.load_data(filters=publish_filters, fields=FileFinder._PUBLISH_FIELDS)
+        return self._freeze_publishes(search.publish_model.get_sg_data())
+
+    def _freeze_publishes(self, sg_data):
+        """
+        Convert the publishes retrieved from the publish model into immutable records that can be
+        shared by all users and tasks processing them.
+
+        :param sg_data: The list of publish dictionaries retrieved from the publish model
+        :returns:       A list of FrozenDict publish records
+        """
+        sg_publishes = []
+        for sg_publish in sg_data:
+            # convert created_at unix time stamp to shotgun std time stamp:
+            created_at = sg_publish.get("created_at")
+            if created_at and not isinstance(created_at, datetime):
+                sg_publish = dict(sg_publish)
+                sg_publish["created_at"] = datetime.fromtimestamp(created_at, sg_timezone.LocalTimezone())
+            sg_publishes.append(freeze_value(sg_publish))
+        return sg_publishes
+
+    def _get_publish_filters(self, work_area):
+        """
+        :param work_area:   The WorkArea to find publishes for
+        :returns:           The list of Shotgun filters used to find the publishes for the work area
+        """
         publish_filters = []
         # If there is no entity in the context then we are trying to load the publishes from the project.
         publish_filters.append(["entity", "is", work_area.context.entity or work_area.context.project])
@@ -943,11 +2086,67 @@ class AsyncFileFinder(FileFinder):
             publish_filters.append(["task", "is", work_area.context.task])
         elif work_area.context.step:
             publish_filters.append(["task.Task.step", "is", work_area.context.step])
-        fields = ["id", "description", "version_number", "image", "created_at", "created_by", "name", "path", "task"]
+        return publish_filters
 
-        # load the data into the publish model:
-        search.publish_model.load_data(filters=publish_filters, fields=fields)
-        return copy.deepcopy(search.publish_model.get_sg_data())
+    def _task_find_batch_work_files(self, environments, cancel_token=None, **kwargs):
+        """
+        Find the work files for all work areas in a batch, walking the filesystem once for all
+        work areas that share a work template.
+        """
+        dir_entries = {}
+        work_files = self._find_work_files_for_work_areas(environments, dir_entries, self._begin_index_scan,
+                                                          cancel_token)
+        return {"work_files":work_files, "dir_entries":dir_entries}
+
+    def _task_find_batch_publishes(self, environments, **kwargs):
+        """
+        Find the publishes for all work areas in a batch with a single query and partition them
+        by Task.  All work areas in a batch are for Tasks.
+        """
+        published_file_type = sgtk.util.get_published_file_entity_type(self._app.sgtk)
+        tasks = [work_area.context.task for work_area in environments]
+        sg_publishes = self._app.shotgun.find(
+            published_file_type, [["task", "in", tasks]], FileFinder._PUBLISH_FIELDS + ["entity"]
+        )
+
+        publishes_by_task = {}
+        for sg_publish in sg_publishes:
+            sg_task = sg_publish.get("task")
+            if sg_task:
+                publishes_by_task.setdefault(sg_task["id"], []).append(freeze_value(sg_publish))
+
+        # match the filters used when searching for the publishes of each work area individually:
+        results = []
+        for work_area in environments:
+            entity = work_area.context.entity or work_area.context.project
+            results.append([p for p in publishes_by_task.get(work_area.context.task["id"], [])
+                             if p.get("entity") and entity
+                             and (p["entity"]["type"], p["entity"]["id"]) == (entity["type"], entity["id"])])
+        return {"sg_publishes":results}
+
+    def _task_query_publishes(self, environment, **kwargs):
+        """
+        Query Shotgun for the publishes of the work area.
+        """
+        sg_publishes = self._find_publishes(self._get_publish_filters(environment))
+        return {"sg_publishes":self._freeze_publishes(sg_publishes), "environment":environment}
+
+    def _task_load_stored_publishes(self, environment, **kwargs):
+        """
+        Load the publishes stored for the work area in the publish store.
+        """
+        sg_publishes, revision = self._publish_store.load(self._get_publish_filters(environment),
+                                                          FileFinder._PUBLISH_FIELDS)
+        return {"sg_publishes":sg_publishes, "revision":revision, "environment":environment}
+
+    def _task_sync_publishes(self, environment, **kwargs):
+        """
+        Synchronise the publishes stored for the work area with Shotgun, only querying publishes
+        that have changed since the last time they were synchronised.
+        """
+        sg_publishes, revision = self._publish_store.sync(self._get_publish_filters(environment),
+                                                          FileFinder._PUBLISH_FIELDS)
+        return {"sg_publishes":sg_publishes, "revision":revision, "environment":environment}
 
     def _task_filter_publishes(self, sg_publishes, environment, **kwargs):
         """
@@ -955,20 +2154,13 @@ class AsyncFileFinder(FileFinder):
         #time.sleep(5)
         filtered_publishes = []
         if sg_publishes and environment and environment.publish_template and environment.context:
-
-            # convert created_at unix time stamp to shotgun std time stamp for all publishes
-            for sg_publish in sg_publishes:
-                created_at = sg_publish.get("created_at")
-                if created_at:
-                    created_at = datetime.fromtimestamp(created_at, sg_timezone.LocalTimezone())
-                    sg_publish["created_at"] = created_at
-
+            # Note, publishes are immutable records shared by all users so they are never modified
             filtered_publishes = self._filter_publishes(sg_publishes, 
                                                         environment.publish_template, 
                                                         environment.valid_file_extensions)
-        return {"sg_publishes":filtered_publishes}    
+        return {"sg_publishes":filtered_publishes, "environment":environment}
 
-    def _task_process_publish_items(self, sg_publishes, environment, name_map, **kwargs):
+    def _task_process_publish_items(self, sg_publishes, environment, name_map, cancel_token=None, **kwargs):
         """
         """
         publish_items = {}
@@ -979,29 +2171,99 @@ class AsyncFileFinder(FileFinder):
                                                       environment.work_template, 
                                                       environment.context,
                                                       name_map,
-                                                      environment.version_compare_ignore_fields)
+                                                      environment.version_compare_ignore_fields,
+                                                      cancel_token=cancel_token)
         return {"publish_items":publish_items, "environment":environment}
 
-    def _task_find_work_files(self, environment, **kwargs):
+    def _task_find_work_files(self, environment, cancel_token=None, **kwargs):
         """
         """
         work_files = []
+        dir_entries = {}
+        index_scan = None
         if (environment and environment.context and environment.work_template):
+            index_scan = self._begin_index_scan(environment)
             work_files = self._find_work_files(environment.context, 
                                                environment.work_template, 
-                                               environment.version_compare_ignore_fields)
-        return {"work_files":work_files}
+                                               environment.version_compare_ignore_fields,
+                                               dir_entries,
+                                               index_scan,
+                                               cancel_token)
+        return {"work_files":work_files, "dir_entries":dir_entries, "index_scan":index_scan}
 
 
-    def _task_filter_work_files(self, work_files, environment, **kwargs):
+    def _task_find_work_file_batch(self, environment, work_file_iter=None, walk_entries=None, index_scan=None,
+                                   cancel_token=None, **kwargs):
+        """
+        Find the next batch of work files.  The first batch starts the walk of the work area and
+        each subsequent batch continues it from where the previous batch stopped.
+        """
+        work_files = []
+        dir_entries = {}
+        if work_file_iter is None:
+            walk_entries = {}
+            if (environment and environment.context and environment.work_template):
+                index_scan = self._begin_index_scan(environment)
+                work_file_iter = self._iter_work_files(environment.context,
+                                                       environment.work_template,
+                                                       environment.version_compare_ignore_fields,
+                                                       walk_entries,
+                                                       index_scan,
+                                                       cancel_token)
+        if work_file_iter is not None:
+            work_files = list(itertools.islice(work_file_iter, self._work_file_batch_size))
+            # hand over the directory entries for just the paths in this batch:
+            for path in work_files:
+                if path in walk_entries:
+                    dir_entries[path] = walk_entries.pop(path)
+        is_final = len(work_files) < self._work_file_batch_size
+        return {"work_files":work_files, "dir_entries":dir_entries, "is_final":is_final,
+                "work_file_iter":None if is_final else work_file_iter,
+                "walk_entries":None if is_final else walk_entries,
+                "index_scan":index_scan, "environment":environment}
+
+    def _begin_index_scan(self, environment):
+        """
+        Begin a scan of the work file index for a work area if the index is enabled.
+
+        :param environment: The WorkArea to begin the scan for
+        :returns:           A WorkFileIndexScan instance or None if the index isn't used
+        """
+        # the index is only used when walking the filesystem directly:
+        index = get_work_file_index() if self._use_template_walker else None
+        if not index:
+            return None
+        return index.begin_scan(
+            build_index_signature(environment.work_template, environment.version_compare_ignore_fields)
+        )
+
+    def _task_filter_work_files(self, work_files, environment, dir_entries=None, index_scan=None, **kwargs):
         """
         """
         filtered_work_files = []
         if work_files:
             filtered_work_files = self._filter_work_files(work_files, environment.valid_file_extensions)
-        return {"work_files":filtered_work_files}
+        return {"work_files":filtered_work_files, "dir_entries":dir_entries, "index_scan":index_scan,
+                "environment":environment}
+
+    def _task_gather_file_metadata(self, environment, work_files=None, sg_publishes=None, dir_entries=None,
+                                   index_scan=None, cancel_token=None, **kwargs):
+        """
+        Gather the filesystem metadata for either work files or publishes with a single
+        stat per path.
+        """
+        files = work_files if work_files is not None else sg_publishes
+        num_stats = self._gather_file_metadata(files or [], dir_entries, cancel_token)
+        result = {"environment":environment, "stat_count":num_stats}
+        if work_files is not None:
+            result["work_files"] = work_files
+            result["index_scan"] = index_scan
+        else:
+            result["sg_publishes"] = sg_publishes
+        return result
 
-    def _task_process_work_items(self, work_files, environment, name_map, **kwargs):
+    def _task_process_work_items(self, work_files, environment, name_map, index_scan=None, cancel_token=None,
+                                 **kwargs):
         """
         """
         work_items = {}
@@ -1011,7 +2273,12 @@ class AsyncFileFinder(FileFinder):
                                                   environment.work_template, 
                                                   environment.context,
                                                   name_map,
-                                                  environment.version_compare_ignore_fields)
+                                                  environment.version_compare_ignore_fields,
+                                                  index_scan=index_scan,
+                                                  cancel_token=cancel_token)
+        if index_scan:
+            # reconcile the index with the results of the search:
+            index_scan.commit()
         return {"work_items":work_items, "environment":environment}
 
 
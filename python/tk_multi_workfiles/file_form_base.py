@@ -35,6 +35,8 @@ from .actions.new_task_action import NewTaskAction
 from .user_cache import g_user_cache
 from .util import monitor_qobject_lifetime, resolve_filters, get_sg_entity_name_field
 from .step_list_filter import get_saved_step_filter
+from .path_cache_sync import get_path_cache_sync_scheduler
+from .task_limiter import get_task_limits, get_required_threads, release_task_limiter
 
 
 class FileFormBase(QtGui.QWidget):
@@ -53,8 +55,10 @@ class FileFormBase(QtGui.QWidget):
         self._current_file = None
 
         # create a single instance of the task manager that manages all
-        # asynchrounous work/tasks.
-        self._bg_task_manager = BackgroundTaskManager(self, max_threads=8)
+        # asynchrounous work/tasks.  If the file finder limits its tasks by resource class then
+        # enough threads are needed for each class to reach its limit:
+        max_threads = get_required_threads(get_task_limits(), 8)
+        self._bg_task_manager = BackgroundTaskManager(self, max_threads=max_threads)
         monitor_qobject_lifetime(self._bg_task_manager, "Main task manager")
         self._bg_task_manager.start_processing()
 
@@ -65,6 +69,12 @@ class FileFormBase(QtGui.QWidget):
         self._entity_models = self._build_entity_models()
         self._file_model = self._build_file_model()
 
+        # if the path cache is synchronized in the background then searches may start before
+        # it is up to date:
+        self._path_cache_sync_scheduler = get_path_cache_sync_scheduler()
+        if self._path_cache_sync_scheduler:
+            self._path_cache_sync_scheduler.sync_completed.connect(self._on_path_cache_sync_completed)
+
         # add refresh action with appropriate keyboard shortcut:
         refresh_action = QtGui.QAction("Refresh", self)
         refresh_action.setShortcut(QtGui.QKeySequence(QtGui.QKeySequence.Refresh))
@@ -86,6 +96,10 @@ class FileFormBase(QtGui.QWidget):
         :param event:   Close event
         """
 
+        if self._path_cache_sync_scheduler:
+            self._path_cache_sync_scheduler.sync_completed.disconnect(self._on_path_cache_sync_completed)
+            self._path_cache_sync_scheduler = None
+
         # clear up the various data models:
         if self._file_model:
             self._file_model.destroy()
@@ -98,6 +112,7 @@ class FileFormBase(QtGui.QWidget):
         # and shut down the task manager
         if self._bg_task_manager:
             shotgun_globals.unregister_bg_task_manager(self._bg_task_manager)
+            release_task_limiter(self._bg_task_manager)
             self._bg_task_manager.shut_down()
             self._bg_task_manager = None
 
@@ -270,12 +285,27 @@ class FileFormBase(QtGui.QWidget):
 
         :param checked:    True if the refresh action is checked - ignored
         """
-        app = sgtk.platform.current_bundle()
-        app.log_debug("Synchronizing remote path cache...")
-        app.sgtk.synchronize_filesystem_structure()
-        app.log_debug("Path cache up to date!")
+        if self._path_cache_sync_scheduler:
+            # sync in the background and refresh straight away:
+            self._path_cache_sync_scheduler.request_sync()
+        else:
+            app = sgtk.platform.current_bundle()
+            app.log_debug("Synchronizing remote path cache...")
+            app.sgtk.synchronize_filesystem_structure()
+            app.log_debug("Path cache up to date!")
         self._refresh_all_async()
 
+    def _on_path_cache_sync_completed(self, paths_synced):
+        """
+        Slot triggered when a background sync of the path cache has completed.  If any paths
+        were synchronized then the file searches are re-validated as they may have started before
+        the path cache was up to date.
+
+        :param paths_synced:    True if any paths were synchronized
+        """
+        if paths_synced and self._file_model:
+            self._file_model.async_refresh()
+
     def _refresh_all_async(self):
         """
         Asynchrounously refresh all models.
@@ -11,16 +11,235 @@
 import sgtk
 from sgtk.platform.qt import QtGui
 
+from tank_vendor.shotgun_api3 import sg_timezone
+
 import os
+import threading
+import weakref
 from datetime import datetime, timedelta
-import copy
+
+from .badge_service import g_badge_service
+from .util import FrozenDict, freeze_value, thaw_value
+
+# The work file and publish details fields that are stored positionally by PackedFileDetails, in
+# the order they are stored.  Any other fields are stored in a dictionary.
+_DETAIL_FIELDS = ("name", "version", "entity", "task", "step", "thumbnail", "description",
+                  "modified_at", "modified_by", "editable", "editable_reason", "publish_description",
+                  "published_at", "published_by", "published_file_entity_id")
+_DETAIL_INDICES = dict([(name, idx) for idx, name in enumerate(_DETAIL_FIELDS)])
+(_NAME, _VERSION, _ENTITY, _TASK, _STEP, _THUMBNAIL, _DESCRIPTION, _MODIFIED_AT, _MODIFIED_BY,
+ _EDITABLE, _EDITABLE_REASON, _PUBLISH_DESCRIPTION, _PUBLISHED_AT, _PUBLISHED_BY,
+ _PUBLISHED_FILE_ENTITY_ID) = range(len(_DETAIL_FIELDS))
+# the bitmask of the fields that are present and the dictionary of other fields follow the
+# positional fields:
+_PRESENT_MASK = len(_DETAIL_FIELDS)
+_OTHER_FIELDS = _PRESENT_MASK + 1
+
+
+def _to_datetime(value):
+    """
+    :param value:   A date/time value from a details dictionary - either a datetime or a
+                    timestamp as returned by os.stat()
+    :returns:       The value as a datetime
+    """
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value, tz=sg_timezone.local)
+    return value
+
+
+class PackedFileDetails(tuple):
+    """
+    Compact, immutable representation of a work file or publish details dictionary.  The common
+    fields are stored positionally so that the field names aren't stored for every file and
+    modified times can be stored as the timestamp returned by os.stat() rather than as a datetime.
+    Instances can be shared between FileItems.
+
+    Use pack_file_details() to create instances.
+    """
+    __slots__ = ()
+
+    def get(self, index, default=None):
+        """
+        :param index:   The index of the field in _DETAIL_FIELDS
+        :param default: The value to return if the field isn't present
+        :returns:       The value of the field
+        """
+        if self[_PRESENT_MASK] & (1 << index):
+            return self[index]
+        return default
+
+    def unpack(self):
+        """
+        :returns:   A FrozenDict containing the details.  Timestamps are converted to datetimes.
+        """
+        present = self[_PRESENT_MASK]
+        details = dict([(name, self[idx]) for idx, name in enumerate(_DETAIL_FIELDS)
+                        if present & (1 << idx)])
+        if "modified_at" in details:
+            details["modified_at"] = _to_datetime(details["modified_at"])
+        if self[_OTHER_FIELDS]:
+            details.update(self[_OTHER_FIELDS])
+        return FrozenDict(details)
+
+
+_EMPTY_DETAILS = PackedFileDetails([None] * len(_DETAIL_FIELDS) + [0, None])
+
+
+def pack_file_details(details, frozen_values=None):
+    """
+    Pack a work file or publish details dictionary into a PackedFileDetails instance.  The values
+    are frozen so that they can be shared safely.
+
+    :param details:         The details dictionary to pack.  The 'modified_at' field may be a
+                            timestamp as returned by os.stat() rather than a datetime.
+    :param frozen_values:   An optional dictionary of {id(value):(value, frozen value)} used to
+                            share frozen values, e.g. entities and users, across all of the
+                            details packed in a batch.  The original values are stored with the
+                            frozen values so that their ids can't be reused whilst the dictionary
+                            is in use.
+    :returns:               A PackedFileDetails instance
+    """
+    if isinstance(details, PackedFileDetails):
+        return details
+    if not details:
+        return _EMPTY_DETAILS
+
+    if frozen_values is None:
+        frozen_values = {}
+    values = [None] * len(_DETAIL_FIELDS)
+    present = 0
+    other_fields = None
+    for name, value in details.iteritems():
+        if isinstance(value, (dict, list)):
+            original, frozen = frozen_values.get(id(value), (None, None))
+            if original is not value:
+                frozen = freeze_value(value)
+                frozen_values[id(value)] = (value, frozen)
+            value = frozen
+        idx = _DETAIL_INDICES.get(name)
+        if idx is not None:
+            values[idx] = value
+            present |= 1 << idx
+        else:
+            if other_fields is None:
+                other_fields = {}
+            other_fields[intern(name) if isinstance(name, str) else name] = value
+    values.append(present)
+    values.append(FrozenDict(other_fields) if other_fields else None)
+    return PackedFileDetails(values)
+
+
+class FileKeyBuilder(object):
+    """
+    Builds unique file keys for a single template and list of ignore fields.  The relevant key
+    names and default values are computed once and the keys built are interned so that all
+    equal keys share a single tuple instance, which keeps comparisons in dictionaries cheap.
+
+    Builders are shared per template and list of ignore fields - use FileKeyBuilder.get()
+    rather than constructing them directly.
+    """
+    # {template:{(definition, ignore fields):FileKeyBuilder}} - weak so that builders are released
+    # along with the templates when the pipeline configuration is reloaded:
+    _builders = weakref.WeakKeyDictionary()
+    _builders_lock = threading.Lock()
+
+    @staticmethod
+    def get(template, ignore_fields=None):
+        """
+        Get the key builder for the specified template and ignore fields, creating it if needed.
+
+        :param template:        The template that represents the files the keys will be used to compare
+        :param ignore_fields:   A list of fields to ignore when constructing keys.  This list is not
+                                modified.
+        :returns:               A FileKeyBuilder instance
+        """
+        cache_key = (template.definition, tuple(sorted(ignore_fields or [])))
+        with FileKeyBuilder._builders_lock:
+            template_builders = FileKeyBuilder._builders.setdefault(template, {})
+            builder = template_builders.get(cache_key)
+            if not builder:
+                builder = FileKeyBuilder(template, ignore_fields)
+                template_builders[cache_key] = builder
+            return builder
+
+    def __init__(self, template, ignore_fields=None):
+        """
+        Construction
+
+        :param template:        The template that represents the files the keys will be used to compare
+        :param ignore_fields:   A list of fields to ignore when constructing keys
+        """
+        # always want to ignore 'version' and 'extension' if they are present in the fields
+        # dictionary
+        ignore_fields = set(ignore_fields or [])
+        ignore_fields.update(["version", "extension"])
+
+        template_keys = template.keys
+        self._key_names = frozenset([name for name in template_keys if name not in ignore_fields])
+        # 'default' values from the template that aren't explicitely ignored:
+        self._defaults = [(key.name, key.default) for key in template_keys.values()
+                          if key.name not in ignore_fields and key.default != None]
+        self._interned_keys = {}
+        self._names = {}
+
+    def build(self, fields):
+        """
+        Build the file key for the specified fields - see FileItem.build_file_key for details.
+
+        :param fields:  A dictionary of fields extracted from a file path
+        :returns:       An interned tuple representing the key
+        """
+        # start with the defaults and then populate the file key from the fields passed in that
+        # are included in the template, skipping the ignore fields:
+        file_key = dict(self._defaults)
+        key_names = self._key_names
+        for name, value in fields.iteritems():
+            if name in key_names:
+                file_key[name] = value
+
+        # return an immutable representation of the sorted dictionary:
+        # e.g. (('sequence', 'Sequence01'), ('shot', 'shot_010'), ('name', 'foo'))
+        return self.intern(tuple(sorted(file_key.iteritems())))
+
+    def intern(self, file_key):
+        """
+        :param file_key:    A file key built previously, e.g. one restored from a persistent cache
+        :returns:           The shared instance of the key
+        """
+        return self._interned_keys.setdefault(file_key, file_key)
+
+    def get_name(self, file_key):
+        """
+        :param file_key:    The file key to get the name for
+        :returns:           The name previously generated for the file key or None
+        """
+        return self._names.get(file_key)
+
+    def set_name(self, file_key, name):
+        """
+        Remember the name generated for a file key.  The first name set for a key is kept.
+
+        :param file_key:    The file key to set the name for
+        :param name:        The name generated for the file key
+        :returns:           The name to use for the file key
+        """
+        return self._names.setdefault(file_key, name)
+
 
 class FileItem(object):
     """
     Encapsulate details about a single version of a work file/publish.  Each instance represents
     a single 'version' but will contain details about both the work/local file and the publish
     for that file if available.
+
+    Instances are kept compact as there can be tens of thousands of them for large work areas.
+    The details are stored as PackedFileDetails that are shared with the FileItems they were
+    merged from and the modified time of a work file is only converted to a datetime when it's
+    requested.
     """
+    __slots__ = ("_key", "_is_local", "_path", "_packed_details", "_is_published", "_publish_path",
+                 "_packed_publish_details", "_thumbnail_path", "_thumbnail_image", "_badge",
+                 "_badge_generated", "_versions", "__weakref__")
 
     @staticmethod
     def build_file_key(fields, template, ignore_fields = None):
@@ -53,41 +272,11 @@ class FileItem(object):
         :param ignore_fields:   A list of fields to ignore when constructing the key.
                                 Typically this will contain at least 'version' but it 
                                 may also contain other fields (e.g. user initials in
-                                the file name).
+                                the file name).  This list is not modified.
         :returns:               An immutable 'key' that can be used for comparison and
                                 as the key in a dictionary (e.g. a string).
         """
-        ignore_fields = ignore_fields or []
-        # always want to ignore 'version' and 'extension' if they are present in the fields
-        # dictionary
-        ignore_fields += ["version", "extension"]
-
-        # populate the file key from the fields passed in that are included in
-        # the template, skipping the ignore fields:
-        file_key = {}
-        template_keys = template.keys
-        for name, value in fields.iteritems():
-            if name in ignore_fields:
-                # skip fields that are explicitly ignored
-                continue
-
-            if name not in template_keys:
-                # skip fields that aren't included in the template
-                continue
-
-            file_key[name] = value
-
-        # add in any 'default' values from the template that aren't explicitely ignored
-        # or weren't specified in the input fields:
-        for key in template_keys.values():
-            if (key.name not in ignore_fields
-                and key.default != None
-                and key.name not in file_key):
-                file_key[key.name] = key.default 
-
-        # return an immutable representation of the sorted dictionary:
-        # e.g. (('sequence', 'Sequence01'), ('shot', 'shot_010'), ('name', 'foo'))
-        return tuple(sorted(file_key.iteritems()))
+        return FileKeyBuilder.get(template, ignore_fields).build(fields)
 
     def __init__(self, key, is_work_file=False, work_path=None, work_details=None, 
                  is_published=False, publish_path=None, publish_details=None):
@@ -97,35 +286,57 @@ class FileItem(object):
         :param key:             Unique key representing all versions of this file
         :param is_work_file:    True if this instance represents a work file
         :param work_path:       Work path on disk of this file
-        :param work_details:    Dictionary containing additional information about this work file
+        :param work_details:    Dictionary or PackedFileDetails containing additional information
+                                about this work file
         :param is_published:    True if this instance represents a published file
         :param publish_path:    Publish path on disk of this file
-        :param publish_details: Dictionary containing additional information about this publish
+        :param publish_details: Dictionary or PackedFileDetails containing additional information
+                                about this publish
         :param badge:           QPixmap icon that should be displayed as a badge
         """
         self._key = key
 
         self._is_local = is_work_file
         self._path = work_path
-        self._details = work_details or {}
+        self._packed_details = pack_file_details(work_details)
 
         self._is_published = is_published
         self._publish_path = publish_path
-        self._publish_details = publish_details or {}
+        self._packed_publish_details = pack_file_details(publish_details)
 
         self._thumbnail_path = None
         self._thumbnail_image = None
 
         self._badge = None
-        # Generate the badge for this FileIte.  This needs to be done in the main thread
-        # since the badge is a QPixmap.
-        sgtk.platform.current_engine().async_execute_in_main_thread(self.generate_badge)
+        self._badge_generated = False
+        # Request the badge for this FileItem.  Badges are generated in batches in the main
+        # thread since the badge is a QPixmap.
+        g_badge_service.request(self)
 
-        self._versions = {}
+        # the versions are only set for the FileItems shown in the file views:
+        self._versions = None
 
     # ------------------------------------------------------------------------------------------
     # General properties
 
+    @property
+    def _details(self):
+        """
+        :returns:   A new dictionary containing the details of the work file that the caller (e.g.
+                    a get_badge hook) is free to modify.  This is built each time it's requested
+                    so shouldn't be used in performance critical code.
+        """
+        return thaw_value(self._packed_details.unpack())
+
+    @property
+    def _publish_details(self):
+        """
+        :returns:   A new dictionary containing the details of the publish that the caller (e.g.
+                    a get_badge hook) is free to modify.  This is built each time it's requested
+                    so shouldn't be used in performance critical code.
+        """
+        return thaw_value(self._packed_publish_details.unpack())
+
     @property
     def key(self):
         """
@@ -139,7 +350,7 @@ class FileItem(object):
         :returns:   The name that identifies this file.  This is either the name specified in
                     the details dictionary or if not specified then the file base name
         """
-        n = self._details.get("name") or self._publish_details.get("name")
+        n = self._packed_details[_NAME] or self._packed_publish_details[_NAME]
         if not n and self._path:
             n = os.path.basename(self._path)
         return n
@@ -149,28 +360,28 @@ class FileItem(object):
         """
         :returns:   The version number of this file
         """
-        return self._details.get("version") or self._publish_details.get("version", 0)
+        return self._packed_details[_VERSION] or self._packed_publish_details.get(_VERSION, 0)
 
     @property
     def entity(self):
         """
         :returns:   The Shotgun entity dictionary that this file is associated with
         """
-        return self._details.get("entity") or self._publish_details.get("entity")
+        return self._packed_details[_ENTITY] or self._packed_publish_details[_ENTITY]
 
     @property
     def task(self):
         """
         :returns:   The Shotgun task entity dictionary that this file is associated with.
         """
-        return self._details.get("task") or self._publish_details.get("task")
+        return self._packed_details[_TASK] or self._packed_publish_details[_TASK]
 
     @property
     def step(self):
         """
         :returns:   The Shotgun step entity dictionary that this file is associated with.
         """
-        return self._details.get("step") or self._publish_details.get("step")
+        return self._packed_details[_STEP] or self._packed_publish_details[_STEP]
 
     #@property
     def _get_thumbnail_path(self):
@@ -178,7 +389,8 @@ class FileItem(object):
         :returns:   The path on disk of the thumbnail for this file
         """
         if self._thumbnail_path is None:
-            self._thumbnail_path = self._details.get("thumbnail") or self._publish_details.get("thumbnail")
+            self._thumbnail_path = (self._packed_details[_THUMBNAIL]
+                                    or self._packed_publish_details[_THUMBNAIL])
         return self._thumbnail_path
     #@thumbnail_path.setter
     def _set_thumbnail_path(self, value):
@@ -210,7 +422,7 @@ class FileItem(object):
         :returns:   A dictionary of {version:FileItem} containing a map of all other
                     versions of this file
         """
-        return self._versions
+        return self._versions if self._versions is not None else {}
     #@versions.setter
     def _set_versions(self, value):
         """
@@ -221,6 +433,9 @@ class FileItem(object):
     versions=property(_get_versions, _set_versions)
 
     def generate_badge(self):
+        """
+        Generate the badge for this file immediately.  Must be called from the main thread.
+        """
         self._badge = None
         app = sgtk.platform.current_bundle()
         if self._is_local:
@@ -258,19 +473,8 @@ class FileItem(object):
 
         if isinstance(self._badge, QtGui.QColor):
             # If the hook returned a QColor, we'll create a dot badge of that color.
-            try:
-                self._badge = app.execute_hook_method(
-                    "hook_get_badge",
-                    "generate_badge_pixmap",
-                    badge_color=self._badge
-                )
-            except Exception:
-                # Capture exceptions raised here and log them, so as not to break
-                # the app if the hook fails.
-                app.logger.warning(
-                    "Exception raised in hook while executing generate_badge_pixmap.",
-                    exc_info=True
-                )
+            self._badge = g_badge_service.get_color_pixmap(self._badge)
+        self._badge_generated = True
 
     @property
     def badge(self):
@@ -287,6 +491,7 @@ class FileItem(object):
                         to the user.
         """
         self._badge = value
+        self._badge_generated = True
 
     # ------------------------------------------------------------------------------------------
     # Work file properties
@@ -310,7 +515,7 @@ class FileItem(object):
         """
         :returns:   A datetime instance containing the last modified date of the local/work file
         """
-        return self._details.get("modified_at")
+        return _to_datetime(self._packed_details[_MODIFIED_AT])
 
     @property
     def modified_by(self):
@@ -318,21 +523,21 @@ class FileItem(object):
         :returns:   A Shotgun entity dictionary representing the user who last modified this local/work
                     file
         """
-        return self._details.get("modified_by")
+        return self._packed_details[_MODIFIED_BY]
 
     @property
     def editable(self):
         """
         :returns:   True if the local.work file is editable, otherwise False
         """
-        return self._details.get("editable", True)
+        return self._packed_details.get(_EDITABLE, True)
 
     @property
     def not_editable_reason(self):
         """
         :returns:   A string describing the reason the local/work file is not editable
         """
-        return self._details.get("editable_reason") or ""
+        return self._packed_details[_EDITABLE_REASON] or ""
 
     # ------------------------------------------------------------------------------------------
     # Published file properties
@@ -357,32 +562,58 @@ class FileItem(object):
         :returns:   The id of the PublishedFile entity in Shotgun that represents this published
                     file
         """
-        return self._publish_details.get("published_file_entity_id")
+        return self._packed_publish_details[_PUBLISHED_FILE_ENTITY_ID]
 
     @property
     def publish_description(self):
         """
         :returns:   The Shotgun description of this published file
         """
-        return self._publish_details.get("publish_description")
+        return self._packed_publish_details[_PUBLISH_DESCRIPTION]
 
     @property
     def published_at(self):
         """
         :returns:   A datetime instance containing the date this published file was published
         """
-        return self._publish_details.get("published_at")
+        return self._packed_publish_details[_PUBLISHED_AT]
 
     @property
     def published_by(self):
         """
         :returns:   A Shotgun entity dictionary representing the user who published this file
         """
-        return self._publish_details.get("published_by")
+        return self._packed_publish_details[_PUBLISHED_BY]
 
     # ------------------------------------------------------------------------------------------
     # Public methods
 
+    def copy(self):
+        """
+        Create a copy of this instance that can be modified independently, e.g. to store in or
+        retrieve from a cache shared by several models.  The details are immutable so are shared
+        with the copy but the versions, which are specific to the model the item is shown in,
+        aren't copied.
+
+        :returns:   A new FileItem instance
+        """
+        file_item = FileItem.__new__(FileItem)
+        file_item._key = self._key
+        file_item._is_local = self._is_local
+        file_item._path = self._path
+        file_item._packed_details = self._packed_details
+        file_item._is_published = self._is_published
+        file_item._publish_path = self._publish_path
+        file_item._packed_publish_details = self._packed_publish_details
+        file_item._thumbnail_path = self._thumbnail_path
+        file_item._thumbnail_image = self._thumbnail_image
+        file_item._badge = self._badge
+        file_item._badge_generated = self._badge_generated
+        if not self._badge_generated:
+            g_badge_service.request(file_item, from_publish=self._is_published)
+        file_item._versions = None
+        return file_item
+
     def update_from_publish(self, publish):
         """
         Update this instance with details from the specified publish FileItem
@@ -392,8 +623,15 @@ class FileItem(object):
         """
         self._is_published = publish._is_published
         self._publish_path = publish._publish_path
-        self._publish_details = copy.deepcopy(publish._publish_details or {})
-        self._badge = publish._badge
+        # details are immutable so can be shared with the publish:
+        self._packed_publish_details = publish._packed_publish_details
+        if publish._badge_generated:
+            self._badge = publish._badge
+            self._badge_generated = True
+        else:
+            # the publish item is usually discarded once merged so generate
+            # the publish badge for this item instead:
+            g_badge_service.request(self, from_publish=True)
 
     def update_from_work_file(self, work_file):
         """
@@ -404,7 +642,8 @@ class FileItem(object):
         """
         self._is_local = work_file._is_local
         self._path = work_file._path
-        self._details = copy.deepcopy(work_file._details or {})
+        # details are immutable so can be shared with the work file:
+        self._packed_details = work_file._packed_details
 
     def set_not_work_file(self):
         """
@@ -464,8 +703,9 @@ class FileItem(object):
         else:
             details_str += "<br>"
 
-        if self.modified_at:
-            details_str += self._format_modified_date_time_str(self.modified_at)
+        modified_at = self.modified_at
+        if modified_at:
+            details_str += self._format_modified_date_time_str(modified_at)
         else:
             details_str += "<i>Unknown</i>"
 
@@ -482,7 +722,7 @@ class FileItem(object):
         else:
             return "<i>No description was entered for this publish</i>"
 
-    def format_tooltip(self):
+    def format_tooltip(self, latest_versions=None):
         """
         Format text for a tooltip containing all useful information about
         the file item.  Tooltips look something like this:
@@ -500,6 +740,10 @@ class FileItem(object):
             This file is not editable
             not editable reason
 
+        :param latest_versions: An optional tuple (latest version, latest published version) of
+                                FileItems for all versions of this file, e.g. as indexed by the
+                                FileSearchCache.  If not specified then these are found from the
+                                versions of this file.
         :returns:   Formatted rich-text string that can be used in a Tooltip for the file
                     item
         """
@@ -508,7 +752,14 @@ class FileItem(object):
         # figure out the latest version and the latest publish version:
         latest_version = self
         latest_publish_version = self if self.is_published else None
-        if self.versions:
+        if latest_versions:
+            max_version, max_publish_version = latest_versions
+            if max_version and max_version.version > latest_version.version:
+                latest_version = max_version
+            if max_publish_version and (not latest_publish_version
+                                        or max_publish_version.version > latest_publish_version.version):
+                latest_publish_version = max_publish_version
+        elif self.versions:
             max_version = max(self.versions.iterkeys())
             if max_version > latest_version.version:
                 latest_version = self.versions[max_version]
@@ -598,10 +849,15 @@ class FileItem(object):
             diff = self.published_at - other.published_at
         else:
             # both are local so compare modified times:
-            if not self.modified_at or not other.modified_at:
+            modified_at = self._packed_details[_MODIFIED_AT]
+            other_modified_at = other._packed_details[_MODIFIED_AT]
+            if not modified_at or not other_modified_at:
                 # can't compare!
                 return 0
-            diff = self.modified_at - other.modified_at
+            if isinstance(modified_at, float) and isinstance(other_modified_at, float):
+                # both are timestamps so can be compared without converting them:
+                return cmp(modified_at, other_modified_at)
+            diff = _to_datetime(modified_at) - _to_datetime(other_modified_at)
 
         zero = timedelta(seconds=0)
         if diff < zero:
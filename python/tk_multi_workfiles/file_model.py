@@ -8,6 +8,7 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
+import os
 import weakref
 
 import sgtk
@@ -15,12 +16,45 @@ from sgtk.platform.qt import QtGui, QtCore
 
 from .file_finder import AsyncFileFinder
 from .user_cache import g_user_cache
-from .file_search_cache import FileSearchCache
+from .file_search_cache import FileSearchCache, get_shared_search_cache
+from .work_area_watcher import WorkAreaWatcher
+from .search_prefetcher import SearchPrefetcher
 
 shotgun_data = sgtk.platform.import_framework("tk-framework-shotgunutils", "shotgun_data")
 ShotgunDataRetriever = shotgun_data.ShotgunDataRetriever
 
 
+def _get_row_ranges(rows):
+    """
+    Collapse a list of rows into ranges of contiguous rows.
+
+    :param rows:    A list of row numbers in any order
+    :returns:       A list of (first row, last row) tuples in ascending order
+    """
+    ranges = []
+    for row in sorted(set(rows)):
+        if ranges and row == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], row)
+        else:
+            ranges.append((row, row))
+    return ranges
+
+
+def _is_in_directories(path, directories):
+    """
+    :param path:        The path to check
+    :param directories: A set of directory paths
+    :returns:           True if the path is in, or below, one of the directories
+    """
+    directory = os.path.dirname(path)
+    while directory not in directories:
+        parent_directory = os.path.dirname(directory)
+        if parent_directory == directory:
+            return False
+        directory = parent_directory
+    return True
+
+
 class FileModel(QtGui.QStandardItemModel):
     """
     The FileModel maintains a model of all files (work files and publishes) found for a matrix of
@@ -216,6 +250,8 @@ class FileModel(QtGui.QStandardItemModel):
             self._search_msg = ""
             self._key = key
             self._work_area = work_area
+            # {file key:{file version:_FileModelItem}} for all file items under this group:
+            self._file_model_items = {}
 
         @property
         def key(self):
@@ -224,6 +260,16 @@ class FileModel(QtGui.QStandardItemModel):
             """
             return self._key
 
+        @property
+        def file_model_items(self):
+            """
+            :returns:   A dictionary of {file key:{file version:_FileModelItem}} containing all the
+                        file items under this group.  This is maintained by the model as file items
+                        are added and removed so that they can be found without iterating over
+                        every row in the group.
+            """
+            return self._file_model_items
+
         # @property
         def _get_work_area(self):
             """
@@ -318,7 +364,28 @@ class FileModel(QtGui.QStandardItemModel):
         self._current_users = [g_user_cache.current_user]
 
         self._in_progress_searches = {}
-        self._search_cache = FileSearchCache()
+        # if set, searches for a new set of entities are only started once the entity searches
+        # have stopped changing for the debounce interval, e.g. whilst the user is using the
+        # arrow keys to move through the entity tree:
+        self._search_debounce_timer = None
+        search_debounce_ms = self._app.get_setting("search_debounce_ms", 0)
+        if search_debounce_ms > 0:
+            self._search_debounce_timer = QtCore.QTimer(self)
+            self._search_debounce_timer.setSingleShot(True)
+            self._search_debounce_timer.setInterval(search_debounce_ms)
+            self._search_debounce_timer.timeout.connect(self._on_search_debounce_timeout)
+
+        # use the search cache shared by all models if enabled, otherwise the model has its own:
+        self._search_cache = get_shared_search_cache()
+        self._owns_search_cache = self._search_cache is None
+        if self._owns_search_cache:
+            self._search_cache = FileSearchCache(
+                max_entries=self._app.get_setting("search_cache_max_entries", 0),
+                max_size=self._app.get_setting("search_cache_max_size", 0) * 1024 * 1024
+            )
+        # work files received so far for searches that return them in batches,
+        # {(search id, user key):[FileItem]}:
+        self._partial_work_files = {}
 
         # self._current_item_map[search_id][file.key][file.version] = model._FileModelItem
         self._current_item_map = {}
@@ -333,6 +400,27 @@ class FileModel(QtGui.QStandardItemModel):
         self._finder.search_failed.connect(self._on_finder_search_failed)
         self._finder.work_area_resolved.connect(self._on_finder_work_area_resolved)
         self._finder.work_area_found.connect(self._on_finder_work_area_found)
+        self._finder.directory_files_found.connect(self._on_finder_directory_files_found)
+        self._finder.directory_search_failed.connect(self._on_finder_directory_search_failed)
+
+        # optionally prefetch the files for entities the user is likely to select next:
+        self._prefetcher = None
+        max_prefetches = self._app.get_setting("prefetch_visible_tasks", 0)
+        if max_prefetches > 0:
+            self._prefetcher = SearchPrefetcher(bg_task_manager, self._search_cache, max_prefetches, self)
+
+        # optionally watch the work areas for changes so that the model can be kept up-to-date:
+        self._watcher = None
+        # {group key:set(watched directories)}:
+        self._watched_group_directories = {}
+        # directories found when updating the files in changed directories that may not contain
+        # any work files yet, e.g. a new directory for a new work file name, {group key:set(directories)}:
+        self._found_group_directories = {}
+        # searches for the work files in changed directories, {search id:(group key, directories)}:
+        self._directory_searches = {}
+        if self._app.get_setting("watch_work_areas", False):
+            self._watcher = WorkAreaWatcher(self)
+            self._watcher.directories_changed.connect(self._on_work_area_directories_changed)
 
     def destroy(self):
         """
@@ -342,24 +430,55 @@ class FileModel(QtGui.QStandardItemModel):
         # clear the model:
         self.clear()
 
+        # stop any prefetches:
+        if self._prefetcher:
+            self._app.log_debug("File Model: Prefetch stats: %s" % self._prefetcher.get_stats())
+            self._prefetcher.shut_down()
+            self._prefetcher = None
+
+        # stop any pending searches from being started:
+        if self._search_debounce_timer:
+            self._search_debounce_timer.stop()
+            self._search_debounce_timer.timeout.disconnect(self._on_search_debounce_timeout)
+            self._search_debounce_timer = None
+
+        # stop watching work areas:
+        if self._watcher:
+            self._watcher.directories_changed.disconnect(self._on_work_area_directories_changed)
+            self._watcher.shut_down()
+            self._watcher.deleteLater()
+            self._watcher = None
+
         # stop the data retriever:
         if self._sg_data_retriever:
             self._sg_data_retriever.stop()
             self._sg_data_retriever.deleteLater()
             self._sg_data_retriever = None
 
-        # clean up the cache:
+        # clean up the cache - a shared cache is kept for the next model but this model's
+        # entries can now be evicted:
         if self._search_cache:
-            self._search_cache.clear()
+            self._app.log_debug("File Model: Search cache stats: %s" % self._search_cache.get_stats())
+            if self._owns_search_cache:
+                self._search_cache.clear()
+            else:
+                self._search_cache.set_pinned([], owner=self)
             self._search_cache = None
 
         # disconnect and clean up the file finder:
         if self._finder:
+            task_stats = self._finder.get_task_stats()
+            if task_stats:
+                self._app.log_debug("File Model: Task stats: %s" % task_stats)
+            self._app.log_debug("File Model: Cancel latency stats: %s"
+                                % AsyncFileFinder.get_cancel_latency_stats())
             self._finder.files_found.disconnect(self._on_finder_files_found)
             self._finder.publishes_found.disconnect(self._on_finder_publishes_found)
             self._finder.search_completed.disconnect(self._on_finder_search_completed)
             self._finder.search_failed.disconnect(self._on_finder_search_failed)
             self._finder.work_area_resolved.disconnect(self._on_finder_work_area_resolved)
+            self._finder.directory_files_found.disconnect(self._on_finder_directory_files_found)
+            self._finder.directory_search_failed.disconnect(self._on_finder_directory_search_failed)
             self._finder.shut_down()
             self._finder = None
 
@@ -378,6 +497,20 @@ class FileModel(QtGui.QStandardItemModel):
         """
         return self._search_cache.find_file_versions(work_area, key, clean_only)
 
+    def get_search_cache_stats(self):
+        """
+        :returns:   A dictionary of statistics for the search cache used by this model - see
+                    FileSearchCache.get_stats() for details.
+        """
+        return self._search_cache.get_stats() if self._search_cache else {}
+
+    def get_task_stats(self):
+        """
+        :returns:   A dictionary of statistics for each resource class of the tasks run by the
+                    file finder - see TaskLimiter.get_stats() for details.
+        """
+        return self._finder.get_task_stats() if self._finder else {}
+
     def items_from_file(self, file_item, ignore_version=False):
         """
         Find the model item(s) for the specified file item.
@@ -402,6 +535,10 @@ class FileModel(QtGui.QStandardItemModel):
                             to search for
         """
         self._app.log_debug("File Model: Setting entity searches on model to: %s" % [s.name for s in searches if s])
+        if self._search_debounce_timer:
+            self._set_entity_searches_debounced(searches)
+            return
+
         # stop any in-progress searches:
         self._stop_in_progress_searches()
         self._current_searches = searches or []
@@ -412,6 +549,42 @@ class FileModel(QtGui.QStandardItemModel):
         # start searches for all items/users in the model:
         self._start_searches()
 
+    def _set_entity_searches_debounced(self, searches):
+        """
+        Set the entity searches, updating the groups in the model straight away so that any cached
+        results are shown but only starting new searches once the entity searches have stopped
+        changing for the debounce interval.  The most recent searches always win - in-progress
+        searches for entities that are no longer being searched for are stopped immediately so
+        that none of their queued tasks hold up the new searches, whilst in-progress searches for
+        entities that are still being searched for are left running rather than being restarted.
+        Files already found by stopped searches remain in the search cache.
+
+        :param searches:    A list of SearchDetails instances containing information about the entities
+                            to search for
+        """
+        self._current_searches = searches or []
+        searches_by_key = dict([(self._gen_entity_key(search.entity), search)
+                                for search in self._current_searches if search.entity])
+        for search_id, search in self._in_progress_searches.items():
+            new_search = searches_by_key.get(self._gen_entity_key(search.entity))
+            if new_search:
+                # keep the search running but use the new details, e.g. for the group name:
+                self._in_progress_searches[search_id] = new_search
+            else:
+                self._stop_in_progress_search(search_id)
+
+        # update groups:
+        self._update_groups()
+
+        # and (re)start the timer to start searches for the new entities:
+        self._search_debounce_timer.start()
+
+    def _on_search_debounce_timeout(self):
+        """
+        Slot triggered once the entity searches have stopped changing for the debounce interval.
+        """
+        self._start_searches(skip_in_progress=True)
+
     # Interface for modifying the users in the model:
     def set_users(self, users):
         """
@@ -442,6 +615,25 @@ class FileModel(QtGui.QStandardItemModel):
         # start searches for all items/users in the model:
         self._start_searches()
 
+    def prefetch_entities(self, entities):
+        """
+        Speculatively search for the files of entities the user is likely to select next, e.g.
+        the Tasks visible in the entity views, so that the files can be shown straight away if
+        they are.  Prefetches run at a lower priority than all other searches and replace any
+        prefetches previously requested that haven't started yet.  This does nothing unless
+        prefetching is enabled in the app settings.
+
+        :param entities:    A list of Shotgun entity dictionaries, most likely to be selected first
+        """
+        if not self._prefetcher:
+            return
+        # entities already being searched for don't need to be prefetched:
+        current_keys = set([self._gen_entity_key(search.entity) for search in self._current_searches
+                            if search.entity])
+        self._prefetcher.prefetch([entity for entity in entities
+                                   if self._gen_entity_key(entity) not in current_keys],
+                                  self._current_users)
+
     def async_refresh(self):
         """
         Asynchronously refresh the model by stopping all in-progress searches and starting
@@ -467,6 +659,9 @@ class FileModel(QtGui.QStandardItemModel):
         # clean up the current-item map
         self._current_item_map = {}
 
+        # and stop watching the groups:
+        self._update_watched_directories()
+
     # ------------------------------------------------------------------------------------------
     # protected methods
 
@@ -490,6 +685,27 @@ class FileModel(QtGui.QStandardItemModel):
         # and remove the row:
         parent_item.removeRow(row)
 
+    def _safe_remove_rows(self, rows, parent_item=None):
+        """
+        Remove the specified rows from the parent item in a PySide/Shiboken friendly way.  Contiguous
+        rows are removed together in a single call rather than one at a time.
+
+        :param rows:        A list of the rows to remove
+        :param parent_item: The parent QStandardItem of the items to remove.  If None then the rows
+                            are removed from the root item.
+        """
+        parent_item = parent_item or self.invisibleRootItem()
+
+        # remove ranges from the bottom up so that the rows in the remaining ranges don't change:
+        for first_row, last_row in reversed(_get_row_ranges(rows)):
+            # safely remove all children of the items first:
+            for row in range(first_row, last_row + 1):
+                item = parent_item.child(row)
+                if item:
+                    self._clear_children_r(item)
+            # and remove the rows:
+            parent_item.removeRows(first_row, last_row - first_row + 1)
+
     def _clear_children_r(self, parent_item):
         """
         Recursively clear the children from the specified parent item in a bottom-up fashion
@@ -500,6 +716,10 @@ class FileModel(QtGui.QStandardItemModel):
         if num_rows == 0:
             return
 
+        if isinstance(parent_item, FileModel._GroupModelItem):
+            # all file items are about to be removed:
+            parent_item.file_model_items.clear()
+
         # remove all grandchildren:
         for row in range(num_rows):
             child_item = parent_item.child(row)
@@ -555,10 +775,17 @@ class FileModel(QtGui.QStandardItemModel):
         else:
             return (entity_dict.get("type"), entity_dict.get("id"))
 
-    def _start_searches(self):
+    def _start_searches(self, skip_in_progress=False):
         """
         Start all searches for all users that should be presented in the model.
+
+        :param skip_in_progress:    If True then searches aren't started for entities that already
+                                    have a search in progress
         """
+        if self._search_debounce_timer:
+            # any pending searches are started now:
+            self._search_debounce_timer.stop()
+
         if not self._current_searches:
             # nothing to do!
             return
@@ -568,10 +795,15 @@ class FileModel(QtGui.QStandardItemModel):
         for group_item in self._group_items():
             group_map[group_item.key] = group_item
 
-        for search in self._current_searches:
-            if not search.entity:
-                continue
-
+        entity_searches = [search for search in self._current_searches if search.entity]
+        if skip_in_progress:
+            in_progress_keys = set([self._gen_entity_key(search.entity)
+                                    for search in self._in_progress_searches.values()])
+            entity_searches = [search for search in entity_searches
+                               if self._gen_entity_key(search.entity) not in in_progress_keys]
+            if not entity_searches:
+                return
+        for search in entity_searches:
             # update all existing group items for this entity and all users to indicate
             # that we are searching for files
             entity_key = self._gen_entity_key(search.entity)
@@ -585,8 +817,11 @@ class FileModel(QtGui.QStandardItemModel):
                 # and dirty the search cache:
                 self._search_cache.set_dirty(search.entity, user)
 
-            # actually start the search:
-            search_id = self._finder.begin_search(search.entity, self._current_users)
+        # actually start the searches - starting them together allows searches for sibling
+        # tasks to be batched:
+        search_ids = self._finder.begin_searches([search.entity for search in entity_searches],
+                                                 self._current_users)
+        for search_id, search in zip(search_ids, entity_searches):
             self._in_progress_searches[search_id] = search
             self._app.log_debug("File Model: Started search %d..." % search_id)
 
@@ -596,6 +831,7 @@ class FileModel(QtGui.QStandardItemModel):
         """
         search_ids = self._in_progress_searches.keys()
         self._in_progress_searches = {}
+        self._partial_work_files = {}
         for search_id in search_ids:
             self._finder.stop_search(search_id)
 
@@ -604,6 +840,17 @@ class FileModel(QtGui.QStandardItemModel):
             self._sg_data_retriever.stop_work(request_id)
         self._pending_thumbnail_requests = {}
 
+    def _stop_in_progress_search(self, search_id):
+        """
+        Stop a single in-progress search, leaving any others running.
+
+        :param search_id:   The id of the search to stop
+        """
+        del self._in_progress_searches[search_id]
+        for batch_key in [k for k in self._partial_work_files if k[0] == search_id]:
+            del self._partial_work_files[batch_key]
+        self._finder.stop_search(search_id)
+
     def _update_groups(self):
         """
         Update groups in the model.  Remove any that are no longer needed and insert any that are
@@ -619,6 +866,10 @@ class FileModel(QtGui.QStandardItemModel):
         for group_item in self._group_items():
             group_map[group_item.key] = group_item
 
+        # make sure the cache entries for the current searches aren't evicted:
+        self._search_cache.set_pinned([(search.entity, user) for search in self._current_searches
+                                       if search.entity for user in self._current_users], owner=self)
+
         valid_group_keys = set()
         if self._current_searches and self._current_users:
 
@@ -683,6 +934,9 @@ class FileModel(QtGui.QStandardItemModel):
         # and clean up the file-to-item map:
         self._cleanup_current_item_map()
 
+        # make sure only the remaining groups are watched:
+        self._update_watched_directories()
+
     def _update_group_child_entity_items(self, parent_item, child_details):
         """
         Update the non-file child entity items for a group item.  This adds/removes rows accordingly
@@ -733,7 +987,8 @@ class FileModel(QtGui.QStandardItemModel):
                 new_rows.append(folder_item)
             parent_item.appendRows(new_rows)
 
-    def _process_files(self, files, work_area, group_item, have_local=True, have_publishes=True):
+    def _process_files(self, files, work_area, group_item, have_local=True, have_publishes=True,
+                       work_directories=None, is_partial=False):
         """
         Update the file items under the specified parent.  This adds/removes/updates file model items
         as needed effectively performing an in-place refresh.  This avoids having to do a complete
@@ -751,24 +1006,31 @@ class FileModel(QtGui.QStandardItemModel):
         :param group_item:      The _GroupModelItem the files should be updated for
         :param have_local:      True if the files list contains details about work files, false otherwise
         :param have_publishes:  True if the files list contains details about publishes, false otherwise
+        :param work_directories: An optional list of directories.  If specified then the files list is
+                                only expected to contain work files found in, or below, these directories
+                                and only the work files in, or below, these directories will be added,
+                                updated or removed.
+        :param is_partial:      True if the files list is only a partial batch of the files that will be
+                                found, in which case files are added and updated but never removed.
         """
         if not have_local and not have_publishes:
             # nothing to do then!
             return
 
-        # get details about existing items:
+        # get details about existing items from the group's map rather than iterating over its rows:
         existing_file_item_map = {}
         prev_local_file_versions = set()
         prev_publish_file_versions = set()
 
-        for model_item in self._file_items(group_item):
-            file_item = model_item.file_item
-            file_version_key = (file_item.key, file_item.version)
-            existing_file_item_map[file_version_key] = (file_item, model_item)
-            if file_item.is_local:
-                prev_local_file_versions.add(file_version_key)
-            if file_item.is_published:
-                prev_publish_file_versions.add(file_version_key)
+        for version_map in group_item.file_model_items.itervalues():
+            for model_item in version_map.itervalues():
+                file_item = model_item.file_item
+                file_version_key = (file_item.key, file_item.version)
+                existing_file_item_map[file_version_key] = (file_item, model_item)
+                if file_item.is_local:
+                    prev_local_file_versions.add(file_version_key)
+                if file_item.is_published:
+                    prev_publish_file_versions.add(file_version_key)
 
         # build a list of existing files that we should keep in the model:
         file_versions_to_keep = set()
@@ -778,12 +1040,25 @@ class FileModel(QtGui.QStandardItemModel):
         elif not have_local and have_publishes:
             # keep all local that aren't publishes
             file_versions_to_keep = prev_local_file_versions
+        if have_local and work_directories is not None:
+            # also keep all local files that aren't in, or below, one of the directories being updated:
+            work_directories = set(work_directories)
+            file_versions_to_keep = file_versions_to_keep | set(
+                [k for k in prev_local_file_versions
+                 if not _is_in_directories(existing_file_item_map[k][0].path, work_directories)]
+            )
+        if is_partial:
+            # more files are still to come so keep everything:
+            file_versions_to_keep = set(existing_file_item_map.keys())
         valid_files = dict([(k, v[0]) for k, v in existing_file_item_map.iteritems() if k in file_versions_to_keep])
 
-        # match files against existing items:
+        # match files against existing items, keeping track of the file keys that have changed so
+        # that only the items for those keys need updating:
         files_to_add = []
+        changed_file_keys = set()
         for file_item in files:
             file_version_key = (file_item.key, file_item.version)
+            changed_file_keys.add(file_item.key)
             current_file, model_item = existing_file_item_map.get(file_version_key, (None, None))
             if current_file and model_item:
                 # update the existing file:
@@ -816,16 +1091,19 @@ class FileModel(QtGui.QStandardItemModel):
         rows_to_remove = set(
             [v[1].row() for k, v in existing_file_item_map.iteritems() if k in file_versions_to_remove]
         )
+        changed_file_keys.update([file_key for file_key, _ in file_versions_to_remove])
 
         # update any files that are no longer in the corresponding set but which aren't going to be removed:
         if have_local:
             for file_version_key in (prev_local_file_versions - valid_file_versions) - file_versions_to_remove:
                 file_item, model_item = existing_file_item_map[file_version_key]
                 file_item.set_not_work_file()
+                changed_file_keys.add(file_item.key)
         if have_publishes:
             for file_version_key in (prev_publish_file_versions - valid_file_versions) - file_versions_to_remove:
                 file_item, model_item = existing_file_item_map[file_version_key]
                 file_item.set_not_published()
+                changed_file_keys.add(file_item.key)
 
         # update the cache - it's important this is done _before_ adding/updating the model items:
         self._search_cache.add(work_area, valid_files.values())
@@ -833,8 +1111,12 @@ class FileModel(QtGui.QStandardItemModel):
         # now lets remove, add and update items as needed:
         # 1. Remove items that are no longer needed:
         if rows_to_remove:
-            for row in sorted(rows_to_remove, reverse=True):
-                self._safe_remove_row(row, group_item)
+            for file_key, file_version in file_versions_to_remove:
+                version_map = group_item.file_model_items[file_key]
+                del version_map[file_version]
+                if not version_map:
+                    del group_item.file_model_items[file_key]
+            self._safe_remove_rows(rows_to_remove, group_item)
 
         # 2. Add new items:
         if files_to_add:
@@ -844,11 +1126,13 @@ class FileModel(QtGui.QStandardItemModel):
                 new_items.append(model_item)
                 # and track this item:
                 self._track_current_file_item(model_item, group_item)
+                version_map = group_item.file_model_items.setdefault(file_item.key, {})
+                version_map[file_item.version] = model_item
             if new_items:
                 group_item.appendRows(new_items)
 
-        # 3. Update all items in this group:
-        self._update_group_file_items(group_item)
+        # 3. Update the items in this group for the files that have changed:
+        self._update_group_file_items(group_item, changed_file_keys)
 
         # and clean up the file-to-item map:
         self._cleanup_current_item_map()
@@ -987,17 +1271,36 @@ class FileModel(QtGui.QStandardItemModel):
         if users:
             self.sandbox_users_found.emit(users)
 
-    def _on_finder_files_found(self, search_id, file_list, work_area):
+    def _on_finder_files_found(self, search_id, file_list, work_area, is_final=True):
         """
         Slot triggered when the finder has found some work files for a search.
 
         :param search_id:    The id of the search that the work files were found for
         :param file_list:    The list of FileItems that were found
         :param work_area:    The work area that the files were found in
+        :param is_final:     False if this is a partial batch and more work files will be found for
+                             the work area, True if this is the final (or only) batch
         """
-        self._app.log_debug("File Model: Found %d files for search %s, user '%s'"
+        self._app.log_debug("File Model: Found %d files for search %s, user '%s'%s"
                             % (len(file_list), search_id,
-                               work_area.context.user["name"] if work_area.context.user else "Unknown"))
+                               work_area.context.user["name"] if work_area.context.user else "Unknown",
+                               "" if is_final else " (partial)"))
+        if search_id not in self._in_progress_searches:
+            # ignore result
+            return
+
+        batch_key = (search_id, self._gen_entity_key(work_area.context.user))
+        if not is_final:
+            # add/update the files found so far but don't remove anything until all files are found:
+            self._partial_work_files.setdefault(batch_key, []).extend(file_list)
+            self._process_found_files(search_id, file_list, work_area, have_local=True, have_publishes=False,
+                                      is_partial=True)
+            return
+
+        # process the complete list of files found:
+        previous_files = self._partial_work_files.pop(batch_key, None)
+        if previous_files:
+            file_list = previous_files + list(file_list)
         self._process_found_files(search_id, file_list, work_area, have_local=True, have_publishes=False)
 
     def _on_finder_publishes_found(self, search_id, file_list, work_area):
@@ -1013,7 +1316,8 @@ class FileModel(QtGui.QStandardItemModel):
                                work_area.context.user["name"] if work_area.context.user else "Unknown"))
         self._process_found_files(search_id, file_list, work_area, have_local=False, have_publishes=True)
 
-    def _process_found_files(self, search_id, file_list, work_area, have_local, have_publishes):
+    def _process_found_files(self, search_id, file_list, work_area, have_local, have_publishes,
+                             is_partial=False):
         """
         Process files/publishes found by the finder.  This ensures that the parent _GroupModelItem for the
         search entity+user exists and then updates the group with files that were found.
@@ -1023,6 +1327,7 @@ class FileModel(QtGui.QStandardItemModel):
         :param work_area:       The work area that the files were found in
         :param have_local:      True if work files were found, otherwise false
         :param have_publishes:  True if publishes were found, otherwise false
+        :param is_partial:      True if the file list is only a partial batch of the files that will be found
         """
         if search_id not in self._in_progress_searches:
             # ignore result
@@ -1055,7 +1360,8 @@ class FileModel(QtGui.QStandardItemModel):
             self._update_group_child_entity_items(group_item, search.child_entities or [])
 
         # process files:
-        self._process_files(file_list, work_area, group_item, have_local, have_publishes)
+        self._process_files(file_list, work_area, group_item, have_local, have_publishes,
+                            is_partial=is_partial)
 
     def _on_finder_search_completed(self, search_id):
         """
@@ -1093,6 +1399,8 @@ class FileModel(QtGui.QStandardItemModel):
 
         search = self._in_progress_searches[search_id]
         del(self._in_progress_searches[search_id])
+        for batch_key in [k for k in self._partial_work_files if k[0] == search_id]:
+            del self._partial_work_files[batch_key]
 
         group_map = {}
         for group_item in self._group_items():
@@ -1110,6 +1418,149 @@ class FileModel(QtGui.QStandardItemModel):
             if status == FileModel.SEARCH_COMPLETED:
                 self._search_cache.set_dirty(search.entity, user, is_dirty=False)
 
+        # start watching the work areas that were found:
+        self._update_watched_directories()
+
+    def _get_group_work_directories(self, group_item):
+        """
+        Get the directories that work files for a group can be found in.  This includes the
+        directories containing the current work files, any directories found when updating the
+        files in changed directories as well as the deepest directory in the work area that can be
+        resolved from the context.
+
+        :param group_item:  The _GroupModelItem to get the directories for
+        :returns:           A set of directory paths
+        """
+        directories = set(self._found_group_directories.get(group_item.key, []))
+        for model_item in self._file_items(group_item):
+            file_item = model_item.file_item
+            if file_item.is_local and file_item.path:
+                directories.add(os.path.dirname(file_item.path))
+
+        work_area = group_item.work_area
+        template = work_area.work_template if work_area else None
+        if template and work_area.context:
+            try:
+                fields = work_area.context.as_template_fields(template)
+            except sgtk.TankError:
+                fields = {}
+            # walk up the template hierarchy until a template can be resolved:
+            template = template.parent
+            while template:
+                if not template.missing_keys(fields, skip_defaults=True):
+                    try:
+                        directories.add(template.apply_fields(fields))
+                    except sgtk.TankError:
+                        pass
+                    break
+                template = template.parent
+        return directories
+
+    def _update_watched_directories(self):
+        """
+        Update the directories being watched so that they match the groups with a completed search.
+        """
+        if not self._watcher:
+            return
+
+        searching_entity_keys = set([self._gen_entity_key(s.entity)
+                                     for s in self._in_progress_searches.values()])
+        self._watched_group_directories = {}
+        group_keys = set([g.key for g in self._group_items()])
+        for group_key in self._found_group_directories.keys():
+            if group_key not in group_keys:
+                del self._found_group_directories[group_key]
+        for group_item in self._group_items():
+            if not group_item.work_area or group_item.key[0] in searching_entity_keys:
+                # files for this group are still being found:
+                continue
+            self._watched_group_directories[group_item.key] = self._get_group_work_directories(group_item)
+
+        all_directories = set()
+        for directories in self._watched_group_directories.values():
+            all_directories.update(directories)
+        self._watcher.set_directories(list(all_directories))
+
+    def _on_work_area_directories_changed(self, directories):
+        """
+        Slot triggered when the watcher detects changes to the directories behind one or more
+        groups.  This starts background searches for the work files in the changed directories
+        of the affected groups rather than searching the whole work area again.
+
+        :param directories: A list of the directories that have changed
+        """
+        changed_directories = set(directories)
+        group_map = dict([(g.key, g) for g in self._group_items()])
+        for group_key, group_directories in self._watched_group_directories.items():
+            group_item = group_map.get(group_key)
+            affected_directories = group_directories & changed_directories
+            if not group_item or not group_item.work_area or not affected_directories:
+                continue
+
+            # replace any search still running for the group, including its directories in the new one:
+            for search_id, (search_group_key, search_directories) in self._directory_searches.items():
+                if search_group_key == group_key:
+                    self._finder.stop_directory_search(search_id)
+                    del self._directory_searches[search_id]
+                    affected_directories |= search_directories
+
+            work_area = group_item.work_area
+            self._app.log_debug("File Model: Updating files in %d changed directories for group %s"
+                                % (len(affected_directories), group_key))
+            # the cache stays dirty until the files have been updated:
+            self._search_cache.set_work_area_dirty(work_area)
+            search_id = self._finder.begin_directory_search(work_area, affected_directories)
+            self._directory_searches[search_id] = (group_key, affected_directories)
+
+    def _on_finder_directory_files_found(self, search_id, files, work_area, directories):
+        """
+        Slot triggered when the work files have been found in the changed directories of a group.
+
+        :param search_id:   The id of the directory search
+        :param files:       The list of FileItems found in the directories
+        :param work_area:   The WorkArea the files were found for
+        :param directories: The list of directories that were searched, including any
+                            subdirectories found below the changed directories
+        """
+        search = self._directory_searches.pop(search_id, None)
+        if not search:
+            return
+        group_key, changed_directories = search
+        group_item = None
+        for item in self._group_items():
+            if item.key == group_key:
+                group_item = item
+                break
+        if not group_item:
+            # the group has been removed whilst the search was running:
+            return
+
+        self._process_files(files, work_area, group_item, have_local=True, have_publishes=False,
+                            work_directories=directories)
+        self._search_cache.set_work_area_dirty(work_area, False)
+
+        # watch any new subdirectories that were found, forgetting those that no longer exist:
+        found_directories = self._found_group_directories.setdefault(group_key, set())
+        changed_directories = set(changed_directories)
+        found_directories -= set([d for d in found_directories
+                                  if _is_in_directories(os.path.join(d, ""), changed_directories)])
+        found_directories.update(directories)
+
+        # new work files may have been added in directories that weren't being watched yet:
+        self._update_watched_directories()
+
+    def _on_finder_directory_search_failed(self, search_id, error_msg):
+        """
+        Slot triggered when searching for the work files in the changed directories of a group
+        fails.  The cache entry is left dirty so that the next search will find the changes.
+
+        :param search_id:   The id of the directory search
+        :param error_msg:   The error message
+        """
+        search = self._directory_searches.pop(search_id, None)
+        if search:
+            self._app.log_debug("File Model: Failed to update files for group %s: %s" % (search[0], error_msg))
+
     def _on_data_retriever_work_completed(self, uid, request_type, data):
         """
         Slot triggered when the data-retriever has finished doing some work.  The data retriever is currently
@@ -1137,11 +1588,11 @@ class FileModel(QtGui.QStandardItemModel):
         if not model_items:
             return
 
-        # find the work area associated with the group:
-        work_area = None
+        # find the group the items are in:
+        file_group_item = None
         for group_item in self._group_items():
             if group_item.key == group_key:
-                work_area = group_item.work_area
+                file_group_item = group_item
                 break
 
         # prepare a pixmap from the thumbnail image:
@@ -1155,9 +1606,9 @@ class FileModel(QtGui.QStandardItemModel):
             file_item.thumbnail = thumb
             model_item.emitDataChanged()
 
-            if work_area:
+            if file_group_item:
                 # update thumbnails on all file versions:
-                self._update_version_thumbnails(file_item.key, group_key, work_area)
+                self._update_version_thumbnails(file_item.key, file_group_item)
 
     def _on_data_retriever_work_failed(self, uid, error_msg):
         """
@@ -1170,35 +1621,39 @@ class FileModel(QtGui.QStandardItemModel):
             del(self._pending_thumbnail_requests[uid])
         self._app.log_debug("File Model: Failed to find thumbnail for id %s: %s" % (uid, error_msg))
 
-    def _update_group_file_items(self, group_item):
+    def _update_group_file_items(self, group_item, file_keys=None):
         """
-        Update all file model items within the specified group model item.  This updates each file's
+        Update the file model items within the specified group model item.  This updates each file's
         tooltip, associated versions and thumbnail and ensures that the correct dataChanged signal is
         emitted for them.
 
         :param group_item:  The _GroupModelItem representing the group in the model
+        :param file_keys:   An optional list of file keys.  If specified then only the items for
+                            versions of these files are updated, otherwise all items in the group are.
         """
         work_area = group_item.work_area
         if not work_area:
             return
 
-        # get a unique list of all file keys under the group:
-        unique_file_keys = set()
-        for item in self._file_items(group_item):
-            file_item = item.file_item
-            unique_file_keys.add(file_item.key)
+        # get a unique list of the file keys to update that have items under the group:
+        unique_file_keys = set(group_item.file_model_items.keys())
+        if file_keys is not None:
+            unique_file_keys &= set(file_keys)
 
         if not unique_file_keys:
             return
 
         # process files for each key:
+        version_indexes = {}
         for file_key in unique_file_keys:
-            # get all file versions for this key:
-            file_versions = self._search_cache.find_file_versions(work_area, file_key) or {}
+            # build the index of all file versions for this key from the items in this model rather
+            # than using the index in the search cache as the items in the cache may be shared:
+            version_index = self._build_version_index(group_item, file_key)
+            version_indexes[file_key] = version_index
 
             # update thumbnail and versions for each version:
             thumb = None
-            for _, version in sorted(file_versions.iteritems(), reverse=False):
+            for version in version_index.sorted_versions:
                 if version.thumbnail_path:
                     # this file version should have a thumbnail!
                     thumb = version.thumbnail
@@ -1207,34 +1662,56 @@ class FileModel(QtGui.QStandardItemModel):
                     version.thumbnail = thumb
 
                 # store the file versions on the file as well:
-                version.versions = file_versions
+                version.versions = version_index.versions
 
-        # update tooltips on all file items:
-        for file_model_item in self._file_items(group_item):
-            file_item = file_model_item.file_item
-            tooltip = ""
-            if file_item:
-                tooltip = file_item.format_tooltip()
-            file_model_item.setToolTip(tooltip)
-
-        # emit data changed signal for all items in the group:
-        row_count = group_item.rowCount()
-        tl_idx = self.index(0, 0, group_item.index())
-        br_idx = self.index(row_count - 1, 0, group_item.index())
-        self.dataChanged.emit(tl_idx, br_idx)
+        # update tooltips on the file items:
+        rows = []
+        for file_key in unique_file_keys:
+            for file_model_item in group_item.file_model_items[file_key].itervalues():
+                file_item = file_model_item.file_item
+                tooltip = ""
+                if file_item:
+                    version_index = version_indexes.get(file_item.key)
+                    if version_index:
+                        tooltip = file_item.format_tooltip(
+                            (version_index.latest, version_index.latest_publish)
+                        )
+                    else:
+                        tooltip = file_item.format_tooltip()
+                if file_model_item.toolTip() != tooltip:
+                    file_model_item.setToolTip(tooltip)
+                rows.append(file_model_item.row())
+
+        # emit data changed signals for just the updated items:
+        group_idx = group_item.index()
+        for first_row, last_row in _get_row_ranges(rows):
+            self.dataChanged.emit(self.index(first_row, 0, group_idx), self.index(last_row, 0, group_idx))
+
+    def _build_version_index(self, group_item, file_key):
+        """
+        Build an index of all versions of a file from the file items under a group.
+
+        :param group_item:  The _GroupModelItem containing the file items
+        :param file_key:    A unique key that identifies all versions of the same file
+        :returns:           A FileSearchCache.FileVersions instance
+        """
+        version_map = group_item.file_model_items.get(file_key) or {}
+        return FileSearchCache.FileVersions([item.file_item for item in version_map.itervalues()])
 
-    def _update_version_thumbnails(self, file_key, group_key, work_area):
+    def _update_version_thumbnails(self, file_key, group_item):
         """
         Update the thumbnail for all versions of a file.  If a file version doesn't have a thumnail set and
         a previous version did then it will re-use the file from the previous version instead.
 
         :param file_key:    A unique key that identifies all versions of the same file
-        :param group_key:   A unique key that represents a single file group
-        :param work_area:   A WorkArea instance that all files in this group belong to
+        :param group_item:  The _GroupModelItem containing the file items
         """
-        file_versions = self._search_cache.find_file_versions(work_area, file_key) or {}
+        version_map = group_item.file_model_items.get(file_key)
+        if not version_map:
+            return
         thumb = None
-        for _, version in sorted(file_versions.iteritems(), reverse=False):
+        for _, model_item in sorted(version_map.iteritems()):
+            version = model_item.file_item
             if version.thumbnail_path:
                 # this file version should have a thumbnail!
                 thumb = version.thumbnail
@@ -1243,10 +1720,8 @@ class FileModel(QtGui.QStandardItemModel):
                     # lets use the current thumbnail for this version:
                     version.thumbnail = thumb
 
-                    # emit a data changed signal for any model items that are affected:
-                    version_items = self._find_current_items(group_key, version.key, version.version)
-                    for item in version_items:
-                        item.emitDataChanged()
+                    # emit a data changed signal for the model item:
+                    model_item.emitDataChanged()
 
     def _build_thumbnail(self, thumb_path_or_image):
         """
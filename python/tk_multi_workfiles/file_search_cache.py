@@ -12,45 +12,105 @@
 Cache used to store and find file search results.
 """
 
+import itertools
+import threading
+
 import sgtk
-from .util import Threaded
+from .util import Threaded, FrozenDict
 
 class FileSearchCache(Threaded):
     """
     Implementation of FileSearchCache class
+
+    Each cache entry is an immutable snapshot of the files found in a work area, together with
+    indexes of the files by key that are built once when the entry is added.  Entries are replaced
+    rather than modified so the find methods don't need to take the lock.  The FileItems added by
+    a model are copied so that the model can continue to update its own items and find() returns
+    copies that the caller can modify and show in a model.  The FileItems returned by the other
+    find methods are those held by the cache and must not be modified.
+
+    The cache can optionally be limited to a maximum number of entries and/or an approximate
+    maximum size in bytes.  When a limit is exceeded, the least recently used entries are evicted
+    first but pinned entries, e.g. those for the groups currently shown in the file model, are
+    never evicted.
+
+    A single instance can be shared by all file models for the lifetime of the engine - see
+    get_shared_search_cache().
     """
-    class _CachedFileInfo(object):
+    # approximate size in bytes of a FileItem, not including its paths:
+    _APPROX_FILE_ITEM_SIZE = 600
+
+    class FileVersions(object):
         """
-        Storage for file versions - encapsulates a dictionary if files indexed 
-        by their version
+        Immutable index of all versions of a single file
         """
-        def __init__(self):
+        __slots__ = ("versions", "sorted_versions", "latest", "latest_publish")
+
+        def __init__(self, files):
             """
             Construction
+
+            :param files:   A list of all the FileItems for the versions of the file
             """
-            self.versions = {}# version:FileItem() 
+            # FrozenDict {version:FileItem}:
+            self.versions = FrozenDict([(f.version, f) for f in files])
+            # tuple of FileItems sorted by version:
+            self.sorted_versions = tuple([f for _, f in sorted(self.versions.iteritems())])
+            # the most recent version and most recent published version, or None:
+            self.latest = self.sorted_versions[-1] if self.sorted_versions else None
+            self.latest_publish = None
+            for file_item in reversed(self.sorted_versions):
+                if file_item.is_published:
+                    self.latest_publish = file_item
+                    break
 
     class _CacheEntry(object):
         """
         A single cache entry - stores the work area the files were found in together with the
-        list of files indexed by the unique file key.
+        list of files and the versions of the files indexed by the unique file key.
         """
-        def __init__(self):
+        def __init__(self, work_area, files, is_dirty):
             """
             Construction
+
+            :param work_area:   The WorkArea the files were found in
+            :param files:       A list of the FileItems found in the work area
+            :param is_dirty:    True if the entry is dirty
             """
-            self.work_area = None
-            self.is_dirty = True
-            self.file_info = {}# FileItem.key:_CachedFileInfo()
+            self.work_area = work_area
+            self.is_dirty = is_dirty
+            self.files = tuple(files)
+            files_by_key = {}
+            for file_item in self.files:
+                files_by_key.setdefault(file_item.key, []).append(file_item)
+            self.file_versions = dict([(k, FileSearchCache.FileVersions(v)) for k, v in files_by_key.iteritems()])
+            # approximate size of the entry in bytes:
+            self.size = sum([FileSearchCache._APPROX_FILE_ITEM_SIZE + len(f.path or "") + len(f.publish_path or "")
+                             for f in self.files])
+            # the value of the use counter when the entry was last used:
+            self.last_used = 0
 
-    def __init__(self):
+    def __init__(self, max_entries=0, max_size=0):
         """
         Construction
+
+        :param max_entries: The maximum number of entries to keep in the cache or 0 for no limit
+        :param max_size:    The approximate maximum size of the cache in bytes or 0 for no limit
         """
         Threaded.__init__(self)
         self._cache = {}
+        self._max_entries = max_entries
+        self._max_size = max_size
+        self._size = 0
+        # {id(owner):set(keys)}:
+        self._pinned_keys_by_owner = {}
+        self._pinned_keys = set()
+        # incremented without the lock whenever an entry is used - the entries with the lowest
+        # counter values are the least recently used:
+        self._use_counter = itertools.count(1)
+        # statistics are updated without the lock so are approximate:
+        self._stats = {"hits":0, "misses":0, "evictions":0}
 
-    @Threaded.exclusive
     def add(self, work_area, files, is_dirty=None):
         """
         Add the specified files to the cache along with the work area they were found in
@@ -63,28 +123,73 @@ class FileSearchCache(Threaded):
                             is_dirty is None then the previous value will be used or True if there
                             is no previous value.
         """
+        # build the new cache entry and its indexes from copies of the files before taking the
+        # lock - the caller may go on to modify the files it passed in:
+        new_entry = FileSearchCache._CacheEntry(work_area, [f.copy() for f in files], is_dirty)
+        new_entry.last_used = next(self._use_counter)
+        self._add_entry(new_entry, is_dirty)
+
+    @Threaded.exclusive
+    def _add_entry(self, new_entry, is_dirty):
+        """
+        Replace the cache entry for the work area of a new entry with the new entry.
+
+        :param new_entry:   The _CacheEntry to add
+        :param is_dirty:    The is_dirty value passed to add()
+        """
         # find the current entry if there is one - this also returns the cache key:
-        key, current_entry = self._find_entry(work_area)
+        key, current_entry = self._find_entry(new_entry.work_area)
         if is_dirty is None:
-            if current_entry:
-                # use the current value for the dirty flag:
-                is_dirty = current_entry.is_dirty
-            else:
-                # default dirty to True
-                is_dirty = True
-
-        # build the new cache entry from the list of files:
-        new_entry = FileSearchCache._CacheEntry()
-        new_entry.work_area = work_area
-        new_entry.is_dirty = is_dirty
-        for file_item in files:
-            new_entry.file_info.setdefault(file_item.key, 
-                                           FileSearchCache._CachedFileInfo()).versions[file_item.version] = file_item
-
-        # add the new entry to the cache:
+            # use the current value for the dirty flag or default to True:
+            new_entry.is_dirty = current_entry.is_dirty if current_entry else True
+
+        if current_entry:
+            self._size -= current_entry.size
         self._cache[key] = new_entry
+        self._size += new_entry.size
+        self._evict()
+
+    def add_search_results(self, work_area, work_files, publishes):
+        """
+        Add the work files and publishes found by a background search, e.g. one run to pre-warm
+        or prefetch the cache, unless there is already an entry for the work area.  Work files
+        are merged with the publish of the same version in the same way as the file model merges
+        them and the entry is marked as clean.  The files are owned by the cache once added so
+        mustn't be modified by the caller.
+
+        :param work_area:   The WorkArea the files were found in
+        :param work_files:  The list of work file FileItems that were found
+        :param publishes:   The list of publish FileItems that were found
+        :returns:           True if an entry was added, False if there was already an entry
+        """
+        files = dict([((f.key, f.version), f) for f in work_files])
+        for publish in publishes:
+            file_item = files.get((publish.key, publish.version))
+            if file_item:
+                file_item.update_from_publish(publish)
+            else:
+                files[(publish.key, publish.version)] = publish
+
+        new_entry = FileSearchCache._CacheEntry(work_area, files.values(), False)
+        new_entry.last_used = next(self._use_counter)
+        return self._add_entry_if_missing(new_entry)
 
     @Threaded.exclusive
+    def _add_entry_if_missing(self, new_entry):
+        """
+        Add a new entry unless there is already an entry for its work area.
+
+        :param new_entry:   The _CacheEntry to add
+        :returns:           True if the entry was added, otherwise False
+        """
+        key, current_entry = self._find_entry(new_entry.work_area)
+        if current_entry or key is None:
+            return False
+        self._cache[key] = new_entry
+        self._size += new_entry.size
+        self._evict()
+        return True
+
     def find_file_versions(self, work_area, file_key, clean_only=False):
         """
         Find all file versions for the specified file key and context.
@@ -93,25 +198,39 @@ class FileSearchCache(Threaded):
         :param file_key:        A unique file key that can be used to locate all versions of a single file
         :param clean_only:      If False then dirty cache entries will be included in the returned results.  If
                                 True then they will be omitted. Defaults to False.
-        :returns:               A dictionary {version:FileItem} of all file versions found.
+        :returns:               An immutable dictionary {version:FileItem} of all file versions found
+                                or None if there isn't a cached result for the work area.
+        """
+        file_versions = self.find_file_version_index(work_area, file_key, clean_only)
+        if file_versions is None:
+            return None
+        return file_versions.versions
+
+    def find_file_version_index(self, work_area, file_key, clean_only=False):
+        """
+        Find the index of all file versions for the specified file key and context.
+
+        :param work_area:       The work area to find the file versions for
+        :param file_key:        A unique file key that can be used to locate all versions of a single file
+        :param clean_only:      If False then dirty cache entries will be included in the returned results.  If
+                                True then they will be omitted. Defaults to False.
+        :returns:               An immutable FileSearchCache.FileVersions instance or None if there
+                                isn't a cached result for the work area.
         """
         _, entry = self._find_entry(work_area)
         if not entry:
             # return None as we don't have a cached result for this context!
+            self._stats["misses"] += 1
             return None
+        entry.last_used = next(self._use_counter)
+        self._stats["hits"] += 1
 
         if clean_only and entry.is_dirty:
             return None
 
-        file_info = entry.file_info.get(file_key)
-        if not file_info:
-            # although we have a cache entry, we don't have any files for the key!
-            return {}
-
-        # return a dictionary of version:FileItem entries:
-        return dict([(v, f) for v, f in file_info.versions.iteritems()])
+        # although we may have a cache entry, we may not have any files for the key!
+        return entry.file_versions.get(file_key) or _NO_FILE_VERSIONS
 
-    @Threaded.exclusive
     def find(self, entity, user=None):
         """
         Find the list of files and work area for the specified entity and user.
@@ -119,18 +238,29 @@ class FileSearchCache(Threaded):
         :param entity:  The entity to return files for
         :param user:    The user to return files for.  If user is None then the user for the current
                         context will be used
-        :returns:       Tuple containing (list(FileItem), WorkArea) or None of an entry isn't found
+        :returns:       Tuple containing (tuple(FileItem), WorkArea) or None of an entry isn't found.
+                        The FileItems are copies of those in the cache so can be modified.
         """
         key = self._construct_key(entity, user)
         entry = self._cache.get(key)
         if not entry:
+            self._stats["misses"] += 1
             return None
+        entry.last_used = next(self._use_counter)
+        self._stats["hits"] += 1
 
-        files = []
-        for file_info in entry.file_info.values():
-            files.extend([f for f in file_info.versions.values()])
+        return (tuple([f.copy() for f in entry.files]), entry.work_area)
 
-        return (files, entry.work_area)
+    def contains(self, entity, user=None):
+        """
+        Check if there is an entry for the specified entity and user without using it.
+
+        :param entity:  The entity to check for
+        :param user:    The user to check for.  If user is None then the user for the current
+                        context will be used
+        :returns:       True if the cache contains an entry for the entity and user
+        """
+        return self._construct_key(entity, user) in self._cache
 
     @Threaded.exclusive
     def set_dirty(self, entity, user=None, is_dirty=True):
@@ -161,12 +291,62 @@ class FileSearchCache(Threaded):
             return
         entry.is_dirty = dirty
 
+    @Threaded.exclusive
+    def set_pinned(self, entity_users, owner=None):
+        """
+        Set the entries that should never be evicted from the cache, replacing any entries
+        previously pinned by the same owner.  Entries don't need to be in the cache to be pinned.
+
+        :param entity_users:    A list of (entity, user) tuples for the entries to pin.  If user
+                                is None then the user for the current context will be used.
+        :param owner:           The object pinning the entries, e.g. a file model, when the cache
+                                is shared.  Entries are pinned whilst any owner has them pinned.
+        """
+        pinned_keys = set([self._construct_key(entity, user) for entity, user in entity_users])
+        if pinned_keys:
+            self._pinned_keys_by_owner[id(owner)] = pinned_keys
+        else:
+            self._pinned_keys_by_owner.pop(id(owner), None)
+        self._pinned_keys = set().union(*self._pinned_keys_by_owner.values())
+        # previously pinned entries may now be evicted:
+        self._evict()
+
+    @Threaded.exclusive
+    def get_stats(self):
+        """
+        :returns:   A dictionary containing the number of cache hits, misses and evictions together
+                    with the current number of entries, the number of pinned entries and the
+                    approximate size of the cache in bytes.
+        """
+        stats = dict(self._stats)
+        stats["entries"] = len(self._cache)
+        stats["pinned"] = len(self._pinned_keys)
+        stats["size"] = self._size
+        return stats
+
     @Threaded.exclusive
     def clear(self):
         """
         Clear the cache
         """
         self._cache = {}
+        self._size = 0
+
+    def _evict(self):
+        """
+        Evict the least recently used entries that aren't pinned until the cache is within its
+        limits.  Must be called with the lock held.
+        """
+        if not self._max_entries and not self._max_size:
+            return
+        for key, _ in sorted(self._cache.iteritems(), key=lambda item: item[1].last_used):
+            if ((not self._max_entries or len(self._cache) <= self._max_entries)
+                and (not self._max_size or self._size <= self._max_size)):
+                break
+            if key in self._pinned_keys:
+                continue
+            self._size -= self._cache.pop(key).size
+            self._stats["evictions"] += 1
 
     def _find_entry(self, work_area):
         """
@@ -206,4 +386,43 @@ class FileSearchCache(Threaded):
         # key needs to be hashable to return a tuple of the key parts:
         return tuple(key_parts)
 
+# shared empty index returned for file keys that aren't in a cache entry:
+_NO_FILE_VERSIONS = FileSearchCache.FileVersions([])
+
+# single process-wide instance of the search cache, created on demand:
+_g_shared_search_cache = None
+_g_shared_search_cache_lock = threading.Lock()
+
+
+def get_shared_search_cache():
+    """
+    Get the search cache shared by all file models for the lifetime of the engine if it is enabled
+    in the app settings.  Sharing the cache allows the File Open and File Save dialogs to be
+    populated immediately with the files found previously whilst the searches run again.
+
+    :returns:   The shared FileSearchCache instance or None if sharing isn't enabled
+    """
+    global _g_shared_search_cache
+    with _g_shared_search_cache_lock:
+        if _g_shared_search_cache is None:
+            app = sgtk.platform.current_bundle()
+            if not app.get_setting("share_search_cache", False):
+                return None
+            _g_shared_search_cache = FileSearchCache(
+                max_entries=app.get_setting("search_cache_max_entries", 0),
+                max_size=app.get_setting("search_cache_max_size", 0) * 1024 * 1024
+            )
+        return _g_shared_search_cache
+
+
+def release_shared_search_cache():
+    """
+    Clear and release the shared search cache if there is one, e.g. when the app is destroyed.
+    """
+    global _g_shared_search_cache
+    with _g_shared_search_cache_lock:
+        if _g_shared_search_cache:
+            _g_shared_search_cache.clear()
+            _g_shared_search_cache = None
+
 
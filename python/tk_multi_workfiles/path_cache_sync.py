@@ -0,0 +1,174 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Scheduler that synchronises the path cache in a background thread rather than blocking the main
+thread whenever a dialog is opened or refreshed.
+"""
+import time
+
+import sgtk
+from sgtk.platform.qt import QtCore
+
+
+class _SyncThread(QtCore.QThread):
+    """
+    Thread that runs a single synchronisation of the path cache.
+    """
+    def __init__(self, parent=None):
+        """
+        Construction
+
+        :param parent:  The parent QObject for this instance
+        """
+        QtCore.QThread.__init__(self, parent)
+        self._app = sgtk.platform.current_bundle()
+        self.synced_paths = []
+        self.error = None
+
+    def run(self):
+        """
+        Run the synchronisation, storing the paths that were synchronised or the error raised.
+        """
+        try:
+            self.synced_paths = self._app.sgtk.synchronize_filesystem_structure() or []
+        except Exception, e:
+            self.error = e
+
+
+class PathCacheSyncScheduler(QtCore.QObject):
+    """
+    Runs path cache synchronisations in a background thread, one at a time.  A requested sync is
+    skipped if the last sync completed within the staleness window so that opening a dialog or
+    refreshing repeatedly doesn't synchronise every time.  All methods must be called from the
+    main thread.
+    """
+    # Signal emitted in the main thread when a sync has completed.  The argument is True if any
+    # paths were synchronised, in which case searches that have already started may need to be
+    # re-validated.
+    sync_completed = QtCore.Signal(bool)
+
+    def __init__(self, staleness_window=0, parent=None):
+        """
+        Construction
+
+        :param staleness_window:    The number of seconds after a sync completes during which
+                                    further syncs are skipped
+        :param parent:              The parent QObject for this instance
+        """
+        QtCore.QObject.__init__(self, parent)
+        self._app = sgtk.platform.current_bundle()
+        self._staleness_window = staleness_window
+        self._last_sync_time = None
+        self._thread = None
+        self._sync_again = False
+
+    @property
+    def is_syncing(self):
+        """
+        :returns:   True if a sync is currently running
+        """
+        return self._thread is not None
+
+    def request_sync(self):
+        """
+        Request that the path cache is synchronised.  The sync runs in the background and this
+        returns straight away.
+
+        :returns:   True if a sync was started or will be started once the running sync has
+                    completed, False if it was skipped as the last sync is within the staleness
+                    window.
+        """
+        if self._thread:
+            # a sync is already running but it may have started before the paths the caller is
+            # interested in were created so run another one once it completes:
+            self._sync_again = True
+            return True
+
+        if (self._last_sync_time is not None
+            and time.time() - self._last_sync_time < self._staleness_window):
+            self._app.log_debug("Path cache was synchronized %.1fs ago - skipping sync"
+                                % (time.time() - self._last_sync_time))
+            return False
+
+        self._start_sync()
+        return True
+
+    def shut_down(self):
+        """
+        Wait for any running sync to complete.
+        """
+        self._sync_again = False
+        if self._thread:
+            self._thread.finished.disconnect(self._on_thread_finished)
+            self._thread.wait()
+            self._thread = None
+
+    def _start_sync(self):
+        """
+        Start a sync in a new background thread.
+        """
+        self._app.log_debug("Synchronizing remote path cache in the background...")
+        self._sync_again = False
+        self._thread = _SyncThread(self)
+        self._thread.finished.connect(self._on_thread_finished)
+        self._thread.start()
+
+    def _on_thread_finished(self):
+        """
+        Slot triggered in the main thread when the sync thread has finished.
+        """
+        thread = self._thread
+        self._thread = None
+        thread.finished.disconnect(self._on_thread_finished)
+        thread.deleteLater()
+
+        if thread.error:
+            self._app.log_warning("Failed to synchronize the remote path cache: %s" % thread.error)
+        else:
+            self._app.log_debug("Path cache up to date! (%d paths synchronized)" % len(thread.synced_paths))
+            self._last_sync_time = time.time()
+
+        if self._sync_again:
+            self._start_sync()
+
+        self.sync_completed.emit(bool(thread.synced_paths))
+
+
+# single global instance of the scheduler, created on demand:
+_g_path_cache_sync_scheduler = None
+
+
+def get_path_cache_sync_scheduler():
+    """
+    Get the global path cache sync scheduler if background syncs are enabled in the app settings.
+    Must be called from the main thread.
+
+    :returns:   The PathCacheSyncScheduler instance or None if background syncs aren't enabled
+    """
+    global _g_path_cache_sync_scheduler
+    if _g_path_cache_sync_scheduler is None:
+        app = sgtk.platform.current_bundle()
+        if not app.get_setting("background_path_cache_sync", False):
+            return None
+        _g_path_cache_sync_scheduler = PathCacheSyncScheduler(
+            app.get_setting("path_cache_sync_staleness", 0)
+        )
+    return _g_path_cache_sync_scheduler
+
+
+def release_path_cache_sync_scheduler():
+    """
+    Shut down and release the global scheduler if there is one, e.g. when the app is destroyed.
+    """
+    global _g_path_cache_sync_scheduler
+    if _g_path_cache_sync_scheduler:
+        _g_path_cache_sync_scheduler.shut_down()
+        _g_path_cache_sync_scheduler = None
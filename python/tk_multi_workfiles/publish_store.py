@@ -0,0 +1,322 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Persistent store of the publishes found for a work area.  Once the publishes for a work area
+have been found, subsequent refreshes only query Shotgun for publishes that have been created
+or updated since the last refresh rather than for the full publish history.
+"""
+import os
+import sys
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import sgtk
+from tank_vendor.shotgun_api3 import sg_timezone
+
+from .util import Threaded, freeze_value
+
+# Publishes updated up to this long before the high-water mark are queried again on each
+# refresh.  This allows for publishes that were being updated whilst the previous refresh
+# was running and that share the same updated_at time as the last publish found.
+_HIGH_WATER_MARK_OVERLAP = timedelta(minutes=1)
+
+# Increment whenever the format of the store changes - existing stores will be ignored.
+_STORE_VERSION = 1
+
+
+class _StoreEntry(object):
+    """
+    The publishes stored for a single work area.
+    """
+    def __init__(self, fields):
+        """
+        Construction
+
+        :param fields:  The list of fields the publishes were queried with
+        """
+        self.fields = sorted(fields)
+        self.publishes = {}
+        self.high_water_mark = None
+        # incremented every time the publishes change:
+        self.revision = 0
+        # only one refresh of the entry can run at a time:
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        """
+        :returns:   The state to pickle - locks can't be pickled
+        """
+        return {"fields":self.fields, "publishes":self.publishes, "high_water_mark":self.high_water_mark,
+                "revision":self.revision}
+
+    def __setstate__(self, state):
+        """
+        :param state:   The state unpickled
+        """
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def update(self, sg_publishes):
+        """
+        Merge publishes queried from Shotgun into the entry, advancing the high-water mark.
+
+        :param sg_publishes:    The list of publishes to merge
+        :returns:               True if any publishes were added or changed, otherwise False
+        """
+        changed = False
+        for sg_publish in sg_publishes:
+            existing = self.publishes.get(sg_publish["id"])
+            if existing is None or existing.get("updated_at") != sg_publish.get("updated_at"):
+                self.publishes[sg_publish["id"]] = freeze_value(sg_publish)
+                changed = True
+            updated_at = sg_publish.get("updated_at")
+            if updated_at and (not self.high_water_mark or updated_at > self.high_water_mark):
+                self.high_water_mark = updated_at
+        return changed
+
+
+class PublishStore(Threaded):
+    """
+    Store of the publishes found for each work area, keyed by the filters used to find them.
+    Stores are kept in memory and are also saved to disk so that they are shared across sessions.
+    """
+    def __init__(self, store_dir):
+        """
+        Construction
+
+        :param store_dir:   The directory the stores are saved in
+        """
+        Threaded.__init__(self)
+        self._store_dir = store_dir
+        self._entries = {}
+        self._app = sgtk.platform.current_bundle()
+
+    def load(self, filters, fields):
+        """
+        Get the publishes stored for the specified filters without querying Shotgun.
+
+        :param filters: The list of Shotgun filters used to find the publishes
+        :param fields:  The list of fields required for each publish
+        :returns:       Tuple (list of publish dictionaries, revision) or (None, None) if the
+                        publishes for the filters haven't been stored yet.  The publishes are
+                        immutable records shared by all callers.
+        """
+        entry = self._get_entry(filters, fields)
+        if entry is None or entry.high_water_mark is None:
+            return (None, None)
+        with entry.lock:
+            return (self._sorted_publishes(entry), entry.revision)
+
+    def sync(self, filters, fields):
+        """
+        Bring the publishes stored for the specified filters up to date with Shotgun.  If none
+        have been stored yet then all publishes are queried, otherwise only those created or
+        updated since the last sync are queried together with the number of publishes matching the
+        filters.  The ids of all publishes are only queried, so that any that have been retired or
+        no longer match the filters can be removed, when that number differs from the number stored.
+
+        :param filters: The list of Shotgun filters used to find the publishes
+        :param fields:  The list of fields required for each publish
+        :returns:       Tuple (list of publish dictionaries, revision).  The revision changes
+                        whenever the publishes change so can be compared with the revision
+                        returned by load().  The publishes are immutable records shared by all
+                        callers.
+        """
+        published_file_type = sgtk.util.get_published_file_entity_type(self._app.sgtk)
+        query_fields = list(set(fields) | set(["updated_at"]))
+
+        entry = self._get_entry(filters, fields)
+        if entry is None:
+            entry = self._add_entry(filters, _StoreEntry(fields))
+
+        with entry.lock:
+            if entry.high_water_mark is None:
+                # first sync so find all publishes:
+                sg_publishes = self._app.shotgun.find(published_file_type, filters, query_fields)
+                entry.publishes = {}
+                changed = entry.update(sg_publishes)
+                if entry.high_water_mark is None:
+                    # there were no publishes - use the current time as the mark to avoid
+                    # querying the full history next time:
+                    entry.high_water_mark = datetime.now(tz=sg_timezone.local)
+                    changed = True
+            else:
+                # find publishes created or updated since the last sync:
+                delta_filters = filters + [
+                    ["updated_at", "greater_than", entry.high_water_mark - _HIGH_WATER_MARK_OVERLAP]
+                ]
+                sg_publishes = self._app.shotgun.find(published_file_type, delta_filters, query_fields)
+                changed = entry.update(sg_publishes)
+
+                # and check that all stored publishes still exist and match the filters.  Counting
+                # the publishes is much cheaper than finding all of their ids so the ids are only
+                # queried when the counts differ:
+                if self._count_publishes(published_file_type, filters) != len(entry.publishes):
+                    current_ids = set([p["id"] for p in self._app.shotgun.find(published_file_type, filters, ["id"])])
+                    for publish_id in set(entry.publishes) - current_ids:
+                        del entry.publishes[publish_id]
+                        changed = True
+                    missing_ids = current_ids - set(entry.publishes)
+                    if missing_ids:
+                        # publishes that have started to match the filters without being updated,
+                        # e.g. ones that have been revived:
+                        sg_publishes = self._app.shotgun.find(
+                            published_file_type, [["id", "in"] + list(missing_ids)], query_fields
+                        )
+                        changed = entry.update(sg_publishes) or changed
+
+            if changed:
+                entry.revision += 1
+                self._save_entry(filters, entry)
+            return (self._sorted_publishes(entry), entry.revision)
+
+    def _count_publishes(self, published_file_type, filters):
+        """
+        :param published_file_type: The published file entity type
+        :param filters:             The list of Shotgun filters used to find the publishes
+        :returns:                   The number of publishes in Shotgun that match the filters
+        """
+        result = self._app.shotgun.summarize(published_file_type, filters,
+                                             [{"field":"id", "type":"count"}])
+        return result["summaries"]["id"]
+
+    def _sorted_publishes(self, entry):
+        """
+        :param entry:   The _StoreEntry to get the publishes from
+        :returns:       The list of publishes in the entry sorted by id
+        """
+        return [entry.publishes[publish_id] for publish_id in sorted(entry.publishes)]
+
+    def _get_entry(self, filters, fields):
+        """
+        Get the entry for the specified filters, loading it from disk if needed.
+
+        :param filters: The list of Shotgun filters used to find the publishes
+        :param fields:  The list of fields required for each publish
+        :returns:       The _StoreEntry or None if there isn't a valid entry for the filters
+        """
+        entry_key = self._get_entry_key(filters)
+        entry = self._get_cached_entry(entry_key)
+        if entry is None:
+            entry = self._read_entry(entry_key)
+            if entry is not None:
+                entry = self._add_entry(filters, entry)
+        if entry is not None and entry.fields != sorted(fields):
+            # entry is missing fields so can't be used:
+            return None
+        return entry
+
+    @Threaded.exclusive
+    def _get_cached_entry(self, entry_key):
+        """
+        :param entry_key:   The key of the entry to get
+        :returns:           The _StoreEntry held in memory or None
+        """
+        return self._entries.get(entry_key)
+
+    @Threaded.exclusive
+    def _add_entry(self, filters, entry):
+        """
+        Add an entry to the store, unless another thread has already added one for the filters
+        with the same fields.
+
+        :param filters: The list of Shotgun filters used to find the publishes
+        :param entry:   The _StoreEntry to add
+        :returns:       The _StoreEntry now in the store for the filters
+        """
+        entry_key = self._get_entry_key(filters)
+        existing = self._entries.get(entry_key)
+        if existing is not None and existing.fields == entry.fields:
+            return existing
+        self._entries[entry_key] = entry
+        return entry
+
+    def _get_entry_key(self, filters):
+        """
+        :param filters: The list of Shotgun filters used to find the publishes
+        :returns:       A string key for the filters that can be used as a file name
+        """
+        def _normalize(value):
+            if isinstance(value, dict):
+                # entity links only need the type and id:
+                return (value.get("type"), value.get("id"))
+            if isinstance(value, (list, tuple)):
+                return tuple([_normalize(v) for v in value])
+            return value
+        return hashlib.md5(repr(_normalize(filters))).hexdigest()
+
+    def _read_entry(self, entry_key):
+        """
+        :param entry_key:   The key of the entry to read
+        :returns:           The _StoreEntry read from disk or None if it doesn't exist or can't be read
+        """
+        entry_path = os.path.join(self._store_dir, "%s.pickle" % entry_key)
+        try:
+            with open(entry_path, "rb") as entry_file:
+                store = pickle.load(entry_file)
+            if store.get("version") == _STORE_VERSION:
+                return store["entry"]
+        except IOError:
+            # entry doesn't exist yet
+            pass
+        except Exception, e:
+            self._app.log_debug("Failed to read stored publishes from '%s': %s" % (entry_path, e))
+        return None
+
+    def _save_entry(self, filters, entry):
+        """
+        Save an entry to disk.  Must be called with the entry lock held.
+
+        :param filters: The list of Shotgun filters used to find the publishes
+        :param entry:   The _StoreEntry to save
+        """
+        entry_path = os.path.join(self._store_dir, "%s.pickle" % self._get_entry_key(filters))
+        # write to a temporary file first so that the entry is replaced atomically:
+        tmp_path = "%s.%d.tmp" % (entry_path, os.getpid())
+        try:
+            if not os.path.exists(self._store_dir):
+                os.makedirs(self._store_dir)
+            with open(tmp_path, "wb") as entry_file:
+                pickle.dump({"version":_STORE_VERSION, "entry":entry}, entry_file, 2)
+            if sys.platform == "win32" and os.path.exists(entry_path):
+                # rename doesn't replace existing files on Windows
+                os.remove(entry_path)
+            os.rename(tmp_path, entry_path)
+        except Exception, e:
+            self._app.log_debug("Failed to save stored publishes to '%s': %s" % (entry_path, e))
+
+
+# single global instance of the publish store, created on demand:
+_g_publish_store = None
+_g_publish_store_lock = threading.Lock()
+
+
+def get_publish_store():
+    """
+    Get the global publish store if it is enabled in the app settings.
+
+    :returns:   The PublishStore instance or None if the store isn't enabled
+    """
+    global _g_publish_store
+    with _g_publish_store_lock:
+        if _g_publish_store is None:
+            app = sgtk.platform.current_bundle()
+            if not app.get_setting("use_incremental_publish_sync", False):
+                return None
+            cache_location = getattr(app, "site_cache_location", None) or app.cache_location
+            _g_publish_store = PublishStore(os.path.join(cache_location, "publish_store"))
+        return _g_publish_store
@@ -0,0 +1,164 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Speculatively searches for the files of the Tasks visible in the entity views so that the search
+cache already contains them when the user selects one.
+"""
+import sgtk
+from sgtk.platform.qt import QtCore
+
+from .file_finder import AsyncFileFinder
+from .search_result_collector import SearchResultCollector
+
+
+class SearchPrefetcher(QtCore.QObject):
+    """
+    Runs searches for entities the user is likely to select next at a lower priority than all
+    other searches, adding the files found to a search cache.  Only a limited number of
+    prefetches run at the same time and entities that are no longer visible are dropped from the
+    queue whenever a new set of entities is requested.  All methods must be called from the main
+    thread.
+    """
+    # offset added to the priority of all prefetch tasks so that they only run once all tasks for
+    # searches the user is waiting on have started:
+    _PRIORITY_OFFSET = -100
+
+    def __init__(self, bg_task_manager, search_cache, max_prefetches, parent=None):
+        """
+        Construction
+
+        :param bg_task_manager: The BackgroundTaskManager to run the searches in
+        :param search_cache:    The FileSearchCache to add the files found to
+        :param max_prefetches:  The maximum number of prefetches to run at the same time
+        :param parent:          The parent QObject for this instance
+        """
+        QtCore.QObject.__init__(self, parent)
+
+        self._app = sgtk.platform.current_bundle()
+        self._search_cache = search_cache
+        self._max_prefetches = max(1, max_prefetches)
+        self._users = []
+        # list of entities waiting to be prefetched, most important first:
+        self._queue = []
+        # {search_id:entity}:
+        self._searches = {}
+        self._stats = {"requested":0, "completed":0, "failed":0, "added":0}
+
+        # prefetches must never be coalesced with searches the user is waiting on as these would
+        # then run at the prefetch priority:
+        self._finder = AsyncFileFinder(bg_task_manager, self, priority_offset=SearchPrefetcher._PRIORITY_OFFSET,
+                                       coalesce=False)
+        self._collector = SearchResultCollector(self._finder, search_cache, self)
+        self._collector.search_completed.connect(self._on_search_completed)
+        self._collector.search_failed.connect(self._on_search_failed)
+
+    def shut_down(self):
+        """
+        Stop all prefetches and release the file finder.
+        """
+        self._queue = []
+        if self._finder:
+            self._collector.search_completed.disconnect(self._on_search_completed)
+            self._collector.search_failed.disconnect(self._on_search_failed)
+            self._collector.shut_down()
+            self._collector = None
+            self._finder.stop_all_searches()
+            self._finder.shut_down()
+            self._finder = None
+        self._searches = {}
+
+    def get_stats(self):
+        """
+        :returns:   Dictionary containing the number of prefetches requested, completed and failed
+                    and the number of cache entries added
+        """
+        return dict(self._stats)
+
+    def prefetch(self, entities, users):
+        """
+        Replace the queue of entities to prefetch.  Entities that already have a cache entry for
+        all users or that are already being prefetched are skipped.
+
+        :param entities:    The list of entities to prefetch, most important first
+        :param users:       The list of users to search for files for
+        """
+        if not self._finder:
+            return
+        if users != self._users:
+            # prefetches for the previous users are no longer useful:
+            self.stop()
+            self._users = list(users)
+
+        running_keys = set([(e["type"], e["id"]) for e in self._searches.values()])
+        queued_keys = set()
+        self._queue = []
+        for entity in entities:
+            entity_key = (entity["type"], entity["id"])
+            if entity_key in running_keys or entity_key in queued_keys:
+                continue
+            queued_keys.add(entity_key)
+            if all([self._search_cache.contains(entity, user) for user in self._users]):
+                # already cached:
+                continue
+            self._queue.append(entity)
+        self._start_prefetches()
+
+    def stop(self):
+        """
+        Stop all running prefetches and clear the queue.
+        """
+        self._queue = []
+        for search_id in self._searches:
+            self._finder.stop_search(search_id)
+            self._collector.remove_search(search_id)
+        self._searches = {}
+
+    def _start_prefetches(self):
+        """
+        Start prefetches for the entities at the front of the queue until the budget is used.
+        """
+        while self._queue and len(self._searches) < self._max_prefetches:
+            entity = self._queue.pop(0)
+            search_id = self._finder.begin_search(entity, self._users)
+            self._searches[search_id] = entity
+            self._collector.add_search(search_id)
+            self._stats["requested"] += 1
+
+    def _on_search_completed(self, search_id, num_added):
+        """
+        Slot triggered when a prefetch has completed and the files found have been added to the
+        search cache, unless the file model had already added them.
+
+        :param search_id:   The id of the search that has completed
+        :param num_added:   The number of cache entries that were added
+        """
+        entity = self._searches.pop(search_id, None)
+        if entity is None:
+            return
+        self._stats["completed"] += 1
+        self._stats["added"] += num_added
+        self._app.log_debug("Prefetched files for %s %s" % (entity["type"], entity["id"]))
+        self._start_prefetches()
+
+    def _on_search_failed(self, search_id, error_msg):
+        """
+        Slot triggered when a prefetch has failed.
+
+        :param search_id:   The id of the search that failed
+        :param error_msg:   The error message
+        """
+        entity = self._searches.pop(search_id, None)
+        if entity is None:
+            return
+        self._stats["failed"] += 1
+        self._app.log_debug("Failed to prefetch files for %s %s: %s"
+                            % (entity["type"], entity["id"], error_msg))
+        self._start_prefetches()
@@ -0,0 +1,144 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Collects the files found by background searches, e.g. those run to pre-warm or prefetch the
+search cache, and adds them to the search cache once each search has completed.
+"""
+from sgtk.platform.qt import QtCore
+
+
+class SearchResultCollector(QtCore.QObject):
+    """
+    Collects the work files and publishes found by the searches of an AsyncFileFinder for each
+    user's work area and adds them to a search cache when the search completes.  Only searches
+    added with add_search() are collected.  All methods must be called from the main thread.
+    """
+    search_completed = QtCore.Signal(object, int) # search_id, number of cache entries added
+    search_failed = QtCore.Signal(object, object) # search_id, message
+
+    def __init__(self, finder, search_cache, parent=None):
+        """
+        Construction
+
+        :param finder:          The AsyncFileFinder running the searches
+        :param search_cache:    The FileSearchCache to add the files found to or None if the
+                                files shouldn't be added to a cache
+        :param parent:          The parent QObject for this instance
+        """
+        QtCore.QObject.__init__(self, parent)
+
+        self._search_cache = search_cache
+        # {search_id:{user key:[work area, work files, publishes]}}:
+        self._search_results = {}
+
+        self._finder = finder
+        self._finder.files_found.connect(self._on_files_found)
+        self._finder.publishes_found.connect(self._on_publishes_found)
+        self._finder.search_completed.connect(self._on_search_completed)
+        self._finder.search_failed.connect(self._on_search_failed)
+
+    def shut_down(self):
+        """
+        Disconnect from the finder and discard the files collected so far.
+        """
+        if self._finder:
+            self._finder.files_found.disconnect(self._on_files_found)
+            self._finder.publishes_found.disconnect(self._on_publishes_found)
+            self._finder.search_completed.disconnect(self._on_search_completed)
+            self._finder.search_failed.disconnect(self._on_search_failed)
+            self._finder = None
+        self._search_results = {}
+
+    def add_search(self, search_id):
+        """
+        Start collecting the files found by a search.
+
+        :param search_id:   The id of the search returned by the finder
+        """
+        self._search_results[search_id] = {}
+
+    def remove_search(self, search_id):
+        """
+        Stop collecting the files found by a search, discarding any files collected so far.
+
+        :param search_id:   The id of the search
+        """
+        self._search_results.pop(search_id, None)
+
+    def _get_results(self, search_id, work_area):
+        """
+        :param search_id:   The id of the search to get the results for
+        :param work_area:   The work area the files were found in
+        :returns:           The [work area, work files, publishes] list that the files found in the
+                            work area are stored in or None if the search isn't being collected
+        """
+        search_results = self._search_results.get(search_id)
+        if search_results is None:
+            return None
+        user = work_area.context.user
+        user_key = (user["type"], user["id"]) if user else None
+        results = search_results.setdefault(user_key, [work_area, [], []])
+        results[0] = work_area
+        return results
+
+    def _on_files_found(self, search_id, file_list, work_area, is_final=True):
+        """
+        Slot triggered when the finder has found some work files for a search.
+
+        :param search_id:   The id of the search that the work files were found for
+        :param file_list:   The list of FileItems that were found
+        :param work_area:   The work area that the files were found in
+        :param is_final:    False if more work files will be found for the work area
+        """
+        results = self._get_results(search_id, work_area)
+        if results is not None:
+            results[1].extend(file_list)
+
+    def _on_publishes_found(self, search_id, file_list, work_area):
+        """
+        Slot triggered when the finder has found some publishes for a search.
+
+        :param search_id:   The id of the search that the publishes were found for
+        :param file_list:   The list of FileItems that were found
+        :param work_area:   The work area that the publishes were found in
+        """
+        results = self._get_results(search_id, work_area)
+        if results is not None:
+            results[2].extend(file_list)
+
+    def _on_search_completed(self, search_id):
+        """
+        Slot triggered when a search has completed.  The work files and publishes found are merged
+        and added to the search cache, unless an entry has already been added for the work area,
+        e.g. by a file model.
+
+        :param search_id:   The id of the search that has completed
+        """
+        search_results = self._search_results.pop(search_id, None)
+        if search_results is None:
+            return
+        num_added = 0
+        if self._search_cache:
+            for work_area, work_files, publishes in search_results.values():
+                if self._search_cache.add_search_results(work_area, work_files, publishes):
+                    num_added += 1
+        self.search_completed.emit(search_id, num_added)
+
+    def _on_search_failed(self, search_id, error_msg):
+        """
+        Slot triggered when a search has failed.
+
+        :param search_id:   The id of the search that failed
+        :param error_msg:   The error message
+        """
+        if self._search_results.pop(search_id, None) is None:
+            return
+        self.search_failed.emit(search_id, error_msg)
@@ -0,0 +1,555 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Limits the number of background tasks of each resource class (filesystem, Shotgun and cpu) that
+run at the same time so that a slow file server or a slow Shotgun site can't occupy every thread
+in the task manager and starve the other classes of work.
+"""
+import time
+import functools
+import itertools
+
+import sgtk
+from sgtk.platform.qt import QtCore
+
+
+class _Task(object):
+    """
+    A task added to the limiter that hasn't completed yet.
+    """
+    def __init__(self, task_id, task_class, cbl, group, priority, task_kwargs):
+        """
+        Construction
+
+        :param task_id:     The id of the task returned to the caller
+        :param task_class:  The resource class of the task or None for pass-through tasks
+        :param cbl:         The callable to run or None for pass-through tasks
+        :param group:       The group the task belongs to
+        :param priority:    The priority of the task
+        :param task_kwargs: The kwargs to run the task with
+        """
+        self.id = task_id
+        self.task_class = task_class
+        self.cbl = cbl
+        self.group = group
+        self.priority = priority or 0
+        self.kwargs = dict(task_kwargs or {})
+        # ids of the upstream tasks that haven't completed yet:
+        self.upstream_ids = set()
+        # ids of the tasks waiting for this task to complete:
+        self.downstream_ids = []
+        # the id of the task in the task manager once it has been released:
+        self.manager_task_id = None
+        self.ready_time = None
+        # set in the worker thread when the task starts and once it has run:
+        self.started = False
+        self.run_time = None
+        # set once the limiter has been told the task has finished running in the worker thread:
+        self.finished_running = False
+        # set if the task was stopped after it was released to the task manager:
+        self.stopped = False
+        # set once the slot the task was using has been freed:
+        self.slot_freed = False
+
+
+class _TaskClassState(object):
+    """
+    The queue, limit and statistics for a single resource class.
+    """
+    def __init__(self, base_limit, max_limit):
+        """
+        Construction
+
+        :param base_limit:  The configured number of tasks that can run at the same time
+        :param max_limit:   The number of tasks the limit can be raised to when tasks are slow
+        """
+        self.base_limit = base_limit
+        self.max_limit = max_limit
+        self.limit = base_limit
+        self.queue = []
+        self.running = 0
+        self.peak_queued = 0
+        self.completed = 0
+        # exponentially weighted moving averages in seconds:
+        self.mean_wait = 0.0
+        self.mean_run_time = 0.0
+
+
+class TaskLimiter(QtCore.QObject):
+    """
+    Wraps a BackgroundTaskManager, queueing the tasks of each resource class separately and only
+    passing them to the task manager once all of their upstream tasks have completed and fewer
+    than the limit for their class are running.  The limit for filesystem and Shotgun tasks is
+    raised, up to a maximum, whilst their tasks are slow and there are tasks waiting and lowered
+    back to the configured limit once they speed up again.
+
+    Provides the subset of the BackgroundTaskManager interface used by the file finder.  Task ids
+    returned by the limiter are only meaningful to the limiter and its signals.  All methods must
+    be called from the main thread.
+
+    A single limiter is shared by everything that runs tasks in a task manager so that the limits
+    and statistics apply across all models - use get_task_limiter() rather than constructing
+    limiters directly.
+    """
+    # the resource classes tasks can be added for:
+    FILESYSTEM, SHOTGUN, CPU = ("filesystem", "shotgun", "cpu")
+
+    # the classes whose limit adapts to the latency of their tasks.  Cpu tasks contend for the GIL
+    # so running more of them at once doesn't help:
+    _ADAPTIVE_CLASSES = (FILESYSTEM, SHOTGUN)
+    # the limit of an adaptive class can be raised up to this multiple of the configured limit:
+    _MAX_LIMIT_SCALE = 2
+    # average run times (in seconds) above which the limit is raised and below which it is lowered:
+    _HIGH_LATENCY, _LOW_LATENCY = (0.5, 0.1)
+    # weight given to the latest sample in the moving averages:
+    _SMOOTHING = 0.2
+
+    task_completed = QtCore.Signal(int, object, object) # task_id, group, result
+    task_failed = QtCore.Signal(int, object, str, str) # task_id, group, message, stack trace
+    task_group_finished = QtCore.Signal(object) # group
+
+    # emitted from the worker thread once a task has finished running:
+    _task_run_finished = QtCore.Signal(object) # _Task
+
+    def __init__(self, bg_task_manager, task_limits, parent=None):
+        """
+        Construction
+
+        :param bg_task_manager: The BackgroundTaskManager to run the tasks in
+        :param task_limits:     Dictionary {resource class:limit} of the number of tasks of each
+                                class that can run at the same time
+        :param parent:          The parent QObject for this instance
+        """
+        QtCore.QObject.__init__(self, parent)
+
+        self._app = sgtk.platform.current_bundle()
+        self._classes = {}
+        for task_class, limit in task_limits.iteritems():
+            self._classes[task_class] = _TaskClassState(limit, get_max_task_limit(task_class, limit))
+
+        self._next_task_id = itertools.count(1)
+        # {task id:_Task} of all tasks that haven't completed yet:
+        self._tasks = {}
+        # {group:set(task ids)}:
+        self._group_tasks = {}
+        # {task manager task id:task id} of all tasks that have been released to the task manager:
+        self._released_tasks = {}
+
+        self._task_run_finished.connect(self._on_task_run_finished)
+
+        self._bg_task_manager = bg_task_manager
+        self._bg_task_manager.task_completed.connect(self._on_task_completed)
+        self._bg_task_manager.task_failed.connect(self._on_task_failed)
+
+    def shut_down(self):
+        """
+        Stop all tasks and disconnect from the task manager.
+        """
+        if self._bg_task_manager:
+            self.stop_all_tasks()
+            self._bg_task_manager.task_completed.disconnect(self._on_task_completed)
+            self._bg_task_manager.task_failed.disconnect(self._on_task_failed)
+            self._bg_task_manager = None
+
+    def next_group_id(self):
+        """
+        :returns:   A new unique group id from the task manager
+        """
+        return self._bg_task_manager.next_group_id()
+
+    def add_task(self, cbl, task_class, group=None, priority=None, upstream_task_ids=None,
+                 task_kwargs=None):
+        """
+        Add a task that will be run in the task manager once its upstream tasks have completed
+        and there is capacity for its resource class.  As with the task manager, the results of
+        upstream tasks are merged into the kwargs the task is run with.
+
+        :param cbl:                 The callable to run
+        :param task_class:          The resource class of the task
+        :param group:               The group the task belongs to
+        :param priority:            The priority of the task - higher priority tasks are run first
+        :param upstream_task_ids:   Ids of tasks that must complete before this task can run
+        :param task_kwargs:         The kwargs to run the task with
+        :returns:                   The id of the task
+        """
+        return self._add_task(cbl, task_class, group, priority, upstream_task_ids, task_kwargs)
+
+    def add_pass_through_task(self, group=None, priority=None, upstream_task_ids=None,
+                              task_kwargs=None):
+        """
+        Add a task that doesn't do anything other than return its kwargs, merged with the results
+        of any upstream tasks.  Pass-through tasks don't count towards any limit.
+
+        :param group:               The group the task belongs to
+        :param priority:            The priority of the task
+        :param upstream_task_ids:   Ids of tasks that must complete before this task completes
+        :param task_kwargs:         The kwargs to return as the result
+        :returns:                   The id of the task
+        """
+        return self._add_task(None, None, group, priority, upstream_task_ids, task_kwargs)
+
+    def stop_task_group(self, group):
+        """
+        Stop all tasks in a group.  Tasks that are running in the task manager will complete but
+        their results will be discarded.  They continue to count towards the limit for their class
+        until they finish running.
+
+        :param group:   The group to stop
+        """
+        task_ids = self._group_tasks.pop(group, None)
+        if not task_ids:
+            return
+        for task_id in task_ids:
+            self._discard_task(self._tasks.get(task_id), stopped=True)
+        self._bg_task_manager.stop_task_group(group)
+        self._release_tasks()
+
+    def stop_all_tasks(self):
+        """
+        Stop all tasks added to the limiter.
+        """
+        for group in self._group_tasks.keys():
+            self.stop_task_group(group)
+
+    def get_stats(self):
+        """
+        :returns:   Dictionary {resource class:stats} where stats is a dictionary containing the
+                    current limit, the number of tasks running and queued, the peak number of
+                    tasks queued, the number of tasks completed and the average time in seconds
+                    tasks have waited to run and taken to run.
+        """
+        stats = {}
+        for task_class, state in self._classes.iteritems():
+            stats[task_class] = {"limit":state.limit, "running":state.running, "queued":len(state.queue),
+                                 "peak_queued":state.peak_queued, "completed":state.completed,
+                                 "mean_wait":state.mean_wait, "mean_run_time":state.mean_run_time}
+        return stats
+
+    def _add_task(self, cbl, task_class, group, priority, upstream_task_ids, task_kwargs):
+        """
+        Add a task to the limiter.
+
+        :returns:   The id of the task
+        """
+        task = _Task(self._next_task_id.next(), task_class, cbl, group, priority, task_kwargs)
+        self._tasks[task.id] = task
+        self._group_tasks.setdefault(group, set()).add(task.id)
+
+        for upstream_id in upstream_task_ids or []:
+            upstream_task = self._tasks.get(upstream_id)
+            if upstream_task:
+                task.upstream_ids.add(upstream_id)
+                upstream_task.downstream_ids.append(task.id)
+
+        if not task.upstream_ids:
+            self._on_task_ready(task)
+            self._release_tasks()
+        return task.id
+
+    def _on_task_ready(self, task):
+        """
+        Queue a task that has no outstanding upstream tasks.  Pass-through tasks are passed
+        straight to the task manager.
+
+        :param task:    The _Task that is ready to run
+        """
+        task.ready_time = time.time()
+        state = self._classes.get(task.task_class)
+        if task.cbl is None or not state:
+            self._release_task(task)
+            return
+        state.queue.append(task)
+        state.peak_queued = max(state.peak_queued, len(state.queue))
+
+    def _release_tasks(self):
+        """
+        Pass the highest priority queued tasks of each class to the task manager until the class
+        reaches its limit.
+        """
+        for state in self._classes.itervalues():
+            while state.queue and state.running < state.limit:
+                # the queue is short so a linear search is fine:
+                task = max(state.queue, key=lambda t: (t.priority, -t.id))
+                state.queue.remove(task)
+                state.running += 1
+                wait = time.time() - task.ready_time
+                state.mean_wait += (wait - state.mean_wait) * TaskLimiter._SMOOTHING
+                self._release_task(task)
+
+    def _release_task(self, task):
+        """
+        Pass a task to the task manager.
+
+        :param task:    The _Task to release
+        """
+        if task.cbl is None:
+            task.manager_task_id = self._bg_task_manager.add_pass_through_task(group=task.group,
+                                                                               priority=task.priority,
+                                                                               task_kwargs=task.kwargs)
+        else:
+            task.manager_task_id = self._bg_task_manager.add_task(functools.partial(self._run_task, task),
+                                                                  group=task.group,
+                                                                  priority=task.priority,
+                                                                  task_kwargs=task.kwargs)
+        self._released_tasks[task.manager_task_id] = task.id
+
+    def _run_task(self, task, **kwargs):
+        """
+        Run a task, recording how long it took.  Runs in a background thread.
+
+        :param task:    The _Task to run
+        :returns:       The result of the task
+        """
+        task.started = True
+        start_time = time.time()
+        try:
+            return task.cbl(**kwargs)
+        finally:
+            task.run_time = time.time() - start_time
+            self._task_run_finished.emit(task)
+
+    def _on_task_run_finished(self, task):
+        """
+        Slot triggered in the main thread once a task has finished running in a worker thread.
+        Frees up the slot of the task if it was stopped whilst it was running as the task manager
+        won't report that it has completed.
+
+        :param task:    The _Task that has finished running
+        """
+        task.finished_running = True
+        if task.stopped:
+            self._free_slot(task)
+            self._release_tasks()
+
+    def _free_slot(self, task):
+        """
+        Free up the slot used by a task that has been released to the task manager.
+
+        :param task:    The _Task whose slot should be freed
+        """
+        state = self._classes.get(task.task_class)
+        if state and task.cbl is not None and not task.slot_freed:
+            task.slot_freed = True
+            state.running -= 1
+
+    def _discard_task(self, task, stopped=False):
+        """
+        Remove a task from the limiter.  If the task has been released to the task manager then
+        any result it returns is ignored and its slot is freed up, unless the task was stopped
+        whilst it is running, in which case the slot is freed once it finishes running.  Tasks
+        that are waiting for the task are not affected.
+
+        :param task:    The _Task to discard
+        :param stopped: True if the task is being stopped rather than having finished
+        """
+        if not task:
+            return
+        del self._tasks[task.id]
+        if task.manager_task_id is not None:
+            del self._released_tasks[task.manager_task_id]
+            task.stopped = stopped
+            if not (stopped and task.started and not task.finished_running):
+                # the task manager won't run a stopped task that hasn't started:
+                self._free_slot(task)
+        else:
+            state = self._classes.get(task.task_class)
+            if state and task in state.queue:
+                state.queue.remove(task)
+
+    def _discard_downstream_tasks(self, task):
+        """
+        Remove all tasks that are waiting, directly or indirectly, for a task.
+
+        :param task:    The _Task whose downstream tasks should be removed
+        """
+        for downstream_id in task.downstream_ids:
+            downstream_task = self._tasks.get(downstream_id)
+            if downstream_task:
+                self._discard_task(downstream_task)
+                self._group_tasks.get(downstream_task.group, set()).discard(downstream_id)
+                self._discard_downstream_tasks(downstream_task)
+
+    def _on_task_finished(self, task):
+        """
+        Update the statistics and limit for the class of a task that has finished running.
+
+        :param task:    The _Task that has finished
+        """
+        state = self._classes.get(task.task_class)
+        if not state or task.run_time is None:
+            return
+        state.completed += 1
+        state.mean_run_time += (task.run_time - state.mean_run_time) * TaskLimiter._SMOOTHING
+        if task.task_class not in TaskLimiter._ADAPTIVE_CLASSES:
+            return
+
+        # slow I/O means threads are mostly waiting so more tasks can be run to hide the latency:
+        if (state.mean_run_time > TaskLimiter._HIGH_LATENCY and state.queue
+            and state.limit < state.max_limit):
+            state.limit += 1
+            self._app.log_debug("Raised %s task limit to %d (average run time %.2fs)"
+                                % (task.task_class, state.limit, state.mean_run_time))
+        elif state.mean_run_time < TaskLimiter._LOW_LATENCY and state.limit > state.base_limit:
+            state.limit -= 1
+            self._app.log_debug("Lowered %s task limit to %d (average run time %.2fs)"
+                                % (task.task_class, state.limit, state.mean_run_time))
+
+    def _finish_task(self, manager_task_id):
+        """
+        Remove a task that has completed or failed in the task manager from the limiter.
+
+        :param manager_task_id: The id of the task in the task manager
+        :returns:               The _Task that finished or None if the task wasn't added by the
+                                limiter or has been stopped
+        """
+        task_id = self._released_tasks.get(manager_task_id)
+        if task_id is None:
+            return None
+        task = self._tasks[task_id]
+        self._discard_task(task)
+        self._group_tasks.get(task.group, set()).discard(task_id)
+        self._on_task_finished(task)
+        return task
+
+    def _check_group_finished(self, group):
+        """
+        Emit the task_group_finished signal if all tasks in a group have finished.
+
+        :param group:   The group to check
+        """
+        if group in self._group_tasks and not self._group_tasks[group]:
+            del self._group_tasks[group]
+            self.task_group_finished.emit(group)
+
+    def _on_task_completed(self, manager_task_id, group, result):
+        """
+        Slot triggered when a task has completed in the task manager.
+
+        :param manager_task_id: The id of the task in the task manager
+        :param group:           The group the task belongs to
+        :param result:          The result of the task
+        """
+        task = self._finish_task(manager_task_id)
+        if not task:
+            return
+
+        # queue any downstream tasks that were only waiting for this task:
+        for downstream_id in task.downstream_ids:
+            downstream_task = self._tasks.get(downstream_id)
+            if not downstream_task:
+                continue
+            if isinstance(result, dict):
+                downstream_task.kwargs.update(result)
+            downstream_task.upstream_ids.discard(task.id)
+            if not downstream_task.upstream_ids:
+                self._on_task_ready(downstream_task)
+        self._release_tasks()
+
+        self.task_completed.emit(task.id, task.group, result)
+        # slots connected to the signal may have added more tasks to the group:
+        self._check_group_finished(task.group)
+
+    def _on_task_failed(self, manager_task_id, group, msg, stack_trace):
+        """
+        Slot triggered when a task has failed in the task manager.
+
+        :param manager_task_id: The id of the task in the task manager
+        :param group:           The group the task belongs to
+        :param msg:             The error message
+        :param stack_trace:     The stack trace of the error
+        """
+        task = self._finish_task(manager_task_id)
+        if not task:
+            return
+
+        # tasks waiting for the failed task can never run:
+        self._discard_downstream_tasks(task)
+        self._release_tasks()
+
+        self.task_failed.emit(task.id, task.group, msg, stack_trace)
+        self._check_group_finished(task.group)
+
+
+# limiters shared by everything that runs tasks in a task manager, {task manager:TaskLimiter}:
+_g_task_limiters = {}
+
+
+def get_task_limiter(bg_task_manager):
+    """
+    Get the TaskLimiter shared by everything that runs tasks in a task manager, creating it if
+    needed.  The limiter should be released with release_task_limiter() before the task manager
+    is shut down.
+
+    :param bg_task_manager: The BackgroundTaskManager the tasks will be run in
+    :returns:               The shared TaskLimiter instance or None if tasks shouldn't be limited
+    """
+    limiter = _g_task_limiters.get(bg_task_manager)
+    if not limiter:
+        task_limits = get_task_limits()
+        if not task_limits:
+            return None
+        limiter = TaskLimiter(bg_task_manager, task_limits)
+        _g_task_limiters[bg_task_manager] = limiter
+    return limiter
+
+
+def release_task_limiter(bg_task_manager):
+    """
+    Shut down and release the TaskLimiter shared by everything that runs tasks in a task manager
+    if there is one.
+
+    :param bg_task_manager: The BackgroundTaskManager the limiter was created for
+    """
+    limiter = _g_task_limiters.pop(bg_task_manager, None)
+    if limiter:
+        limiter.shut_down()
+
+
+def get_task_limits():
+    """
+    Get the number of tasks of each resource class that can run at the same time from the app
+    settings.
+
+    :returns:   Dictionary {resource class:limit} or None if tasks shouldn't be limited
+    """
+    app = sgtk.platform.current_bundle()
+    if not app.get_setting("limit_task_concurrency", False):
+        return None
+    return {
+        TaskLimiter.FILESYSTEM:max(1, app.get_setting("filesystem_task_limit", 4)),
+        TaskLimiter.SHOTGUN:max(1, app.get_setting("shotgun_task_limit", 4)),
+        TaskLimiter.CPU:max(1, app.get_setting("cpu_task_limit", 2))
+    }
+
+
+def get_max_task_limit(task_class, limit):
+    """
+    :param task_class:  The resource class
+    :param limit:       The configured limit for the class
+    :returns:           The limit the class can be raised to when its tasks are slow
+    """
+    if task_class in TaskLimiter._ADAPTIVE_CLASSES:
+        return limit * TaskLimiter._MAX_LIMIT_SCALE
+    return limit
+
+
+def get_required_threads(task_limits, default_threads):
+    """
+    :param task_limits:     Dictionary {resource class:limit} returned by get_task_limits() or None
+    :param default_threads: The number of threads used when tasks aren't limited
+    :returns:               The number of threads the task manager needs so that every class of
+                            its shared limiter can reach its maximum limit without blocking the
+                            tasks of other models
+    """
+    if not task_limits:
+        return default_threads
+    return max(default_threads,
+               sum([get_max_task_limit(task_class, limit) for task_class, limit in task_limits.iteritems()]))
@@ -0,0 +1,313 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Bulk extraction of template fields from paths.  A template is compiled once into a set of
+regular expressions that can then be used to parse a large number of paths much faster than
+calling Template.get_fields for each path.
+"""
+import os
+import re
+import sys
+import threading
+import weakref
+
+from sgtk import TankError
+
+from .template_walker import expand_definition, key_pattern
+
+# regular expression used to find keys in template definitions:
+_KEY_TOKEN_RE = re.compile(r"\{([^\{\}]+)\}")
+
+# the minimum number of paths before a process pool is used to match them:
+_POOL_MIN_PATHS = 5000
+_POOL_CHUNK_SIZE = 1000
+
+# regular expression used to check that sys.executable is a Python interpreter rather than a DCC
+# that embeds Python, e.g. python, python2.7 or pythonw.exe:
+_PYTHON_EXECUTABLE_RE = re.compile(r"^python(w)?[\d\.]*(\.exe)?$", re.IGNORECASE)
+
+# result returned by _match_paths when a path matches in more than one way:
+_AMBIGUOUS = -1
+
+
+def _value_pattern(key, greedy):
+    """
+    Build the pattern for a key value that either matches as much or as little as possible.
+
+    :param key:     The TemplateKey to build the pattern for
+    :param greedy:  True if the pattern should be greedy, False if it should be lazy
+    :returns:       A string containing the regular expression fragment
+    """
+    pattern = key_pattern(key)
+    if pattern.endswith("+?"):
+        return pattern[:-1] if greedy else pattern
+    if pattern.endswith("+"):
+        return pattern if greedy else pattern + "?"
+    return pattern
+
+
+def _compile_variant(root_path, definition, template_keys, greedy):
+    """
+    Build the pattern for a single definition variant.
+
+    :param root_path:       The root path of the template
+    :param definition:      The template definition variant
+    :param template_keys:   Dictionary of the template's TemplateKeys indexed by name
+    :param greedy:          True if the key patterns should be greedy, False if they should be lazy
+    :returns:               Tuple (pattern string, {group name:key name})
+    """
+    pattern = ""
+    group_keys = {}
+    tokens = _KEY_TOKEN_RE.split(definition.strip("/\\"))
+    for ti, token in enumerate(tokens):
+        if ti % 2 == 0:
+            # static token - separators can be either forward or back slashes:
+            pattern += r"[/\\]".join([re.escape(part) for part in re.split(r"[/\\]", token)])
+        else:
+            group_name = "k%d" % len(group_keys)
+            group_keys[group_name] = token
+            pattern += "(?P<%s>%s)" % (group_name, _value_pattern(template_keys[token], greedy))
+
+    root_pattern = re.escape(root_path.rstrip("/\\")) if root_path else ""
+    return (r"%s[/\\]%s[/\\]*\Z" % (root_pattern, pattern), group_keys)
+
+
+def _match_paths(compiled_variants, paths):
+    """
+    Match a list of paths against the compiled variants of a template.
+
+    :param compiled_variants:   List of (greedy regex, lazy regex) tuples, one per variant
+    :param paths:               The list of paths to match
+    :returns:                   A list containing, for each path, either None if the path didn't
+                                match, _AMBIGUOUS if it matched in more than one way or a tuple
+                                (variant index, {group name:value string})
+    """
+    results = []
+    for path in paths:
+        result = None
+        for vi, (greedy_re, lazy_re) in enumerate(compiled_variants):
+            lazy_match = lazy_re.match(path)
+            if not lazy_match:
+                continue
+            values = lazy_match.groupdict()
+            if result is not None or greedy_re.match(path).groupdict() != values:
+                # the path can be split into values in more than one way:
+                result = _AMBIGUOUS
+                break
+            result = (vi, values)
+        results.append(result)
+    return results
+
+
+def _match_paths_chunk(args):
+    """
+    Process pool entry point - this is a module level function so that it can be pickled.
+
+    :param args:    Tuple of (list of (greedy pattern, lazy pattern) strings, regex flags, paths)
+    :returns:       The result of _match_paths
+    """
+    variant_patterns, flags, paths = args
+    compiled = [(re.compile(g, flags), re.compile(l, flags)) for g, l in variant_patterns]
+    return _match_paths(compiled, paths)
+
+
+class TemplateFieldExtractor(object):
+    """
+    Extracts fields from paths for a single template.  The results are identical to calling
+    Template.get_fields for each path - any path that can't be parsed unambiguously by the
+    compiled patterns falls back to Template.get_fields.
+    """
+    def __init__(self, template):
+        """
+        Construction
+
+        :param template:    The TemplatePath to extract fields for
+        """
+        # only a weak reference is kept so that the extractor doesn't keep the template alive:
+        self._template_ref = weakref.ref(template)
+        self._flags = re.IGNORECASE if sys.platform == "win32" else 0
+
+        template_keys = template.keys
+        root_path = getattr(template, "root_path", None)
+        self._variant_patterns = []
+        self._variant_keys = []
+        self._variant_res = []
+        for definition, _ in expand_definition(template.definition):
+            greedy_pattern, group_keys = _compile_variant(root_path, definition, template_keys, True)
+            lazy_pattern, _ = _compile_variant(root_path, definition, template_keys, False)
+            self._variant_patterns.append((greedy_pattern, lazy_pattern))
+            self._variant_keys.append(group_keys)
+            self._variant_res.append((re.compile(greedy_pattern, self._flags),
+                                      re.compile(lazy_pattern, self._flags)))
+        self._keys = template_keys
+
+    def get_fields(self, path):
+        """
+        Extract the fields from a single path.
+
+        :param path:    The path to extract the fields from
+        :returns:       A dictionary of fields or None if the path doesn't match the template
+        """
+        return self.extract([path])[0]
+
+    def extract(self, paths, processes=0):
+        """
+        Extract the fields from a list of paths.
+
+        :param paths:       The list of paths to extract the fields from
+        :param processes:   If greater than zero and the list of paths is large enough, the paths
+                            are matched using a pool of this many processes
+        :returns:           A list containing, for each path, a dictionary of fields or None if
+                            the path doesn't match the template
+        """
+        matches = None
+        if processes > 0 and len(paths) >= _POOL_MIN_PATHS:
+            matches = self._match_in_pool(paths, processes)
+        if matches is None:
+            matches = _match_paths(self._variant_res, paths)
+
+        results = []
+        for path, match in zip(paths, matches):
+            fields = None
+            if match is not None and match != _AMBIGUOUS:
+                fields = self._convert(*match)
+            if fields is None:
+                # let the template decide:
+                fields = self._template_get_fields(path)
+            results.append(fields)
+        return results
+
+    def _match_in_pool(self, paths, processes):
+        """
+        Match paths using a process pool.
+
+        :param paths:       The list of paths to match
+        :param processes:   The number of processes in the pool
+        :returns:           The result of _match_paths or None if a process pool can't be used
+        """
+        pool = _get_process_pool(processes)
+        if not pool:
+            return None
+        chunks = [(self._variant_patterns, self._flags, paths[i:i + _POOL_CHUNK_SIZE])
+                  for i in range(0, len(paths), _POOL_CHUNK_SIZE)]
+        results = []
+        for chunk_results in pool.map(_match_paths_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def _convert(self, variant_index, values):
+        """
+        Convert the string values matched for a variant into field values.
+
+        :param variant_index:   The index of the variant that matched
+        :param values:          Dictionary of {group name:value string}
+        :returns:               A dictionary of fields or None if the values aren't valid
+        """
+        fields = {}
+        group_keys = self._variant_keys[variant_index]
+        for group_name, value_str in values.iteritems():
+            key_name = group_keys[group_name]
+            try:
+                value = self._keys[key_name].value_from_str(value_str)
+            except TankError:
+                return None
+            if key_name in fields and fields[key_name] != value:
+                # the same key has to resolve to the same value throughout the path:
+                return None
+            fields[key_name] = value
+        return fields
+
+    def _template_get_fields(self, path):
+        """
+        :param path:    The path to extract the fields from
+        :returns:       The fields returned by Template.get_fields or None if the path doesn't
+                        match the template
+        """
+        template = self._template_ref()
+        if not template:
+            return None
+        try:
+            return template.get_fields(path)
+        except TankError:
+            return None
+
+
+# extractors are cached per template, {template:{cache key:TemplateFieldExtractor}} - weak so that
+# extractors are released along with the templates when the pipeline configuration is reloaded:
+_g_extractors = weakref.WeakKeyDictionary()
+_g_extractors_lock = threading.Lock()
+
+# process pool shared by all extractors, created on demand:
+_g_process_pool = None
+_g_process_pool_size = 0
+
+
+def get_field_extractor(template):
+    """
+    Get the field extractor for the specified template, creating it if needed.
+
+    :param template:    The TemplatePath to get the extractor for
+    :returns:           A TemplateFieldExtractor instance
+    """
+    cache_key = (template.name, template.definition, getattr(template, "root_path", None))
+    with _g_extractors_lock:
+        template_extractors = _g_extractors.setdefault(template, {})
+        extractor = template_extractors.get(cache_key)
+        if not extractor:
+            extractor = TemplateFieldExtractor(template)
+            template_extractors[cache_key] = extractor
+        return extractor
+
+
+def _is_python_executable():
+    """
+    Check if sys.executable is a Python interpreter.  On Windows, multiprocessing starts each
+    process in the pool by running sys.executable, which inside a DCC is the DCC itself.
+
+    :returns:   True if sys.executable is a Python interpreter
+    """
+    return bool(sys.executable
+                and _PYTHON_EXECUTABLE_RE.match(os.path.basename(sys.executable)))
+
+
+def _get_process_pool(processes):
+    """
+    Get the process pool used to match paths, creating it if needed.
+
+    :param processes:   The number of processes the pool should have
+    :returns:           A multiprocessing.Pool instance or None if a pool can't be started
+                        because sys.executable isn't a Python interpreter
+    """
+    global _g_process_pool, _g_process_pool_size
+    if not _is_python_executable():
+        return None
+    with _g_extractors_lock:
+        if _g_process_pool is None or _g_process_pool_size != processes:
+            import multiprocessing
+            if _g_process_pool is not None:
+                _g_process_pool.terminate()
+                _g_process_pool.join()
+            _g_process_pool = multiprocessing.Pool(processes)
+            _g_process_pool_size = processes
+        return _g_process_pool
+
+
+def release_process_pool():
+    """
+    Terminate and release the process pool if there is one, e.g. when the app is destroyed.
+    """
+    global _g_process_pool, _g_process_pool_size
+    with _g_extractors_lock:
+        if _g_process_pool is not None:
+            _g_process_pool.terminate()
+            _g_process_pool.join()
+            _g_process_pool = None
+            _g_process_pool_size = 0
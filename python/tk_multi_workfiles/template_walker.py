@@ -0,0 +1,467 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Filesystem walker compiled from a template definition.  This is used as a faster alternative
+to sgtk.paths_from_template when searching for work files.
+"""
+import os
+import re
+import stat
+import sys
+
+from sgtk import TankError
+
+try:
+    # Python 3.5+
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        # the scandir backport, if it has been installed
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+# regular expressions used to parse template definitions:
+_OPTIONAL_SECTION_RE = re.compile(r"\[[^\[\]]*\]")
+_KEY_TOKEN_RE = re.compile(r"\{([^\{\}]+)\}")
+
+# generic pattern used for any key whose value can't be restricted further - this mirrors the
+# glob '*' used by paths_from_template:
+_GENERIC_KEY_PATTERN = r"[^/\\]+?"
+
+
+class _ListDirEntry(object):
+    """
+    Minimal stand-in for os.DirEntry used when scandir isn't available.  Note that is_dir() and
+    stat() will both hit the filesystem in this case.
+    """
+    def __init__(self, directory, name):
+        """
+        Construction
+
+        :param directory:   The directory containing the entry
+        :param name:        The name of the entry
+        """
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        """
+        :returns:   True if the entry is a directory, otherwise False
+        """
+        return os.path.isdir(self.path)
+
+    def stat(self):
+        """
+        :returns:   The os.stat result for the entry
+        """
+        return os.stat(self.path)
+
+
+class _StatEntry(object):
+    """
+    os.DirEntry compatible wrapper around a stat result that has already been retrieved.
+    """
+    def __init__(self, path, stat_result):
+        """
+        Construction
+
+        :param path:        The path that was stat'd
+        :param stat_result: The os.stat result for the path
+        """
+        self.name = os.path.basename(path)
+        self.path = path
+        self._stat_result = stat_result
+
+    def is_dir(self):
+        """
+        :returns:   True if the entry is a directory, otherwise False
+        """
+        return stat.S_ISDIR(self._stat_result.st_mode)
+
+    def stat(self):
+        """
+        :returns:   The os.stat result for the entry
+        """
+        return self._stat_result
+
+
+def list_directory(directory):
+    """
+    List the entries in a directory, using os.scandir when available so that the entry
+    types can be determined without additional stat calls.
+
+    :param directory:   The directory to list
+    :returns:           A list of os.DirEntry (or compatible) instances
+    :raises OSError:    If the directory can't be listed
+    """
+    if _scandir:
+        return list(_scandir(directory))
+    return [_ListDirEntry(directory, name) for name in os.listdir(directory)]
+
+
+def expand_definition(definition):
+    """
+    Expand a template definition into all the variations of the definition that are created by
+    including or excluding the optional [...] sections.  The variations are ordered from the one
+    containing the most optional sections to the one containing the fewest.
+
+    :param definition:  The template definition string
+    :returns:           A list of (definition variant, set(optional key names omitted)) tuples
+    """
+    sections = _OPTIONAL_SECTION_RE.findall(definition)
+    if not sections:
+        return [(definition, set())]
+
+    # split the definition around the optional sections:
+    static_parts = _OPTIONAL_SECTION_RE.split(definition)
+
+    variants = []
+    num_sections = len(sections)
+    for mask in range(2 ** num_sections):
+        variant = static_parts[0]
+        omitted_keys = set()
+        for si, section in enumerate(sections):
+            if mask & (1 << si):
+                omitted_keys.update(_KEY_TOKEN_RE.findall(section))
+            else:
+                variant += section[1:-1]
+            variant += static_parts[si + 1]
+        variants.append((bin(mask).count("1"), variant, omitted_keys))
+
+    # order by the number of omitted sections, keeping the declaration order otherwise:
+    variants.sort(key=lambda v: v[0])
+    return [(v_definition, v_omitted_keys) for _, v_definition, v_omitted_keys in variants]
+
+
+def key_pattern(key):
+    """
+    Build a regular expression fragment that matches the string representation of a template key.
+
+    :param key: The TemplateKey to build the pattern for
+    :returns:   A string containing the regular expression fragment
+    """
+    choices = getattr(key, "choices", None)
+    if choices:
+        # the key can only be one of a fixed number of values:
+        try:
+            choice_strs = set([key.str_from_value(c) for c in choices])
+        except TankError:
+            choice_strs = None
+        if choice_strs:
+            return "(?:%s)" % "|".join([re.escape(s) for s in sorted(choice_strs, key=len, reverse=True)])
+
+    key_type = type(key).__name__
+    if key_type == "IntegerKey":
+        return r"\d+"
+    elif key_type == "StringKey":
+        filter_by = getattr(key, "filter_by", None)
+        if filter_by == "alphanumeric":
+            return r"[a-zA-Z0-9]+"
+        elif filter_by == "alpha":
+            return r"[a-zA-Z]+"
+        elif filter_by == "integer":
+            return r"[0-9]+"
+
+    return _GENERIC_KEY_PATTERN
+
+
+class _Segment(object):
+    """
+    A single path segment (directory or file name) of a template definition variant.  If all
+    keys in the segment have known values then the segment is static, otherwise it is matched
+    against directory entries using a compiled regular expression.
+    """
+    def __init__(self, segment_def, template_keys, fields):
+        """
+        Construction
+
+        :param segment_def:     The segment of the template definition, e.g. "{Shot}_{name}.v{version}.ma"
+        :param template_keys:   Dictionary of the template's TemplateKeys indexed by name
+        :param fields:          Dictionary of known key values
+        """
+        self.name = None
+        # (key name, TemplateKey) indexed by the regular expression group they are captured in:
+        self.keys = {}
+        self.hide_dot_files = False
+        self._regex = None
+
+        is_static = True
+        static_name = ""
+        pattern = ""
+        group_names = {}
+        tokens = _KEY_TOKEN_RE.split(segment_def)
+        for ti, token in enumerate(tokens):
+            if ti % 2 == 0:
+                # static token:
+                static_name += token
+                pattern += re.escape(token)
+                continue
+
+            key = template_keys[token]
+            if token in fields:
+                value_str = key.str_from_value(fields[token])
+                static_name += value_str
+                pattern += re.escape(value_str)
+                continue
+
+            # this is a wildcard key so the segment can't be static:
+            is_static = False
+            if ti == 1 and not tokens[0]:
+                # to match glob, a leading wildcard never matches hidden entries:
+                self.hide_dot_files = True
+            # key names aren't guaranteed to be valid group names so use generated ones:
+            group_name = group_names.get(token)
+            if group_name:
+                pattern += "(?P=%s)" % group_name
+            else:
+                group_name = "k%d" % len(group_names)
+                group_names[token] = group_name
+                self.keys[group_name] = (token, key)
+                pattern += "(?P<%s>%s)" % (group_name, key_pattern(key))
+
+        if is_static:
+            self.name = static_name
+        else:
+            flags = re.IGNORECASE if sys.platform == "win32" else 0
+            self._regex = re.compile(pattern + r"\Z", flags)
+
+    @property
+    def is_static(self):
+        """
+        :returns:   True if this segment doesn't contain any wildcard keys
+        """
+        return self.name is not None
+
+    def match(self, name, captured):
+        """
+        Match an entry name against this segment.
+
+        :param name:        The directory entry name to match
+        :param captured:    Dictionary of key values captured from previous segments
+        :returns:           A dictionary of all captured key values (including those captured
+                            from previous segments) if the name matches, otherwise None
+        """
+        if self.hide_dot_files and name.startswith("."):
+            return None
+        m = self._regex.match(name)
+        if not m:
+            return None
+
+        values = captured
+        for group_name, value_str in m.groupdict().iteritems():
+            key_name, key = self.keys[group_name]
+            try:
+                value = key.value_from_str(value_str)
+            except TankError:
+                return None
+            if key_name in captured:
+                # the same key has to resolve to the same value throughout the path:
+                if captured[key_name] != value:
+                    return None
+                continue
+            if values is captured:
+                values = dict(captured)
+            values[key_name] = value
+        return values
+
+
+class TemplateWalker(object):
+    """
+    Walks the filesystem to find all paths matching a template.  Unlike paths_from_template this
+    only descends into directories that can match the template, uses the entry types returned by
+    os.scandir rather than stat'ing entries and matches entries names against a single compiled
+    pattern per path segment.
+    """
+
+    def __init__(self, template, fields, skip_keys=None, skip_missing_optional_keys=False,
+                 list_directory_fn=None, cancel_token=None):
+        """
+        Construction.  The arguments match those of sgtk.paths_from_template with the addition
+        of list_directory_fn and cancel_token.
+
+        :param template:                    The TemplatePath to find paths for
+        :param fields:                      Dictionary of fields to resolve the template with
+        :param skip_keys:                   List of keys to treat as wildcards even if they are in fields
+        :param skip_missing_optional_keys:  If True, optional keys that aren't in fields are treated
+                                            as wildcards.
+        :param list_directory_fn:           Optional function used to list directories instead of
+                                            list_directory, e.g. to list them through an index.
+        :param cancel_token:                Optional CancellationToken checked before each directory
+                                            is visited so that the walk can be stopped part way.
+        """
+        self._root = template.root_path
+        self._list_directory_fn = list_directory_fn or list_directory
+        self._cancel_token = cancel_token
+        self._entries = {}
+        self._directories = set()
+        skip_keys = set(skip_keys or [])
+        template_keys = template.keys
+
+        local_fields = dict([(k, v) for k, v in fields.iteritems()
+                             if k not in skip_keys and k in template_keys])
+        if skip_missing_optional_keys:
+            skip_keys.update([k for k in template_keys
+                              if template.is_optional(k) and k not in local_fields])
+
+        self._variants = []
+        for definition, omitted_keys in expand_definition(template.definition):
+            if omitted_keys & set(local_fields):
+                # a path generated from this variant can't contain the values
+                # specified in the fields so it will never be valid:
+                continue
+            segment_defs = [s for s in re.split(r"[/\\]", definition) if s]
+            if not segment_defs:
+                continue
+            self._variants.append([_Segment(s, template_keys, local_fields) for s in segment_defs])
+
+    @property
+    def entries(self):
+        """
+        :returns:   A dictionary of {path:os.DirEntry} for all paths found so far.  The entries
+                    can be used to retrieve the stat information for a path without issuing
+                    any additional stat calls where the platform supports it.
+        """
+        return self._entries
+
+    @property
+    def directories(self):
+        """
+        :returns:   A set of all directories listed so far.  These are the directories that can
+                    contain paths matching the template, or directories containing them.
+        """
+        return self._directories
+
+    def walk(self):
+        """
+        Walk the filesystem and return all paths that match the template.
+
+        :returns:   A list of matching paths
+        """
+        return list(self.iter_paths())
+
+    def iter_paths(self, root_directory=None):
+        """
+        Walk the filesystem, yielding paths that match the template as they are found.
+
+        :param root_directory:  Optional directory to start walking from instead of the root of
+                                the template, e.g. to only find the paths below a directory that
+                                is known to have changed.
+        :returns:               A generator yielding matching paths
+        """
+        found = set()
+        for segments in self._variants:
+            start = self._get_walk_start(segments, root_directory)
+            if not start:
+                continue
+            for path in self._walk_variant(segments, start):
+                if path not in found:
+                    found.add(path)
+                    yield path
+
+    def _get_walk_start(self, segments, directory):
+        """
+        Match a directory against the leading segments of a definition variant to find where a
+        walk starting from the directory should begin.
+
+        :param segments:    The list of _Segment instances representing the variant
+        :param directory:   The directory to start from or None to start from the template root
+        :returns:           Tuple (directory, segment index, captured values) or None if paths
+                            matching the variant can't be found below the directory
+        """
+        if not directory:
+            return (self._root, 0, {})
+
+        relative_path = os.path.relpath(directory, self._root)
+        if relative_path == os.curdir:
+            return (self._root, 0, {})
+        names = [n for n in re.split(r"[/\\]", relative_path) if n]
+        if not names or names[0] == os.pardir or len(names) >= len(segments):
+            # the directory isn't below the root or is too deep to contain any matching paths:
+            return None
+
+        captured = {}
+        for name, segment in zip(names, segments):
+            if segment.is_static:
+                if os.path.normcase(name) != os.path.normcase(segment.name):
+                    return None
+                continue
+            captured = segment.match(name, captured)
+            if captured is None:
+                return None
+        return (directory, len(names), captured)
+
+    def _walk_variant(self, segments, start):
+        """
+        Walk the filesystem for a single definition variant.
+
+        :param segments:    The list of _Segment instances representing the variant
+        :param start:       Tuple (directory, segment index, captured values) to start walking from
+        :returns:           A generator yielding matching paths
+        """
+        last_index = len(segments) - 1
+        # each pending item is (directory, segment index, captured values):
+        pending = [start]
+        while pending:
+            if self._cancel_token:
+                self._cancel_token.check()
+            directory, index, captured = pending.pop()
+            segment = segments[index]
+
+            if segment.is_static:
+                path = os.path.join(directory, segment.name)
+                if index < last_index:
+                    # no need to list anything - listing the child directory
+                    # will fail if this path doesn't exist:
+                    pending.append((path, index + 1, captured))
+                else:
+                    try:
+                        stat_result = os.stat(path)
+                    except OSError:
+                        # path doesn't exist:
+                        continue
+                    self._entries[path] = _StatEntry(path, stat_result)
+                    yield path
+                continue
+
+            try:
+                entries = self._list_directory(directory)
+            except OSError:
+                # directory doesn't exist or can't be read:
+                continue
+            self._directories.add(directory)
+
+            child_dirs = []
+            for entry in entries:
+                values = segment.match(entry.name, captured)
+                if values is None:
+                    continue
+                if index == last_index:
+                    self._entries[entry.path] = entry
+                    yield entry.path
+                else:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        child_dirs.append((entry.path, index + 1, values))
+            # reverse so that directories are visited in listing order:
+            pending.extend(reversed(child_dirs))
+
+    def _list_directory(self, directory):
+        """
+        List a single directory.
+
+        :param directory:   The directory to list
+        :returns:           A list of os.DirEntry (or compatible) instances
+        """
+        return self._list_directory_fn(directory)
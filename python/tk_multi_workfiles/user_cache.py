@@ -13,13 +13,28 @@ Implementation of the user cache storing Shotgun user information
 """
 import os
 import sys
+import time
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 import sgtk
 
 from .util import Threaded
 
+# Increment whenever the format of the persistent store changes - existing stores will be ignored.
+_STORE_VERSION = 1
+
 class UserCache(Threaded):
     """
-    A cache of user information retrieved from Shotgun as needed
+    A cache of user information retrieved from Shotgun as needed.
+
+    If the 'user_cache_ttl' setting is greater than zero then the cache is also persisted to
+    disk so that it is shared across sessions.  Entries older than the TTL are still returned
+    but are refreshed from Shotgun in a background thread.
     """
     def __init__(self):
         """
@@ -29,11 +44,22 @@ class UserCache(Threaded):
         self._app = sgtk.platform.current_bundle()
         self._current_user = sgtk.util.get_current_user(self._app.sgtk)
 
+        # user details are stored as (details, time cached) tuples:
         self._user_details_by_login = {}
         self._user_details_by_id = {}
+        self._login_by_uid = {}
 
         self._sg_fields = ["id", "type", "email", "login", "name", "image"]
 
+        # persistent store - the settings are read when the cache is first used:
+        self._store_loaded = False
+        self._store_path = None
+        self._ttl = 0
+        self._max_size = 0
+        self._stale_ids = set()
+        self._stale_logins = set()
+        self._refresh_thread = None
+
     @property
     def current_user(self):
         """
@@ -76,30 +102,9 @@ class UserCache(Threaded):
 
         if users_to_fetch:
             # get user details from shotgun:
-            sg_users = []
-            try:
-                sg_users = self._app.shotgun.find("HumanUser", [["id", "in"] + list(users_to_fetch)], self._sg_fields)
-            except:
-                sg_users = []
-
-            # add found users to look-ups:
-            users_found = set()
-            for sg_user in sg_users:
-                user_id = sg_user.get("id")
-                if user_id not in users_to_fetch:
-                    continue
-                self._cache_user(sg_user["login"], user_id, sg_user)
-                users_found.add(user_id)
-
-                user_details[user_id] = sg_user
-
-            # and fill in any blanks so we don't bother searching again:
-            for user_id in users_to_fetch:
-                if user_id not in users_found:
-                    # store empty dictionary to differentiate from 'None'
-                    self._cache_user(None, user_id, {})
-                    user_details[user_id] = {}
+            user_details.update(self._fetch_users("id", users_to_fetch))
 
+        self._refresh_stale_users()
         return user_details
 
     def get_file_last_modified_user(self, path):
@@ -110,23 +115,99 @@ class UserCache(Threaded):
         :param path:    The path to find the last modified user for
         :returns:       A  Shotgun entity dictionary for the HumanUser that last modified the path
         """
+        if sys.platform == "win32":
+            # TODO: add windows support..
+            return None
 
-        login_name = None
+        try:
+            uid = os.stat(path).st_uid
+        except OSError:
+            return None
+        return self.get_user_details_for_uid(uid)
+
+    def get_file_last_modified_users(self, paths):
+        """
+        Get the user details of the last person to modify each of the specified files.  Note,
+        this currently doesn't work on Windows as Windows doesn't provide this information as
+        standard
+
+        :param paths:   The list of paths to find the last modified users for
+        :returns:       A dictionary of path->Shotgun entity dictionary for the HumanUser that
+                        last modified the path, or None if the user can't be determined
+        """
         if sys.platform == "win32":
             # TODO: add windows support..
-            pass
-        else:
+            return dict([(path, None) for path in paths])
+
+        uids_by_path = {}
+        for path in paths:
             try:
-                from pwd import getpwuid
-                login_name = getpwuid(os.stat(path).st_uid).pw_name
-            except:
-                pass
+                uids_by_path[path] = os.stat(path).st_uid
+            except OSError:
+                uids_by_path[path] = None
+        users_by_uid = self.get_user_details_for_uids(uids_by_path.values())
+        return dict([(path, users_by_uid.get(uid)) for path, uid in uids_by_path.iteritems()])
+
+    def get_user_details_for_uid(self, uid):
+        """
+        Get the user details for the specified file owner uid, as found in the st_uid member
+        of a stat result.  Note, this currently doesn't work on Windows as Windows doesn't
+        provide this information as standard
+
+        :param uid: The uid of the file owner
+        :returns:   A Shotgun entity dictionary for the HumanUser with the login matching the
+                    uid or None if the user can't be determined
+        """
+        return self.get_user_details_for_uids([uid]).get(uid)
+
+    def get_user_details_for_uids(self, uids):
+        """
+        Get the user details for all of the specified file owner uids.  The uids are resolved
+        to logins and any logins that haven't been looked up before are found using a single
+        Shotgun query.  Note, this currently doesn't work on Windows as Windows doesn't provide
+        this information as standard
+
+        :param uids:    The uids of the file owners
+        :returns:       A dictionary of uid->Shotgun entity dictionary for the HumanUser with the
+                        login matching the uid, or None if the user can't be determined
+        """
+        uids = set(uids)
+        uids.discard(None)
+        if not uids or sys.platform == "win32":
+            # TODO: add windows support..
+            return {}
+
+        logins_by_uid = dict([(uid, self._get_login_for_uid(uid)) for uid in uids])
+        users_by_login = self._get_user_details_for_logins(
+            set([login for login in logins_by_uid.values() if login])
+        )
 
-        if login_name:
-            sg_user = self._get_user_details_for_login(login_name)
-            return sg_user
+        user_details = {}
+        for uid, login in logins_by_uid.iteritems():
+            # missing users are cached as empty dictionaries:
+            user_details[uid] = users_by_login.get(login) or None
+        return user_details
 
-        return None
+    def _get_login_for_uid(self, uid):
+        """
+        Get the login name for the specified uid, using the cached value if there is one
+
+        :param uid: The uid to find the login name for
+        :returns:   The login name or None if it can't be determined
+        """
+        login_name = self._get_cached_login_for_uid(uid)
+        if login_name is not None:
+            return login_name or None
+
+        login_name = ""
+        try:
+            from pwd import getpwuid
+            login_name = getpwuid(uid).pw_name
+        except:
+            pass
+        # cache the login, using an empty string if it couldn't be found:
+        self._cache_login_for_uid(uid, login_name)
+        return login_name or None
 
     def _get_user_details_for_login(self, login_name):
         """
@@ -135,22 +216,139 @@ class UserCache(Threaded):
         :param login_name:  The login name of the user to find
         :returns:           A Shotgun entity dictionary for the HumanUser entity found
         """
-        # first look to see if we've already found the user:
-        sg_user = self._get_user_for_login(login_name)
-        if not sg_user:
+        return self._get_user_details_for_logins([login_name]).get(login_name)
+
+    def _get_user_details_for_logins(self, login_names):
+        """
+        Get the shotgun HumanUser entries for the specified login names.  All login names that
+        haven't been looked up before are found with a single Shotgun query.
+
+        :param login_names: The login names of the users to find
+        :returns:           A dictionary of login->Shotgun entity dictionary for the HumanUser
+                            entity found.  An empty dictionary is returned for users that
+                            couldn't be found.
+        """
+        # first look to see if we've already found the users:
+        user_details = {}
+        logins_to_fetch = set()
+        for login_name in login_names:
+            sg_user = self._get_user_for_login(login_name)
+            if sg_user is None:
+                logins_to_fetch.add(login_name)
+            else:
+                user_details[login_name] = sg_user
+
+        if logins_to_fetch:
             # have to do a Shotgun lookup:
+            user_details.update(self._fetch_users("login", logins_to_fetch))
+
+        self._refresh_stale_users()
+        return user_details
+
+    def _fetch_users(self, field, values):
+        """
+        Find the users whose 'id' or 'login' field matches one of the specified values using a
+        single Shotgun query and add them to the cache.  Users that can't be found are cached as
+        empty dictionaries so that they aren't searched for again.
+
+        :param field:   The HumanUser field to match - either "id" or "login"
+        :param values:  The set of values to find users for
+        :returns:       A dictionary of value->Shotgun entity dictionary for the HumanUser entity
+                        found.  An empty dictionary is returned for users that couldn't be found.
+        """
+        try:
+            sg_users = self._app.shotgun.find("HumanUser", [[field, "in"] + list(values)], self._sg_fields)
+        except Exception, e:
+            # this isn't critical so just log as debug
+            self._app.log_debug("Failed to retrieve Shotgun users for %s %s: %s" % (field, sorted(values), e))
+            # don't cache anything so that the users are looked up again next time:
+            return dict([(value, {}) for value in values])
+
+        # add found users to look-ups:
+        user_details = {}
+        for sg_user in sg_users:
+            value = sg_user.get(field)
+            if value not in values:
+                continue
+            self._cache_user(sg_user.get("login"), sg_user.get("id"), sg_user)
+            user_details[value] = sg_user
+
+        # and fill in any blanks so we don't bother searching again:
+        for value in values:
+            if value not in user_details:
+                # store empty dictionary to differentiate from 'None'
+                if field == "id":
+                    self._cache_user(None, value, {})
+                else:
+                    self._cache_user(value, None, {})
+                user_details[value] = {}
+
+        self._save_store()
+        return user_details
+
+    @Threaded.exclusive
+    def _refresh_stale_users(self):
+        """
+        Start a background thread to refresh any stale users found in the cache, unless one is
+        already running.
+        """
+        if self._refresh_thread or not (self._stale_ids or self._stale_logins):
+            return
+        self._refresh_thread = threading.Thread(target=self._refresh_thread_run, name="UserCacheRefresh")
+        self._refresh_thread.daemon = True
+        self._refresh_thread.start()
+
+    def _refresh_thread_run(self):
+        """
+        Background thread that refreshes stale users from Shotgun until there are none left.
+        """
+        while True:
+            stale_ids, stale_logins = self._take_stale_users()
+            if not stale_ids and not stale_logins:
+                break
             try:
-                sg_user = self._app.shotgun.find_one("HumanUser", [["login", "is", login_name]], self._sg_fields)
-                # handle sg_user being None
-                sg_user = sg_user or {}
+                if stale_ids:
+                    self._fetch_users("id", stale_ids)
+                if stale_logins:
+                    self._fetch_users("login", stale_logins)
             except Exception, e:
                 # this isn't critical so just log as debug
-                self._app.log_debug("Failed to retrieve Shotgun user for login '%s': %s" % (login_name, e))
+                self._app.log_debug("Failed to refresh stale users: %s" % e)
 
-            # cache the sg user so we don't have to look for it again
-            self._cache_user(login_name, sg_user.get("id"), sg_user)
+    @Threaded.exclusive
+    def _take_stale_users(self):
+        """
+        Take the stale users to refresh, clearing the refresh thread if there are none left so
+        that a new thread is started for any users that become stale later.
+
+        :returns:   Tuple (set of stale user ids, set of stale logins)
+        """
+        stale_ids, stale_logins = self._stale_ids, self._stale_logins
+        self._stale_ids, self._stale_logins = set(), set()
+        if not stale_ids and not stale_logins:
+            self._refresh_thread = None
+        return (stale_ids, stale_logins)
 
-        return sg_user
+    @Threaded.exclusive
+    def _get_cached_login_for_uid(self, uid):
+        """
+        Thread-safe mechanism to get the cached login for the specified uid
+
+        :param uid: The uid to find the login for
+        :returns:   The login name, an empty string if the uid couldn't be resolved previously
+                    or None if the uid hasn't been looked up before
+        """
+        return self._login_by_uid.get(uid)
+
+    @Threaded.exclusive
+    def _cache_login_for_uid(self, uid, login_name):
+        """
+        Thread-safe mechanism to add the login for the specified uid to the cache
+
+        :param uid:         The uid to add
+        :param login_name:  The login name for the uid or an empty string if it couldn't be found
+        """
+        self._login_by_uid[uid] = login_name
 
     @Threaded.exclusive
     def _get_user_for_id(self, user_id):
@@ -161,7 +359,8 @@ class UserCache(Threaded):
         :returns:       A Shotgun entity dictionary representing the user if found in the 
                         cache, otherwise None
         """
-        return self._user_details_by_id.get(user_id)
+        self._load_store()
+        return self._get_cached(self._user_details_by_id, user_id, self._stale_ids)
 
     @Threaded.exclusive
     def _get_user_for_login(self, login):
@@ -172,7 +371,27 @@ class UserCache(Threaded):
         :returns:       A Shotgun entity dictionary representing the user if found in the 
                         cache, otherwise None
         """
-        return self._user_details_by_login.get(login)
+        self._load_store()
+        return self._get_cached(self._user_details_by_login, login, self._stale_logins)
+
+    def _get_cached(self, user_details, key, stale_keys):
+        """
+        Get a user from one of the cache look-ups, adding the key to the set of stale keys if
+        the entry is older than the TTL.  Must be called with the lock held.
+
+        :param user_details:    The look-up to get the user from
+        :param key:             The id or login of the user to get
+        :param stale_keys:      The set of stale keys to add the key to if the entry is stale
+        :returns:               A Shotgun entity dictionary representing the user if found in
+                                the cache, otherwise None
+        """
+        entry = user_details.get(key)
+        if entry is None:
+            return None
+        details, cached_at = entry
+        if self._ttl and time.time() - cached_at > self._ttl:
+            stale_keys.add(key)
+        return details
 
     @Threaded.exclusive
     def _cache_user(self, login, user_id, details):
@@ -183,10 +402,89 @@ class UserCache(Threaded):
         :param user_id: Id of the user to add
         :param details: Shotgun entity dictionary containing the details of the user to add
         """
+        now = time.time()
         if login != None:
-            self._user_details_by_login[login] = details
+            self._user_details_by_login[login] = (details, now)
         if user_id != None:
-            self._user_details_by_id[user_id] = details
+            self._user_details_by_id[user_id] = (details, now)
+
+    def _load_store(self):
+        """
+        Load the persistent store the first time the cache is used if it's enabled in the app
+        settings.  Must be called with the lock held.
+        """
+        if self._store_loaded:
+            return
+        self._store_loaded = True
+
+        self._ttl = max(self._app.get_setting("user_cache_ttl", 0) or 0, 0) * 3600
+        if not self._ttl:
+            # persistent store isn't enabled:
+            return
+        self._max_size = self._app.get_setting("user_cache_max_size", 0) or 0
+        cache_location = getattr(self._app, "site_cache_location", None) or self._app.cache_location
+        self._store_path = os.path.join(cache_location, "user_cache.pickle")
+
+        by_id, by_login = self._read_store()
+        # entries already in memory are at least as recent as those stored:
+        by_id.update(self._user_details_by_id)
+        by_login.update(self._user_details_by_login)
+        self._user_details_by_id, self._user_details_by_login = by_id, by_login
+
+    def _read_store(self):
+        """
+        :returns:   Tuple (users by id, users by login) read from the persistent store.  Both are
+                    empty if the store doesn't exist or can't be read.
+        """
+        try:
+            with open(self._store_path, "rb") as store_file:
+                store = pickle.load(store_file)
+            if store.get("version") == _STORE_VERSION:
+                return (store["users_by_id"], store["users_by_login"])
+        except IOError:
+            # store doesn't exist yet
+            pass
+        except Exception, e:
+            self._app.log_debug("Failed to read the user cache from '%s': %s" % (self._store_path, e))
+        return ({}, {})
+
+    @Threaded.exclusive
+    def _save_store(self):
+        """
+        Save the cache to the persistent store if it's enabled.  The cache is merged with the
+        current contents of the store so that users cached by other sessions aren't lost and
+        only the most recently cached users are kept if the store exceeds the maximum size.
+        """
+        if not self._store_path:
+            return
+
+        by_id, by_login = self._read_store()
+        for stored, cached in ((by_id, self._user_details_by_id), (by_login, self._user_details_by_login)):
+            for key, entry in cached.iteritems():
+                if key not in stored or stored[key][1] < entry[1]:
+                    stored[key] = entry
+            if self._max_size and len(stored) > self._max_size:
+                oldest = sorted(stored.iteritems(), key=lambda item: item[1][1])
+                for key, _ in oldest[:len(stored) - self._max_size]:
+                    del stored[key]
+
+        # write to a temporary file first so that the store is replaced atomically:
+        tmp_path = "%s.%d.tmp" % (self._store_path, os.getpid())
+        try:
+            store_dir = os.path.dirname(self._store_path)
+            if not os.path.exists(store_dir):
+                os.makedirs(store_dir)
+            with open(tmp_path, "wb") as store_file:
+                pickle.dump(
+                    {"version":_STORE_VERSION, "users_by_id":by_id, "users_by_login":by_login},
+                    store_file, 2
+                )
+            if sys.platform == "win32" and os.path.exists(self._store_path):
+                # rename doesn't replace existing files on Windows
+                os.remove(self._store_path)
+            os.rename(tmp_path, self._store_path)
+        except Exception, e:
+            self._app.log_debug("Failed to save the user cache to '%s': %s" % (self._store_path, e))
 
 # single global instance of the user cache
 g_user_cache = UserCache()
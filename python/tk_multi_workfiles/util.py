@@ -59,6 +59,62 @@ class Threaded(object):
 
         return wrapper
 
+class FrozenDict(dict):
+    """
+    Immutable dictionary used for records that are shared between searches, users and FileItems
+    rather than being copied.  As the contents can't change, copying returns the same instance.
+    Use dict(frozen_dict) to get a mutable copy.
+    """
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        """
+        Raise an error for any method that would modify the dictionary
+        """
+        raise TypeError("'%s' object can't be modified - use dict() to create a mutable copy"
+                        % type(self).__name__)
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+def freeze_value(value):
+    """
+    Convert a value into an immutable equivalent that can be shared safely.  Dictionaries are
+    converted to FrozenDicts and lists to tuples, recursively.
+
+    :param value:   The value to freeze
+    :returns:       The immutable value
+    """
+    if isinstance(value, FrozenDict):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict([(k, freeze_value(v)) for k, v in value.iteritems()])
+    if isinstance(value, (list, tuple)):
+        return tuple([freeze_value(v) for v in value])
+    return value
+
+def thaw_value(value):
+    """
+    Convert a value frozen with freeze_value() into a mutable copy.  FrozenDicts are converted to
+    dictionaries and tuples to lists, recursively.
+
+    :param value:   The value to thaw
+    :returns:       The mutable copy of the value
+    """
+    if isinstance(value, dict):
+        return dict([(k, thaw_value(v)) for k, v in value.iteritems()])
+    if isinstance(value, tuple):
+        return [thaw_value(v) for v in value]
+    return value
+
 def value_to_str(value):
     """
     Safely convert the value to a string - handles QtCore.QString if usign PyQt
@@ -0,0 +1,349 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Watcher that reports changes to the directories behind the work areas shown in the file model.
+On Linux this uses inotify, otherwise it falls back to polling the directory modified times.
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+
+import sgtk
+from sgtk.platform.qt import QtCore
+
+from .util import Threaded
+
+# inotify constants (see sys/inotify.h):
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ONLYDIR = 0x01000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_IN_WATCH_MASK = (_IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE
+                  | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class _PollingBackend(object):
+    """
+    Backend that detects changes by polling the modified time of each watched directory.
+    """
+    def __init__(self, poll_interval):
+        """
+        Construction
+
+        :param poll_interval:   The number of seconds between each poll
+        """
+        self._poll_interval = poll_interval
+        self._mtimes = {}
+
+    def update_directories(self, directories):
+        """
+        Update the directories being watched.
+
+        :param directories: The set of directories to watch
+        """
+        for directory in set(self._mtimes) - directories:
+            del self._mtimes[directory]
+        for directory in directories - set(self._mtimes):
+            self._mtimes[directory] = self._get_mtime(directory)
+
+    def wait(self, timeout):
+        """
+        Wait for changes to the watched directories.
+
+        :param timeout: The maximum number of seconds to wait
+        :returns:       A set of directories that have changed
+        """
+        time.sleep(max(timeout, self._poll_interval))
+        changed = set()
+        for directory, mtime in self._mtimes.items():
+            new_mtime = self._get_mtime(directory)
+            if new_mtime != mtime:
+                self._mtimes[directory] = new_mtime
+                changed.add(directory)
+        return changed
+
+    def close(self):
+        """
+        Release any resources held by the backend.
+        """
+        self._mtimes = {}
+
+    def _get_mtime(self, directory):
+        """
+        :param directory:   The directory to get the modified time for
+        :returns:           The modified time of the directory or None if it doesn't exist
+        """
+        try:
+            return os.stat(directory).st_mtime
+        except OSError:
+            return None
+
+
+class _InotifyBackend(object):
+    """
+    Backend that uses the Linux inotify API (via ctypes) to detect changes.
+    """
+    def __init__(self):
+        """
+        Construction
+
+        :raises OSError:    If inotify isn't available
+        """
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        for func_name in ("inotify_init1", "inotify_add_watch", "inotify_rm_watch"):
+            if not hasattr(libc, func_name):
+                raise OSError(errno.ENOSYS, "inotify is not supported")
+        self._inotify_add_watch = libc.inotify_add_watch
+        self._inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._inotify_rm_watch = libc.inotify_rm_watch
+        self._inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        # {directory:watch descriptor} and {watch descriptor:directory}:
+        self._watches = {}
+        self._directories = {}
+        # directories that couldn't be watched (e.g. they don't exist yet):
+        self._missing = set()
+
+    def update_directories(self, directories):
+        """
+        Update the directories being watched.
+
+        :param directories: The set of directories to watch
+        """
+        for directory in set(self._watches) - directories:
+            wd = self._watches.pop(directory)
+            self._directories.pop(wd, None)
+            self._inotify_rm_watch(self._fd, wd)
+        self._missing &= directories
+        for directory in directories - set(self._watches):
+            self._add_watch(directory)
+
+    def wait(self, timeout):
+        """
+        Wait for changes to the watched directories.
+
+        :param timeout: The maximum number of seconds to wait
+        :returns:       A set of directories that have changed
+        """
+        changed = set()
+        # directories that didn't exist previously are reported once they appear:
+        for directory in list(self._missing):
+            if self._add_watch(directory):
+                changed.add(directory)
+
+        try:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+        except (select.error, OSError):
+            return changed
+        if not readable:
+            return changed
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError:
+            return changed
+
+        offset = 0
+        while offset + _INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, name_len = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size + name_len
+            if mask & _IN_Q_OVERFLOW:
+                # events were lost so treat all directories as changed:
+                changed.update(self._watches)
+                continue
+            directory = self._directories.get(wd)
+            if not directory:
+                continue
+            changed.add(directory)
+            if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+                # the watch is no longer valid:
+                self._inotify_rm_watch(self._fd, wd)
+                del self._directories[wd]
+                del self._watches[directory]
+                self._missing.add(directory)
+        return changed
+
+    def close(self):
+        """
+        Release any resources held by the backend.
+        """
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._watches = {}
+        self._directories = {}
+        self._missing = set()
+
+    def _add_watch(self, directory):
+        """
+        :param directory:   The directory to add a watch for
+        :returns:           True if the watch was added, otherwise False
+        """
+        path = directory.encode(sys.getfilesystemencoding()) if not isinstance(directory, bytes) else directory
+        wd = self._inotify_add_watch(self._fd, path, _IN_WATCH_MASK)
+        if wd < 0:
+            self._missing.add(directory)
+            return False
+        self._missing.discard(directory)
+        self._watches[directory] = wd
+        self._directories[wd] = directory
+        return True
+
+
+class WorkAreaWatcher(QtCore.QObject, Threaded):
+    """
+    Watches a set of directories in a background thread and emits directories_changed in the
+    main thread once changes have settled.
+    """
+    # Signal emitted with the list of directories that have changed.
+    directories_changed = QtCore.Signal(list)
+
+    # interval used to deliver changes to the main thread and the time changes have to
+    # settle for before they are delivered:
+    _DELIVERY_INTERVAL_MS = 250
+    _SETTLE_TIME = 0.3
+    # poll interval used when inotify isn't available:
+    _POLL_INTERVAL = 1.0
+
+    def __init__(self, parent=None):
+        """
+        Construction
+
+        :param parent:  The parent QObject for this instance
+        """
+        QtCore.QObject.__init__(self, parent)
+        Threaded.__init__(self)
+        self._app = sgtk.platform.current_bundle()
+
+        self._directories = set()
+        self._directories_updated = False
+        self._pending_changes = set()
+        self._last_change_time = 0
+        self._stop_event = threading.Event()
+
+        self._backend = None
+        if sys.platform.startswith("linux"):
+            try:
+                self._backend = _InotifyBackend()
+            except (OSError, AttributeError) as e:
+                self._app.log_debug("inotify is unavailable, polling work areas instead: %s" % e)
+        if not self._backend:
+            self._backend = _PollingBackend(WorkAreaWatcher._POLL_INTERVAL)
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+        self._delivery_timer = QtCore.QTimer(self)
+        self._delivery_timer.timeout.connect(self._deliver_changes)
+        self._delivery_timer.start(WorkAreaWatcher._DELIVERY_INTERVAL_MS)
+
+    def set_directories(self, directories):
+        """
+        Set the directories to watch, replacing any that were previously being watched.
+
+        :param directories: A list of directory paths to watch
+        """
+        self._set_directories(set(directories))
+
+    def shut_down(self):
+        """
+        Stop watching all directories and shut down the background thread.
+        """
+        self._delivery_timer.stop()
+        self._stop_event.set()
+        self._thread.join()
+        self._backend.close()
+
+    @Threaded.exclusive
+    def _set_directories(self, directories):
+        """
+        :param directories: The set of directories to watch
+        """
+        self._directories = directories
+        self._directories_updated = True
+        self._pending_changes &= directories
+
+    @Threaded.exclusive
+    def _get_updated_directories(self):
+        """
+        :returns:   The set of directories to watch if it has changed since it was last
+                    retrieved, otherwise None
+        """
+        if not self._directories_updated:
+            return None
+        self._directories_updated = False
+        return set(self._directories)
+
+    @Threaded.exclusive
+    def _add_changes(self, directories):
+        """
+        :param directories: A set of directories that have changed
+        """
+        # ignore changes for directories that have stopped being watched in the meantime:
+        directories &= self._directories
+        if directories:
+            self._pending_changes |= directories
+            self._last_change_time = time.time()
+
+    @Threaded.exclusive
+    def _take_settled_changes(self):
+        """
+        :returns:   The list of changed directories if changes have settled, otherwise an empty list
+        """
+        if not self._pending_changes or time.time() - self._last_change_time < WorkAreaWatcher._SETTLE_TIME:
+            return []
+        changes = list(self._pending_changes)
+        self._pending_changes = set()
+        return changes
+
+    def _run(self):
+        """
+        Background thread that waits for changes to the watched directories.
+        """
+        while not self._stop_event.is_set():
+            directories = self._get_updated_directories()
+            if directories is not None:
+                self._backend.update_directories(directories)
+            try:
+                changed = self._backend.wait(0.25)
+            except Exception as e:
+                self._app.log_debug("Failed to check work areas for changes: %s" % e)
+                self._stop_event.wait(WorkAreaWatcher._POLL_INTERVAL)
+                continue
+            if changed:
+                self._add_changes(changed)
+
+    def _deliver_changes(self):
+        """
+        Called in the main thread to emit any changes that have settled.
+        """
+        changes = self._take_settled_changes()
+        if changes:
+            self.directories_changed.emit(changes)
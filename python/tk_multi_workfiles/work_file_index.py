@@ -0,0 +1,390 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Persistent on-disk index of work files found in work areas.  Directory listings are revalidated
+using the directory modified time so that only directories that have changed since the last
+search need to be listed again.
+"""
+import os
+import time
+import sqlite3
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import sgtk
+
+from .util import Threaded
+from .template_walker import list_directory, _scandir
+
+# Directory modified times are only trusted if the directory hadn't been modified for at least
+# this many seconds when it was listed.  This avoids missing changes made within the mtime
+# resolution of the filesystem.
+_MTIME_GRACE_PERIOD = 2.0
+
+# Increment whenever the schema changes - existing databases will be rebuilt.
+_SCHEMA_VERSION = 1
+
+
+def _dumps(value):
+    """
+    :param value:   The value to serialize
+    :returns:       A value that can be stored in a BLOB column
+    """
+    return sqlite3.Binary(pickle.dumps(value, 2))
+
+
+def _loads(blob):
+    """
+    :param blob:    A value retrieved from a BLOB column
+    :returns:       The deserialized value
+    """
+    return pickle.loads(bytes(blob))
+
+
+class _IndexedEntry(object):
+    """
+    os.DirEntry compatible representation of a directory entry retrieved from the index.
+    """
+    def __init__(self, directory, name, is_dir):
+        """
+        Construction
+
+        :param directory:   The directory containing the entry
+        :param name:        The name of the entry
+        :param is_dir:      True if the entry is a directory, False if not or None if unknown
+        """
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._is_dir = is_dir
+
+    def is_dir(self):
+        """
+        :returns:   True if the entry is a directory, otherwise False
+        """
+        if self._is_dir is None:
+            self._is_dir = os.path.isdir(self.path)
+        return self._is_dir
+
+    def stat(self):
+        """
+        :returns:   The os.stat result for the entry
+        """
+        return os.stat(self.path)
+
+
+class WorkFileRecord(object):
+    """
+    A single work file stored in the index.
+    """
+    __slots__ = ["path", "fields", "file_key", "version", "mtime", "uid"]
+
+    def __init__(self, path, fields, file_key, version, mtime, uid):
+        """
+        Construction
+
+        :param path:        The path of the work file
+        :param fields:      The template fields extracted from the path
+        :param file_key:    The unique file key built for the path
+        :param version:     The version of the work file
+        :param mtime:       The modified time of the work file
+        :param uid:         The uid of the owner of the work file
+        """
+        self.path = path
+        self.fields = fields
+        self.file_key = file_key
+        self.version = version
+        self.mtime = mtime
+        self.uid = uid
+
+
+class WorkFileIndexScan(Threaded):
+    """
+    The state of a single scan of a work area that uses the index.  This is used to list
+    directories via the index and to collect the records to write back to the index once the
+    found files have been processed.  When work files are found in batches, the scan is shared
+    by all batches and may be committed once per batch.
+    """
+    def __init__(self, index, signature):
+        """
+        Construction
+
+        :param index:       The WorkFileIndex this scan reads from and writes to
+        :param signature:   A string identifying the work template and settings used to
+                            build the records
+        """
+        Threaded.__init__(self)
+        self._index = index
+        self._signature = signature
+        # records for all files in directories that haven't changed:
+        self.records = {}
+        # directories that had to be listed again, {directory:(mtime, [(name, is_dir)])}
+        self._listed_directories = {}
+        self._new_records = []
+
+    def list_directory(self, directory):
+        """
+        List a directory, using the entries stored in the index if the directory hasn't been
+        modified since it was last listed.
+
+        :param directory:   The directory to list
+        :returns:           A list of os.DirEntry (or compatible) instances
+        :raises OSError:    If the directory can't be listed
+        """
+        dir_mtime = os.stat(directory).st_mtime
+
+        cached = self._index.get_directory(directory)
+        if cached and cached[0] == dir_mtime:
+            # directory hasn't changed since it was last listed:
+            self.records.update(self._index.get_records(self._signature, directory))
+            return [_IndexedEntry(directory, name, is_dir) for name, is_dir in cached[1]]
+
+        entries = list_directory(directory)
+        if time.time() - dir_mtime < _MTIME_GRACE_PERIOD:
+            # directory was modified very recently so the modified time can't be trusted:
+            dir_mtime = -1
+        # only store the entry type if it can be determined without a stat:
+        self._add_listed_directory(
+            directory, dir_mtime, [(e.name, e.is_dir() if _scandir else None) for e in entries]
+        )
+        return entries
+
+    def get_record(self, path, mtime=None):
+        """
+        Get the record for a path if it is in the index and is still valid.
+
+        :param path:    The path to return the record for
+        :param mtime:   If specified, the record is only returned if it matches this modified time
+        :returns:       A WorkFileRecord or None if there isn't a valid record for the path
+        """
+        record = self.records.get(path)
+        if record and mtime is not None and record.mtime != mtime:
+            return None
+        return record
+
+    @Threaded.exclusive
+    def add_record(self, path, fields, file_key, version, mtime, uid):
+        """
+        Add a record to be written to the index when the scan is committed.
+
+        :param path:        The path of the work file
+        :param fields:      The template fields extracted from the path
+        :param file_key:    The unique file key built for the path
+        :param version:     The version of the work file
+        :param mtime:       The modified time of the work file
+        :param uid:         The uid of the owner of the work file
+        """
+        if path in self.records and self.records[path].mtime == mtime:
+            # nothing has changed:
+            return
+        self._new_records.append(WorkFileRecord(path, fields, file_key, version, mtime, uid))
+
+    @Threaded.exclusive
+    def commit(self):
+        """
+        Reconcile the index with the results of this scan so far.  The lock is held while the
+        index is updated so that commits from different batches are applied in order.
+        """
+        self._index.update(self._signature, self._listed_directories, self._new_records)
+        self._listed_directories = {}
+        self._new_records = []
+
+    @Threaded.exclusive
+    def _add_listed_directory(self, directory, mtime, entries):
+        """
+        :param directory:   The directory that was listed
+        :param mtime:       The modified time to store for the directory
+        :param entries:     The list of (name, is_dir) entries found in the directory
+        """
+        self._listed_directories[directory] = (mtime, entries)
+
+
+class WorkFileIndex(Threaded):
+    """
+    Persistent SQLite index of directory listings and work file records.
+    """
+
+    def __init__(self, db_path):
+        """
+        Construction
+
+        :param db_path: The path of the SQLite database file to use
+        """
+        Threaded.__init__(self)
+        self._app = sgtk.platform.current_bundle()
+        self._db_path = db_path
+        self._connection = None
+
+    def begin_scan(self, signature):
+        """
+        Begin a new scan of a work area.
+
+        :param signature:   A string identifying the work template and settings used to build
+                            the records
+        :returns:           A WorkFileIndexScan instance
+        """
+        return WorkFileIndexScan(self, signature)
+
+    @Threaded.exclusive
+    def get_directory(self, directory):
+        """
+        Get the stored listing for a directory.
+
+        :param directory:   The directory to return the listing for
+        :returns:           Tuple (mtime, [(name, is_dir)]) or None if the directory isn't in
+                            the index
+        """
+        try:
+            row = self._get_connection().execute(
+                "SELECT mtime, entries FROM directories WHERE path = ?", (directory,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._app.log_debug("Failed to read work file index: %s" % e)
+            return None
+        if not row:
+            return None
+        return (row[0], _loads(row[1]))
+
+    @Threaded.exclusive
+    def get_records(self, signature, directory):
+        """
+        Get all work file records stored for a directory.
+
+        :param signature:   The signature the records were stored with
+        :param directory:   The directory to return the records for
+        :returns:           A dictionary of {path:WorkFileRecord}
+        """
+        records = {}
+        try:
+            rows = self._get_connection().execute(
+                "SELECT path, fields, file_key, version, mtime, uid FROM work_files "
+                "WHERE signature = ? AND directory = ?", (signature, directory)
+            ).fetchall()
+        except sqlite3.Error as e:
+            self._app.log_debug("Failed to read work file index: %s" % e)
+            return records
+        for path, fields, file_key, version, mtime, uid in rows:
+            records[path] = WorkFileRecord(path, _loads(fields), _loads(file_key), version, mtime, uid)
+        return records
+
+    @Threaded.exclusive
+    def update(self, signature, listed_directories, records):
+        """
+        Update the index with new directory listings and work file records.  Any records for
+        paths in the listed directories that aren't in the list of records are removed.
+
+        :param signature:           The signature to store the records with
+        :param listed_directories:  A dictionary of {directory:(mtime, [(name, is_dir)])}
+        :param records:             A list of WorkFileRecord instances to store
+        """
+        if not listed_directories and not records:
+            return
+        try:
+            connection = self._get_connection()
+            with connection:
+                for directory, (mtime, entries) in listed_directories.iteritems():
+                    connection.execute(
+                        "INSERT OR REPLACE INTO directories (path, mtime, entries) VALUES (?, ?, ?)",
+                        (directory, mtime, _dumps(entries))
+                    )
+                    connection.execute(
+                        "DELETE FROM work_files WHERE signature = ? AND directory = ?",
+                        (signature, directory)
+                    )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO work_files "
+                    "(signature, path, directory, fields, file_key, version, mtime, uid) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(signature, r.path, os.path.dirname(r.path), _dumps(r.fields), _dumps(r.file_key),
+                      r.version, r.mtime, r.uid) for r in records]
+                )
+        except sqlite3.Error as e:
+            # the index is only an optimisation so this isn't critical:
+            self._app.log_debug("Failed to update work file index: %s" % e)
+
+    @Threaded.exclusive
+    def close(self):
+        """
+        Close the connection to the database.
+        """
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+    def _get_connection(self):
+        """
+        Get the connection to the database, creating the database if needed.  This should only
+        be called with the lock held.
+
+        :returns:   A sqlite3.Connection instance
+        """
+        if self._connection:
+            return self._connection
+
+        db_dir = os.path.dirname(self._db_path)
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        # the connection is shared between threads but access is serialized by the lock:
+        connection = sqlite3.connect(self._db_path, timeout=10, check_same_thread=False)
+        connection.text_factory = str
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != _SCHEMA_VERSION:
+            with connection:
+                connection.execute("DROP TABLE IF EXISTS directories")
+                connection.execute("DROP TABLE IF EXISTS work_files")
+                connection.execute(
+                    "CREATE TABLE directories (path TEXT PRIMARY KEY, mtime REAL, entries BLOB)"
+                )
+                connection.execute(
+                    "CREATE TABLE work_files (signature TEXT, path TEXT, directory TEXT, fields BLOB, "
+                    "file_key BLOB, version INTEGER, mtime REAL, uid INTEGER, PRIMARY KEY (signature, path))"
+                )
+                connection.execute(
+                    "CREATE INDEX work_files_directory ON work_files (signature, directory)"
+                )
+                connection.execute("PRAGMA user_version = %d" % _SCHEMA_VERSION)
+        self._connection = connection
+        return connection
+
+
+def build_index_signature(work_template, version_compare_ignore_fields):
+    """
+    Build the signature used to store records found with the specified template and settings.
+
+    :param work_template:                   The work template used to find the files
+    :param version_compare_ignore_fields:   The fields ignored when building file keys
+    :returns:                               A string signature
+    """
+    return "%s|%s|%s" % (work_template.root_path, work_template.definition,
+                         ",".join(sorted(version_compare_ignore_fields or [])))
+
+
+# single global instance of the index, created on demand:
+_g_work_file_index = None
+
+
+def get_work_file_index():
+    """
+    Get the global work file index if it is enabled in the app settings.
+
+    :returns:   The WorkFileIndex instance or None if the index isn't enabled
+    """
+    global _g_work_file_index
+    if _g_work_file_index is None:
+        app = sgtk.platform.current_bundle()
+        if not app.get_setting("use_work_file_index", False):
+            return None
+        cache_location = getattr(app, "site_cache_location", None) or app.cache_location
+        _g_work_file_index = WorkFileIndex(os.path.join(cache_location, "work_file_index.db"))
+    return _g_work_file_index
@@ -15,6 +15,7 @@ import sgtk
 from sgtk.platform.qt import QtCore
 
 from .util import report_non_destroyed_qobjects
+from .path_cache_sync import get_path_cache_sync_scheduler
 
 
 def dbg_info(func):
@@ -74,9 +75,14 @@ class WorkFiles(object):
         Constructor.
         """
         app = sgtk.platform.current_bundle()
-        app.log_debug("Synchronizing remote path cache...")
-        app.sgtk.synchronize_filesystem_structure()
-        app.log_debug("Path cache up to date!")
+        sync_scheduler = get_path_cache_sync_scheduler()
+        if sync_scheduler:
+            # sync in the background - the dialog will re-validate its searches if needed:
+            sync_scheduler.request_sync()
+        else:
+            app.log_debug("Synchronizing remote path cache...")
+            app.sgtk.synchronize_filesystem_structure()
+            app.log_debug("Path cache up to date!")
 
         # If the user wants to debug the dialog, show it modally and wrap it
         # with memory leak-detection code.
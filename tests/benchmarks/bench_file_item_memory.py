@@ -0,0 +1,121 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Measure the memory retained per FileItem for a typical search result - a work file for every
+version with a publish for every other one, all sharing the same entity, task and user.
+
+This needs the app to be loaded so run it from a Toolkit Python console where the app is
+available, e.g. from a 'tank shell':
+
+    >>> execfile("tests/benchmarks/bench_file_item_memory.py")
+"""
+
+import gc
+import sys
+import time
+from datetime import datetime
+
+import sgtk
+from tank_vendor.shotgun_api3 import sg_timezone
+
+# the number of FileItems to create:
+NUM_ITEMS = 50000
+
+
+def _get_app_module():
+    """
+    :returns:   The tk_multi_workfiles module of the running app
+    """
+    engine = sgtk.platform.current_engine()
+    if not engine:
+        raise RuntimeError("This benchmark needs to be run in a running Toolkit engine!")
+    for app in engine.apps.values():
+        if app.name == "tk-multi-workfiles2":
+            return app.import_module("tk_multi_workfiles")
+    raise RuntimeError("tk-multi-workfiles2 isn't loaded in the current engine!")
+
+
+def _deep_size(value, seen):
+    """
+    :param value:   The value to measure
+    :param seen:    Set of ids of the objects already measured - shared objects are only
+                    counted once
+    :returns:       The size in bytes of the value and everything it references
+    """
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.iteritems():
+            size += _deep_size(k, seen) + _deep_size(v, seen)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            size += _deep_size(v, seen)
+    if hasattr(value, "__dict__"):
+        size += _deep_size(value.__dict__, seen)
+    for cls in type(value).__mro__:
+        for slot in cls.__dict__.get("__slots__", ()):
+            if slot != "__weakref__" and hasattr(value, slot):
+                size += _deep_size(getattr(value, slot), seen)
+    return size
+
+
+def run():
+    """
+    Build the FileItems and print the memory retained by each of them.
+    """
+    tk_multi_workfiles = _get_app_module()
+    file_item = tk_multi_workfiles.file_item
+    FileItem = file_item.FileItem
+
+    user = {"type":"HumanUser", "id":1, "name":"Artist"}
+    entity = {"type":"Shot", "id":2, "name":"sh010"}
+    task = {"type":"Task", "id":3, "name":"Anim"}
+    keys = [(("name", "file%d" % (i // 10)),) for i in range(NUM_ITEMS)]
+
+    # values shared across the batch, as the file finder does:
+    frozen_values = {}
+    gc.collect()
+    start = time.time()
+    items = []
+    for i in range(NUM_ITEMS):
+        name = "file%d" % (i // 10)
+        version = i % 10
+        mtime = 1500000000.0 + i
+        work_details = {"name":name, "version":version, "entity":entity, "task":task,
+                        "description":None, "thumbnail":None, "modified_at":mtime,
+                        "modified_by":user}
+        item = FileItem(key=keys[i], is_work_file=True,
+                        work_path="/proj/shots/sh010/work/%s.v%03d.ma" % (name, version),
+                        work_details=file_item.pack_file_details(work_details, frozen_values))
+        if i % 2:
+            publish_details = {"name":name, "version":version, "entity":entity, "task":task,
+                               "publish_description":"Published", "thumbnail":None,
+                               "published_at":datetime.fromtimestamp(mtime, tz=sg_timezone.local),
+                               "published_by":user, "published_file_entity_id":i}
+            publish = FileItem(key=keys[i], is_published=True,
+                               publish_path="/proj/shots/sh010/publish/%s.v%03d.ma" % (name, version),
+                               publish_details=file_item.pack_file_details(publish_details,
+                                                                           frozen_values))
+            item.update_from_publish(publish)
+        items.append(item)
+    elapsed = time.time() - start
+
+    # don't count the values that are owned by the caller:
+    seen = set([id(v) for v in (user, entity, task, None, True, False, sg_timezone.local)])
+    seen.update([id(k) for k in keys])
+    retained = _deep_size(items, seen)
+    print "%d FileItems built in %.2fs, retaining %.0f bytes per item" % (
+        NUM_ITEMS, elapsed, retained / float(NUM_ITEMS))
+
+
+run()
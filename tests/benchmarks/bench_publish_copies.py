@@ -0,0 +1,110 @@
+# Copyright (c) 2015 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Compare the cost of protecting the published file model data by deep-copying it for every search
+(the previous behaviour) against freezing it once with freeze_value() and sharing the FrozenDicts
+between searches.
+
+This needs the app to be loaded so run it from a Toolkit Python console where the app is
+available, e.g. from a 'tank shell':
+
+    >>> execfile("tests/benchmarks/bench_publish_copies.py")
+"""
+
+import copy
+import sys
+import time
+
+import sgtk
+
+# the number of publishes in the model and the number of searches that use them, e.g. one per
+# user sandbox:
+NUM_PUBLISHES = 5000
+NUM_SEARCHES = 6
+
+
+def _get_app_module():
+    """
+    :returns:   The tk_multi_workfiles module of the running app
+    """
+    engine = sgtk.platform.current_engine()
+    if not engine:
+        raise RuntimeError("This benchmark needs to be run in a running Toolkit engine!")
+    for app in engine.apps.values():
+        if app.name == "tk-multi-workfiles2":
+            return app.import_module("tk_multi_workfiles")
+    raise RuntimeError("tk-multi-workfiles2 isn't loaded in the current engine!")
+
+
+def _make_publishes():
+    """
+    :returns:   A list of publish dictionaries as returned by the published file model
+    """
+    user = {"type":"HumanUser", "id":1, "name":"Artist"}
+    task = {"type":"Task", "id":3, "name":"Anim"}
+    return [{"type":"PublishedFile", "id":i, "name":"file%d" % i, "description":"Published",
+             "version_number":i % 10, "image":"https://example.com/thumbnail/%d" % i,
+             "created_at":1500000000 + i, "created_by":dict(user), "task":dict(task),
+             "path":{"local_path":"/proj/publish/file%d.ma" % i,
+                     "url":"file:///proj/publish/file%d.ma" % i, "name":"file%d.ma" % i}}
+            for i in range(NUM_PUBLISHES)]
+
+
+def _deep_size(value, seen):
+    """
+    :param value:   The value to measure
+    :param seen:    Set of ids of the objects already measured - shared objects are only
+                    counted once
+    :returns:       The size in bytes of the value and everything it references
+    """
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.iteritems():
+            size += _deep_size(k, seen) + _deep_size(v, seen)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            size += _deep_size(v, seen)
+    return size
+
+
+def _measure(label, fn):
+    """
+    Run fn on a fresh set of publishes and print the time it took and the memory retained by
+    the copies it returns, not counting anything shared with the original publishes.
+
+    :param label:   The label to print the results with
+    :param fn:      Callable taking the list of publishes and returning the copies
+    """
+    publishes = _make_publishes()
+    start = time.time()
+    copies = fn(publishes)
+    elapsed = time.time() - start
+    seen = set()
+    _deep_size(publishes, seen)
+    retained = _deep_size(copies, seen)
+    print "%-45s %.3fs, %.2f MB retained" % (label, elapsed, retained / (1024.0 * 1024.0))
+
+
+def run():
+    """
+    Run the comparison and print the results.
+    """
+    freeze_value = _get_app_module().util.freeze_value
+    _measure("deepcopy per search (%d searches):" % NUM_SEARCHES,
+             lambda publishes: [copy.deepcopy(publishes) for _ in range(NUM_SEARCHES)])
+    _measure("freeze_value once, shared by all searches:",
+             lambda publishes: [freeze_value(p) for p in publishes])
+
+
+run()